@@ -0,0 +1,58 @@
+"""composite (created_at, id) index for keyset pagination
+
+Revision ID: 002_message_cursor_index
+Revises: 001_add_emojis
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision: str = '002_message_cursor_index'
+down_revision: Union[str, None] = '001_add_emojis'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def table_exists(table_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def index_exists(table_name: str, index_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    indexes = [idx['name'] for idx in inspector.get_indexes(table_name)]
+    return index_name in indexes
+
+
+def upgrade() -> None:
+    #fresh database => create_all builds the table with the index
+    if not table_exists('messages'):
+        return
+    
+    if not index_exists('messages', 'ix_messages_created_at_id_desc'):
+        op.create_index(
+            'ix_messages_created_at_id_desc',
+            'messages',
+            [sa.text('created_at DESC'), sa.text('id DESC')]
+        )
+    
+    #the composite index covers everything the single column one was used for
+    if index_exists('messages', 'ix_messages_created_at_desc'):
+        op.drop_index('ix_messages_created_at_desc', 'messages')
+
+
+def downgrade() -> None:
+    if not table_exists('messages'):
+        return
+    
+    if not index_exists('messages', 'ix_messages_created_at_desc'):
+        op.create_index('ix_messages_created_at_desc', 'messages', [sa.text('created_at DESC')])
+    
+    if index_exists('messages', 'ix_messages_created_at_id_desc'):
+        op.drop_index('ix_messages_created_at_id_desc', 'messages')
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""full-text search column and GIN index on messages
+
+Revision ID: 003_message_search
+Revises: 002_message_cursor_index
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision: str = '003_message_search'
+down_revision: Union[str, None] = '002_message_cursor_index'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def column_exists(table_name: str, column_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    columns = [c['name'] for c in inspector.get_columns(table_name)]
+    return column_name in columns
+
+
+def table_exists(table_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def index_exists(table_name: str, index_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    indexes = [idx['name'] for idx in inspector.get_indexes(table_name)]
+    return index_name in indexes
+
+
+def upgrade() -> None:
+    #fresh database => create_all builds the table with the column
+    if not table_exists('messages'):
+        return
+    
+    #stored generated column => postgres keeps it current on every insert/update
+    if not column_exists('messages', 'search_vector'):
+        op.execute(
+            "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+            "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(content, ''))) STORED"
+        )
+    
+    if not index_exists('messages', 'ix_messages_search_vector'):
+        op.create_index(
+            'ix_messages_search_vector',
+            'messages',
+            ['search_vector'],
+            postgresql_using='gin'
+        )
+
+
+def downgrade() -> None:
+    if not table_exists('messages'):
+        return
+    
+    if index_exists('messages', 'ix_messages_search_vector'):
+        op.drop_index('ix_messages_search_vector', 'messages')
+    
+    if column_exists('messages', 'search_vector'):
+        op.drop_column('messages', 'search_vector')
\ No newline at end of file
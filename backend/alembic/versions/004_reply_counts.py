@@ -0,0 +1,74 @@
+"""reply counts and thread index on messages
+
+Revision ID: 004_reply_counts
+Revises: 003_message_search
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision: str = '004_reply_counts'
+down_revision: Union[str, None] = '003_message_search'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def column_exists(table_name: str, column_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    columns = [c['name'] for c in inspector.get_columns(table_name)]
+    return column_name in columns
+
+
+def table_exists(table_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def index_exists(table_name: str, index_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    indexes = [idx['name'] for idx in inspector.get_indexes(table_name)]
+    return index_name in indexes
+
+
+def upgrade() -> None:
+    #fresh database => create_all builds the table with the column
+    if not table_exists('messages'):
+        return
+    
+    if not column_exists('messages', 'reply_count'):
+        op.add_column(
+            'messages',
+            sa.Column('reply_count', sa.Integer(), nullable=False, server_default='0')
+        )
+        #one-off backfill, from here on the count is maintained by the app
+        op.execute(
+            "UPDATE messages SET reply_count = counts.replies "
+            "FROM (SELECT reply_to_id, count(*) AS replies FROM messages "
+            "WHERE reply_to_id IS NOT NULL GROUP BY reply_to_id) AS counts "
+            "WHERE messages.id = counts.reply_to_id"
+        )
+    
+    if not index_exists('messages', 'ix_messages_reply_to_created'):
+        op.create_index(
+            'ix_messages_reply_to_created',
+            'messages',
+            ['reply_to_id', 'created_at', 'id']
+        )
+
+
+def downgrade() -> None:
+    if not table_exists('messages'):
+        return
+    
+    if index_exists('messages', 'ix_messages_reply_to_created'):
+        op.drop_index('ix_messages_reply_to_created', 'messages')
+    
+    if column_exists('messages', 'reply_count'):
+        op.drop_column('messages', 'reply_count')
\ No newline at end of file
@@ -0,0 +1,59 @@
+"""reply preview snapshots on messages
+
+Revision ID: 005_reply_previews
+Revises: 004_reply_counts
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision: str = '005_reply_previews'
+down_revision: Union[str, None] = '004_reply_counts'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def column_exists(table_name: str, column_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    columns = [c['name'] for c in inspector.get_columns(table_name)]
+    return column_name in columns
+
+
+def table_exists(table_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade() -> None:
+    #fresh database => create_all builds the table with the column
+    if not table_exists('messages'):
+        return
+    
+    if not column_exists('messages', 'reply_preview'):
+        op.add_column('messages', sa.Column('reply_preview', sa.JSON(), nullable=True))
+        #snapshot the quote of every existing reply (200 = default reply_preview_length)
+        op.execute(
+            "UPDATE messages SET reply_preview = json_build_object("
+            "'id', parent.id, "
+            "'content', left(parent.content, 200), "
+            "'author_username', coalesce(author.username, 'Unknown'), "
+            "'attachment_only', coalesce(parent.content, '') = '' "
+            "AND coalesce(json_array_length(parent.attachments), 0) > 0, "
+            "'deleted', false) "
+            "FROM messages AS parent LEFT JOIN users AS author ON author.id = parent.author_id "
+            "WHERE messages.reply_to_id = parent.id"
+        )
+
+
+def downgrade() -> None:
+    if not table_exists('messages'):
+        return
+    
+    if column_exists('messages', 'reply_preview'):
+        op.drop_column('messages', 'reply_preview')
\ No newline at end of file
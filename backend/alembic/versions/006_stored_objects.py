@@ -0,0 +1,51 @@
+"""reference counted, content-addressed storage objects
+
+Revision ID: 006_stored_objects
+Revises: 005_reply_previews
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision: str = '006_stored_objects'
+down_revision: Union[str, None] = '005_reply_previews'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def table_exists(table_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade() -> None:
+    #objects stored before this revision get no row => their one attachment
+    #owns them and deleting it removes them as before
+    if not table_exists('stored_objects'):
+        op.create_table(
+            'stored_objects',
+            sa.Column('object_name', sa.String(255), primary_key=True),
+            sa.Column('sha256', sa.String(64), nullable=True),
+            sa.Column('size', sa.BigInteger(), nullable=False, server_default='0'),
+            sa.Column('content_type', sa.String(255), nullable=False),
+            sa.Column('ref_count', sa.Integer(), nullable=False, server_default='1'),
+            sa.Column('derived', sa.JSON(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+        )
+        op.create_index(
+            'ix_stored_objects_unreferenced',
+            'stored_objects',
+            ['object_name'],
+            postgresql_where=sa.text('ref_count <= 0')
+        )
+
+
+def downgrade() -> None:
+    if table_exists('stored_objects'):
+        op.drop_index('ix_stored_objects_unreferenced', 'stored_objects')
+        op.drop_table('stored_objects')
@@ -0,0 +1,50 @@
+"""background chat purges (/clear and retention)
+
+Revision ID: 007_chat_purges
+Revises: 006_stored_objects
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision: str = '007_chat_purges'
+down_revision: Union[str, None] = '006_stored_objects'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def table_exists(table_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade() -> None:
+    #fresh database => create_all builds the table (users has to exist for the FK)
+    if not table_exists('users'):
+        return
+    
+    if not table_exists('chat_purges'):
+        op.create_table(
+            'chat_purges',
+            sa.Column('id', sa.String(36), primary_key=True),
+            sa.Column('reason', sa.String(20), nullable=False),
+            sa.Column('before', sa.DateTime(timezone=True), nullable=False),
+            sa.Column('status', sa.String(20), nullable=False, server_default='running'),
+            sa.Column('deleted', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('created_by_id', sa.String(36), sa.ForeignKey('users.id', ondelete='SET NULL'), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index('ix_chat_purges_status', 'chat_purges', ['status'])
+
+
+def downgrade() -> None:
+    if table_exists('chat_purges'):
+        op.drop_index('ix_chat_purges_status', 'chat_purges')
+        op.drop_table('chat_purges')
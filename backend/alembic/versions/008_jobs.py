@@ -0,0 +1,50 @@
+"""durable background job queue
+
+Revision ID: 008_jobs
+Revises: 007_chat_purges
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision: str = '008_jobs'
+down_revision: Union[str, None] = '007_chat_purges'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def table_exists(table_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade() -> None:
+    if not table_exists('jobs'):
+        op.create_table(
+            'jobs',
+            sa.Column('id', sa.String(36), primary_key=True),
+            sa.Column('kind', sa.String(50), nullable=False),
+            sa.Column('payload', sa.JSON(), nullable=False),
+            sa.Column('idempotency_key', sa.String(255), nullable=True, unique=True),
+            sa.Column('status', sa.String(20), nullable=False, server_default='queued'),
+            sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('max_attempts', sa.Integer(), nullable=False),
+            sa.Column('run_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+            sa.Column('locked_until', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now()),
+            sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+            sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+        )
+        op.create_index('ix_jobs_status_run_at', 'jobs', ['status', 'run_at'])
+
+
+def downgrade() -> None:
+    if table_exists('jobs'):
+        op.drop_index('ix_jobs_status_run_at', 'jobs')
+        op.drop_table('jobs')
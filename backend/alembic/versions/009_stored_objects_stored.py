@@ -0,0 +1,46 @@
+"""explicit storage state of stored_objects rows
+
+Revision ID: 009_stored_objects_stored
+Revises: 008_jobs
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision: str = '009_stored_objects_stored'
+down_revision: Union[str, None] = '008_jobs'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def column_exists(table_name: str, column_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    columns = [c['name'] for c in inspector.get_columns(table_name)]
+    return column_name in columns
+
+
+def table_exists(table_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade() -> None:
+    if table_exists('stored_objects') and not column_exists('stored_objects', 'stored'):
+        #record() already ran for every row that exists now (zero-byte objects
+        #included) => they all start out stored, new rows don't
+        op.add_column(
+            'stored_objects',
+            sa.Column('stored', sa.Boolean(), nullable=False, server_default=sa.text('true'))
+        )
+        op.alter_column('stored_objects', 'stored', server_default=sa.text('false'))
+
+
+def downgrade() -> None:
+    if table_exists('stored_objects') and column_exists('stored_objects', 'stored'):
+        op.drop_column('stored_objects', 'stored')
@@ -0,0 +1,40 @@
+"""lease token on jobs
+
+Revision ID: 010_job_lease_token
+Revises: 009_stored_objects_stored
+Create Date: 2026-10-16
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import inspect
+
+revision: str = '010_job_lease_token'
+down_revision: Union[str, None] = '009_stored_objects_stored'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def column_exists(table_name: str, column_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    columns = [c['name'] for c in inspector.get_columns(table_name)]
+    return column_name in columns
+
+
+def table_exists(table_name: str) -> bool:
+    bind = op.get_bind()
+    inspector = inspect(bind)
+    return table_name in inspector.get_table_names()
+
+
+def upgrade() -> None:
+    if table_exists('jobs') and not column_exists('jobs', 'lease_token'):
+        op.add_column('jobs', sa.Column('lease_token', sa.String(32), nullable=True))
+
+
+def downgrade() -> None:
+    if table_exists('jobs') and column_exists('jobs', 'lease_token'):
+        op.drop_column('jobs', 'lease_token')
@@ -5,13 +5,16 @@ import bcrypt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, update, func, inspect as sa_inspect
+from sqlalchemy.exc import IntegrityError
 from config import get_settings
-from database import get_db
-from models import User
+from database import get_db, AsyncSessionLocal
+from models import User, generate_uuid
+import asyncio
 import secrets
 import string
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -54,6 +57,146 @@ def generate_guest_id() -> str:
     return f"guest_{random_part}"
 
 
+def decode_token(token: str) -> Optional[dict]:
+    try:
+        return jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError as e:
+        logger.debug(f"JWT decode error: {e}")
+        return None
+
+
+# ============ STATELESS GUESTS ============
+#guests only get a users row once they react, until then their
+#identity lives entirely in the signed token claims
+
+def new_guest(avatar: str = "default") -> User:
+    """build a guest identity without touching the database"""
+    return User(
+        id=generate_uuid(),
+        username=generate_guest_id(),
+        is_admin=False,
+        must_change_password=False,
+        avatar=avatar,
+        created_at=datetime.now(timezone.utc)
+    )
+
+
+def create_guest_token(user: User) -> str:
+    issued = user.created_at or datetime.now(timezone.utc)
+    return create_access_token(data={
+        "sub": str(user.id),
+        "guest": True,
+        "username": user.username,
+        "avatar": user.avatar or "default",
+        "iat": int(issued.timestamp())
+    })
+
+
+def guest_from_claims(payload: dict) -> Optional[User]:
+    """rebuild a stateless guest from its token (no DB round trip)"""
+    user_id = cast(Optional[str], payload.get("sub"))
+    if not payload.get("guest") or not user_id:
+        return None
+    
+    issued = payload.get("iat")
+    return User(
+        id=user_id,
+        username=payload.get("username") or generate_guest_id(),
+        is_admin=False,
+        must_change_password=False,
+        avatar=payload.get("avatar") or "default",
+        created_at=datetime.fromtimestamp(issued, timezone.utc) if issued else datetime.now(timezone.utc)
+    )
+
+
+def is_stateless_guest(user: User) -> bool:
+    return sa_inspect(user).transient
+
+
+async def materialize_guest(user: User, db: AsyncSession) -> User:
+    """make sure a users row exists, e.g. before a guest's first reaction"""
+    if not is_stateless_guest(user):
+        return user
+    
+    existing = await db.get(User, user.id)
+    if existing:
+        return existing
+    
+    db.add(user)
+    try:
+        await db.commit()
+    except IntegrityError:
+        #a concurrent request materialized the same guest first
+        await db.rollback()
+        existing = await db.get(User, user.id)
+        if not existing:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Could not create guest account")
+        return existing
+    
+    await db.refresh(user)
+    logger.info(f"Materialized guest {user.username}")
+    return user
+
+
+# ============ ACTIVITY ============
+#users.last_seen drives the guest purge => it has to move on activity, not
+#only when the row happens to be updated
+
+#user_id -> monotonic time of the last last_seen bump from this worker
+_last_seen_bumps: dict = {}
+_pending_bumps: set = set()
+
+
+async def _bump_last_seen(user_id: str):
+    try:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(User)
+                .where(User.id == user_id)
+                .values(last_seen=func.now())
+            )
+            await db.commit()
+    except Exception as e:
+        logger.warning(f"Failed to update last_seen of {user_id}: {e}")
+
+
+def note_activity(user_id: str):
+    """bump last_seen in the background, at most once per last_seen_update_seconds
+    
+    stateless guests without a row just update nothing
+    """
+    now = time.monotonic()
+    interval = settings.last_seen_update_seconds
+    if now - _last_seen_bumps.get(user_id, -interval) < interval:
+        return
+    _last_seen_bumps[user_id] = now
+    if len(_last_seen_bumps) > 10000:
+        #forget users whose throttle window has passed anyway
+        for stale in [uid for uid, bumped in _last_seen_bumps.items() if now - bumped >= interval]:
+            del _last_seen_bumps[stale]
+    
+    task = asyncio.create_task(_bump_last_seen(user_id))
+    _pending_bumps.add(task)
+    task.add_done_callback(_pending_bumps.discard)
+
+
+async def get_user_from_token(token: str, db: AsyncSession) -> Optional[User]:
+    payload = decode_token(token)
+    if not payload:
+        return None
+    
+    guest = guest_from_claims(payload)
+    if guest:
+        return guest
+    
+    user_id = cast(Optional[str], payload.get("sub"))
+    if not user_id:
+        return None
+    
+    result = await db.execute(select(User).where(User.id == user_id))
+    return result.scalar_one_or_none()
+
+
 async def get_current_user(
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security),
     db: AsyncSession = Depends(get_db)
@@ -61,21 +204,9 @@ async def get_current_user(
     if not credentials:
         return None
     
-    try:
-        payload = jwt.decode(
-            credentials.credentials, 
-            settings.secret_key, 
-            algorithms=[settings.algorithm]
-        )
-        user_id = cast(Optional[str], payload.get("sub"))
-        if not user_id:
-            return None
-    except JWTError as e:
-        logger.debug(f"JWT decode error: {e}")
-        return None
-    
-    result = await db.execute(select(User).where(User.id == user_id))
-    user = result.scalar_one_or_none()
+    user = await get_user_from_token(credentials.credentials, db)
+    if user:
+        note_activity(str(user.id))
     return user
 
 
@@ -129,6 +260,9 @@ async def get_or_create_guest(
         return user
     
     #create guest user
+    if settings.stateless_guests:
+        return new_guest()
+    
     guest_id = generate_guest_id()
     guest = User(
         username=guest_id,
@@ -138,4 +272,28 @@ async def get_or_create_guest(
     db.add(guest)
     await db.commit()
     await db.refresh(guest)
-    return guest
\ No newline at end of file
+    return guest
+
+# ============ UPLOAD TOKENS ============
+#proof that an upload session was issued to this user for this object =>
+#create_message only accepts objects the backend named itself. no "sub" claim,
+#so an upload token is never accepted as an access token
+
+def create_upload_token(user_id: str, object_name: str, filename: str, content_type: str, expires_seconds: int) -> str:
+    return create_access_token(
+        data={
+            "typ": "upload",
+            "uploader": str(user_id),
+            "object_name": object_name,
+            "filename": filename,
+            "content_type": content_type
+        },
+        expires_delta=timedelta(seconds=expires_seconds)
+    )
+
+
+def decode_upload_token(token: str, user_id: str) -> Optional[dict]:
+    payload = decode_token(token)
+    if not payload or payload.get("typ") != "upload" or payload.get("uploader") != str(user_id):
+        return None
+    return payload
\ No newline at end of file
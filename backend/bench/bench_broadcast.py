@@ -0,0 +1,114 @@
+"""cpu per broadcast vs connection count: per-socket send_json vs encode-once frames
+
+    cd backend && python bench/bench_broadcast.py [rounds]
+
+runs the real ConnectionManager against in-memory sockets (no network, no
+database). "per-socket json" replays what the old path did, send_json =>
+one json.dumps per connection. "encode-once" is manager.broadcast(), timed
+until every writer drained its queue
+"""
+from datetime import datetime, timezone
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from websocket_manager import ConnectionManager
+
+CONNECTIONS = (10, 100, 1000)
+
+
+class FakeSocket:
+    """just enough of starlette's WebSocket for the manager"""
+    
+    def __init__(self):
+        self.frames = 0
+    
+    async def accept(self):
+        pass
+    
+    async def send_text(self, text: str):
+        self.frames += 1
+    
+    async def send_json(self, data):
+        #what starlette does
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+    
+    async def close(self, code: int = 1000):
+        pass
+
+
+def new_message_event() -> dict:
+    """a new_message broadcast with one image and 50 reactions"""
+    return {
+        "type": "new_message",
+        "data": {
+            "id": "5b0c6f0e-4f7e-4b6a-9a43-2f3c1d1e0a01",
+            "content": "a message with some text in it ✓" * 4,
+            "author_id": "a1b2c3d4-0000-4000-8000-000000000001",
+            "author_username": "alice",
+            "author_avatar": "cat",
+            "is_admin": True,
+            "is_pinned": False,
+            "attachments": [{
+                "type": "image",
+                "url": "http://storage/chat/images/abc.jpg",
+                "name": "photo.jpg",
+                "size": 204800,
+                "width": 1600,
+                "height": 1200,
+                "placeholder": "LEHV6nWB2yk8pyo0adR*.7kCMdnj"
+            }],
+            "reactions": [
+                {"emoji": f"e{i}", "count": 3, "users": ["alice", "bob", "carol"], "user_avatars": ["cat", "dog", "default"]}
+                for i in range(50)
+            ],
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "reply_to": None,
+            "reply_count": 0
+        }
+    }
+
+
+async def drained(manager: ConnectionManager):
+    while any(conn.queue for conn in manager._connections.values()):
+        await asyncio.sleep(0)
+
+
+async def run(connections: int, rounds: int) -> tuple:
+    manager = ConnectionManager()
+    sockets = [FakeSocket() for _ in range(connections)]
+    for i, socket in enumerate(sockets):
+        connection_id = await manager.connect(socket, f"user-{i}", {"username": f"user{i}"})
+        await manager.start_session(connection_id, {"type": "connected", "data": {}})
+    await drained(manager)
+    event = new_message_event()
+    
+    started = time.process_time()
+    for _ in range(rounds):
+        for socket in sockets:
+            await socket.send_json(event)
+    per_socket = (time.process_time() - started) / rounds
+    
+    started = time.process_time()
+    for _ in range(rounds):
+        await manager.broadcast(event)
+        await drained(manager)
+    encode_once = (time.process_time() - started) / rounds
+    
+    await manager.close_all()
+    return per_socket, encode_once
+
+
+async def main(rounds: int):
+    print(f"{'connections':>12} {'per-socket json':>16} {'encode-once':>12}")
+    for connections in CONNECTIONS:
+        per_socket, encode_once = await run(connections, rounds)
+        print(f"{connections:>12} {per_socket * 1000:>13.3f} ms {encode_once * 1000:>9.3f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
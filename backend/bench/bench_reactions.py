@@ -0,0 +1,155 @@
+"""reaction summaries on a seeded database: per-row ORM objects vs SQL aggregation
+
+    cd backend && python bench/bench_reactions.py seed [--messages 50] [--reactions 2000]
+    cd backend && python bench/bench_reactions.py run [--rounds 20]
+    cd backend && python bench/bench_reactions.py cleanup
+
+uses DATABASE_URL like the app => point it at a scratch database. seeded rows
+are bench_* users and their messages, `cleanup` removes them again.
+
+"orm" is the old read path: selectinload every Reaction with its User and
+CustomEmoji and aggregate in python. "sql" is load_reaction_summaries from
+main.py, one GROUP BY for the whole page
+"""
+from datetime import datetime, timedelta, timezone
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import select, delete, insert
+from sqlalchemy.orm import selectinload
+from database import AsyncSessionLocal
+from models import User, Message, Reaction, generate_uuid
+from main import load_reaction_summaries
+
+EMOJIS = ["👍", "❤️", "😂", "🎉", "🔥", "👀", "🙏", "💯"]
+BENCH_CONTENT = "bench reaction message"
+
+
+async def seed(messages: int, reactions: int):
+    #every user reacts with every emoji => enough users for the reactions per message
+    user_count = -(-reactions // len(EMOJIS))
+    users = [
+        {"id": generate_uuid(), "username": f"bench_{i}", "avatar": "default", "is_admin": False}
+        for i in range(user_count)
+    ]
+    start = datetime.now(timezone.utc) - timedelta(days=1)
+    message_rows = [
+        {
+            "id": generate_uuid(),
+            "content": BENCH_CONTENT,
+            "author_id": users[0]["id"],
+            "created_at": start + timedelta(seconds=i)
+        }
+        for i in range(messages)
+    ]
+    async with AsyncSessionLocal() as db:
+        await db.execute(insert(User), users)
+        await db.execute(insert(Message), message_rows)
+        for message in message_rows:
+            batch = [
+                {
+                    "id": generate_uuid(),
+                    "message_id": message["id"],
+                    "user_id": users[i // len(EMOJIS)]["id"],
+                    "emoji": EMOJIS[i % len(EMOJIS)],
+                    "created_at": start + timedelta(milliseconds=i)
+                }
+                for i in range(reactions)
+            ]
+            await db.execute(insert(Reaction), batch)
+        await db.commit()
+    print(f"seeded {messages} messages x {reactions} reactions from {user_count} users")
+
+
+async def bench_message_ids() -> list:
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Message.id).where(Message.content == BENCH_CONTENT).order_by(Message.created_at)
+        )
+        return list(result.scalars().all())
+
+
+async def orm_summaries(message_ids: list) -> dict:
+    """what build_message_response did before"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(Message)
+            .options(
+                selectinload(Message.reactions).selectinload(Reaction.user),
+                selectinload(Message.reactions).selectinload(Reaction.custom_emoji)
+            )
+            .where(Message.id.in_(message_ids))
+        )
+        summaries = {}
+        for message in result.scalars().all():
+            reaction_map = {}
+            for reaction in message.reactions or []:
+                if reaction.emoji not in reaction_map:
+                    reaction_map[reaction.emoji] = {
+                        "emoji": reaction.emoji,
+                        "count": 0,
+                        "users": [],
+                        "user_avatars": [],
+                        "custom_emoji_url": reaction.custom_emoji.url if reaction.custom_emoji else None
+                    }
+                reaction_map[reaction.emoji]["count"] += 1
+                if reaction.user:
+                    reaction_map[reaction.emoji]["users"].append(reaction.user.username)
+                    reaction_map[reaction.emoji]["user_avatars"].append(reaction.user.avatar or "default")
+            summaries[message.id] = list(reaction_map.values())
+        return summaries
+
+
+async def sql_summaries(message_ids: list) -> dict:
+    async with AsyncSessionLocal() as db:
+        summaries, _ = await load_reaction_summaries(db, message_ids)
+        return summaries
+
+
+async def timed(fn, message_ids: list, rounds: int) -> float:
+    await fn(message_ids)
+    started = time.perf_counter()
+    for _ in range(rounds):
+        await fn(message_ids)
+    return (time.perf_counter() - started) / rounds
+
+
+async def run(rounds: int):
+    message_ids = await bench_message_ids()
+    if not message_ids:
+        print("nothing seeded, run `seed` first")
+        return
+    for name, fn in (("orm", orm_summaries), ("sql", sql_summaries)):
+        elapsed = await timed(fn, message_ids, rounds)
+        print(f"{name}: {elapsed * 1000:.1f} ms per page of {len(message_ids)} messages")
+
+
+async def cleanup():
+    async with AsyncSessionLocal() as db:
+        bench_users = select(User.id).where(User.username.like("bench\\_%", escape="\\"))
+        #reactions go with their message and user (ON DELETE CASCADE)
+        await db.execute(delete(Message).where(Message.author_id.in_(bench_users)))
+        await db.execute(delete(User).where(User.username.like("bench\\_%", escape="\\")))
+        await db.commit()
+    print("bench rows removed")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("seed", "run", "cleanup"))
+    parser.add_argument("--messages", type=int, default=50)
+    parser.add_argument("--reactions", type=int, default=2000, help="reactions per message")
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    
+    if args.command == "seed":
+        asyncio.run(seed(args.messages, args.reactions))
+    elif args.command == "run":
+        asyncio.run(run(args.rounds))
+    else:
+        asyncio.run(cleanup())
@@ -0,0 +1,98 @@
+"""serializers.py vs the pydantic response models on one page of messages
+
+    cd backend && python bench/bench_serializers.py [messages] [rounds]
+
+no database needed => rows are synthetic message_row_query() rows with an
+image attachment, a reply quote and reactions each. the pydantic side
+validates the same dicts into MessageList and dumps that, i.e. the cost the
+lean path skips
+"""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from schemas import MessageList, MessageResponse
+from serializers import message_dict, encode
+
+
+def make_rows(count: int) -> list:
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [
+        SimpleNamespace(
+            id=f"00000000-0000-4000-8000-{i:012d}",
+            content=f"message {i} with some text ✓",
+            author_id="a1b2c3d4-0000-4000-8000-000000000001",
+            author_username="alice",
+            author_avatar="cat",
+            author_is_admin=False,
+            is_pinned=False,
+            attachments=[{
+                "type": "image",
+                "url": f"http://storage/chat/images/{i}.jpg",
+                "name": "photo.jpg",
+                "size": 204800,
+                "object_name": f"images/{i}.jpg",
+                "width": 1600,
+                "height": 1200,
+                "placeholder": "LEHV6nWB2yk8pyo0adR*.7kCMdnj",
+                "renditions": [{
+                    "label": "thumb",
+                    "url": f"http://storage/chat/images/{i}.thumb.webp",
+                    "content_type": "image/webp",
+                    "width": 480,
+                    "height": 360,
+                    "size": 10240,
+                    "object_name": f"images/{i}.thumb.webp"
+                }]
+            }],
+            created_at=start + timedelta(seconds=i),
+            updated_at=None,
+            reply_preview={"id": "p", "content": "parent", "author_username": "bob", "attachment_only": False, "deleted": False},
+            reply_to_id="p",
+            reply_count=0
+        )
+        for i in range(count)
+    ]
+
+
+REACTIONS = [{"emoji": "👍", "count": 2, "users": ["alice", "bob"], "user_avatars": ["cat", "dog"], "custom_emoji_url": None}]
+
+
+def lean(rows: list) -> bytes:
+    return encode({"messages": [message_dict(row, REACTIONS) for row in rows], "total": len(rows), "has_more": False})
+
+
+def pydantic(rows: list) -> bytes:
+    messages = [MessageResponse.model_validate(message_dict(row, REACTIONS)) for row in rows]
+    return MessageList(messages=messages, total=len(rows), has_more=False).model_dump_json().encode("utf-8")
+
+
+def timed(fn, rows: list, rounds: int) -> list:
+    """seconds per page of every round"""
+    fn(rows)
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn(rows)
+        samples.append(time.perf_counter() - started)
+    return sorted(samples)
+
+
+def percentile(samples: list, fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    rows = make_rows(count)
+    for name, fn in (("orjson dicts", lean), ("pydantic models", pydantic)):
+        samples = timed(fn, rows, rounds)
+        print(
+            f"{name:>16}: p50 {percentile(samples, 0.5) * 1000:.3f} ms, "
+            f"p99 {percentile(samples, 0.99) * 1000:.3f} ms per page of {count}"
+        )
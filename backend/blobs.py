@@ -0,0 +1,310 @@
+from collections import Counter
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from sqlalchemy import select, update, delete, or_, literal_column
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import get_settings
+from database import AsyncSessionLocal
+from models import StoredObject
+from storage import FileTooLarge, delete_file, store_bytes, get_file_url, IMMUTABLE_CACHE_CONTROL
+from media import attachment_object_names, rendition_object_name
+from jobs import job_handler, every, enqueue, enqueue_now
+import asyncio
+import hashlib
+import logging
+import uuid
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+#chunk size uploads are hashed with
+HASH_CHUNK_SIZE = 1024 * 1024
+#unreferenced rows handed to storage.collect per sweep
+SWEEP_BATCH_SIZE = 500
+
+
+def content_object_name(digest: str, filename: str, folder: str) -> str:
+    """folder/<sha256>.ext => identical bytes always land on the same object"""
+    ext = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    return f"{folder}/{digest}.{ext}" if ext else f"{folder}/{digest}"
+
+
+def _hash_stream(raw: BinaryIO, max_size: int) -> str:
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = raw.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_size:
+            raise FileTooLarge(f"upload exceeds {max_size} bytes")
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+async def hash_stream(raw: BinaryIO, max_size: int) -> str:
+    """sha256 of a (spooled) file in a worker thread, raises FileTooLarge past max_size"""
+    return await asyncio.to_thread(_hash_stream, raw, max_size)
+
+
+async def hash_bytes(data: bytes) -> str:
+    return await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+
+
+class Collecting(Exception):
+    """the object's bytes are being deleted => its name can't take references until the row is gone"""
+
+
+async def claim(object_name: str, content_type: str, sha256: Optional[str] = None) -> Optional[dict]:
+    """take a reference on object_name, creating its row if needed
+
+    the reference is taken before any byte is stored, so a concurrent release
+    can never delete an object someone is about to use. an unreferenced row
+    whose bytes are not stored is being collected (or awaits it) => it is left
+    alone and Collecting is raised, the caller stores under another name
+
+    returns:
+        {size, derived} of the existing object on a hit, None if the caller
+        has to store the bytes (and then call record). a row whose upload is
+        still in flight is no hit => the caller stores the same bytes itself
+    """
+    statement = (
+        insert(StoredObject)
+        .values(object_name=object_name, sha256=sha256, content_type=content_type, ref_count=1)
+        .on_conflict_do_update(
+            index_elements=[StoredObject.object_name],
+            set_={"ref_count": StoredObject.ref_count + 1},
+            where=or_(StoredObject.stored, StoredObject.ref_count > 0)
+        )
+        #xmax is only 0 on a freshly inserted row
+        .returning(
+            literal_column("xmax = 0").label("inserted"),
+            StoredObject.stored,
+            StoredObject.size,
+            StoredObject.derived
+        )
+    )
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(statement)).one_or_none()
+        await db.commit()
+    if row is None:
+        raise Collecting(object_name)
+    if row.inserted or not row.stored:
+        return None
+    return {"size": row.size, "derived": row.derived}
+
+
+async def claim_content(
+    digest: str,
+    filename: str,
+    folder: str,
+    content_type: str,
+    sha256: Optional[str] = None
+) -> Tuple[str, Optional[dict]]:
+    """claim the content-addressed name of some bytes
+
+    while the name's old bytes are being collected, this copy is stored under
+    a name of its own (deduplicated again from then on)
+
+    returns:
+        (object name, claim result)
+    """
+    object_name = content_object_name(digest, filename, folder)
+    try:
+        return object_name, await claim(object_name, content_type, sha256)
+    except Collecting:
+        object_name = content_object_name(f"{digest}-{uuid.uuid4().hex[:8]}", filename, folder)
+        return object_name, await claim(object_name, content_type, sha256)
+
+
+async def record(object_name: str, size: int, derived: Optional[dict] = None):
+    """size and image fields of an object whose bytes were just stored"""
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(StoredObject)
+            .where(StoredObject.object_name == object_name)
+            .values(size=size, derived=derived, stored=True)
+        )
+        await db.commit()
+
+
+async def store_renditions(object_name: str, derived: dict) -> dict:
+    """upload the renditions of a processed image next to its original
+
+    renditions are an extra => if any upload fails the others are discarded and
+    the attachment keeps only its dimensions and placeholder
+
+    returns:
+        the image fields of the attachment
+    """
+    fields = {"width": derived["width"], "height": derived["height"], "placeholder": derived["placeholder"]}
+    renditions = [
+        {**rendition, "object_name": rendition_object_name(object_name, rendition["label"], rendition["ext"])}
+        for rendition in derived["renditions"]
+    ]
+    results = await asyncio.gather(
+        *(store_bytes(r["object_name"], r["data"], r["content_type"], IMMUTABLE_CACHE_CONTROL) for r in renditions),
+        return_exceptions=True
+    )
+    failed = [result for result in results if isinstance(result, BaseException)]
+    if failed:
+        logger.warning(f"Failed to store renditions of {object_name}: {failed[0]}")
+        await discard([
+            r["object_name"] for r, result in zip(renditions, results) if not isinstance(result, BaseException)
+        ])
+        return fields
+
+    if renditions:
+        fields["renditions"] = [
+            {
+                "label": r["label"],
+                "url": get_file_url(r["object_name"]),
+                "content_type": r["content_type"],
+                "width": r["width"],
+                "height": r["height"],
+                "size": len(r["data"]),
+                "object_name": r["object_name"]
+            }
+            for r in renditions
+        ]
+    return fields
+
+
+@job_handler("storage.collect")
+async def collect(payload: dict):
+    """delete an object whose last reference is gone
+
+    the row is only locked to turn it into a tombstone (stored = false), no
+    lock is held across the storage deletes. claims leave a tombstone alone
+    (see claim) => nobody stores under the name until the row is gone. a
+    failed delete keeps the tombstone and raises, so the job (or the next
+    storage.sweep) retries it
+    """
+    object_name = payload["object_name"]
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(StoredObject)
+            .where(StoredObject.object_name == object_name, StoredObject.ref_count <= 0)
+            .with_for_update()
+        )
+        stored = result.scalar_one_or_none()
+        if stored is None:
+            #referenced again in the meantime (or already collected)
+            return
+        names = attachment_object_names({"object_name": object_name, **(stored.derived or {})})
+        stored.stored = False
+        await db.commit()
+
+    results = await asyncio.gather(*(delete_file(name) for name in names))
+    if not all(results):
+        raise RuntimeError(f"failed to delete storage objects of {object_name}")
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            delete(StoredObject)
+            .where(
+                StoredObject.object_name == object_name,
+                StoredObject.ref_count <= 0,
+                StoredObject.stored == False
+            )
+        )
+        await db.commit()
+
+
+@job_handler("storage.delete")
+async def delete_objects(payload: dict):
+    """delete objects nothing tracks (legacy uploads, leftovers of a failed store)"""
+    names = payload.get("object_names") or []
+    results = await asyncio.gather(*(delete_file(name) for name in names))
+    failed = [name for name, deleted in zip(names, results) if not deleted]
+    if failed:
+        raise RuntimeError(f"failed to delete {', '.join(failed)}")
+
+
+@job_handler("storage.sweep")
+async def sweep(payload: dict):
+    """collect unreferenced objects whose collect job was lost or gave up"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            select(StoredObject.object_name)
+            .where(StoredObject.ref_count <= 0)
+            .limit(SWEEP_BATCH_SIZE)
+        )
+        for object_name in result.scalars().all():
+            await enqueue(db, "storage.collect", {"object_name": object_name})
+        await db.commit()
+
+
+every("storage.sweep", settings.storage_sweep_interval_minutes * 60)
+
+
+@job_handler("uploads.discard")
+async def discard_upload(payload: dict):
+    """delete a presigned upload that was never attached to a message
+
+    anything attached has a stored_objects row by now => left alone
+    """
+    object_name = payload["object_name"]
+    async with AsyncSessionLocal() as db:
+        referenced = await db.get(StoredObject, object_name)
+    if referenced is None and not await delete_file(object_name):
+        raise RuntimeError(f"failed to delete {object_name}")
+
+
+async def drop_references(db: AsyncSession, attachments: List[dict]):
+    """drop one reference per attachment (or stored-fields dict) in the caller's transaction
+
+    storage is only touched by the jobs enqueued here => nothing is deleted
+    unless the caller commits, and a failed delete is retried. objects without
+    a row predate reference counting and are owned by that one attachment =>
+    they are deleted, renditions included
+    """
+    counts = Counter(
+        attachment["object_name"] for attachment in attachments
+        if isinstance(attachment, dict) and isinstance(attachment.get("object_name"), str)
+    )
+    if not counts:
+        return
+
+    #one statement per distinct count => an image posted twice drops both references
+    by_count: Dict[int, List[str]] = {}
+    for object_name, count in counts.items():
+        by_count.setdefault(count, []).append(object_name)
+
+    remaining: Dict[str, int] = {}
+    for count, names in by_count.items():
+        result = await db.execute(
+            update(StoredObject)
+            .where(StoredObject.object_name.in_(names))
+            .values(ref_count=StoredObject.ref_count - count)
+            .returning(StoredObject.object_name, StoredObject.ref_count)
+        )
+        remaining.update({row.object_name: row.ref_count for row in result})
+
+    for object_name, refs in remaining.items():
+        if refs <= 0:
+            await enqueue(db, "storage.collect", {"object_name": object_name})
+
+    untracked = [
+        name
+        for attachment in attachments
+        if isinstance(attachment, dict) and attachment.get("object_name") in counts
+        and attachment["object_name"] not in remaining
+        for name in attachment_object_names(attachment)
+    ]
+    if untracked:
+        await enqueue(db, "storage.delete", {"object_names": list(dict.fromkeys(untracked))})
+
+
+async def release(attachments: List[dict]):
+    """drop_references in a transaction of its own"""
+    async with AsyncSessionLocal() as db:
+        await drop_references(db, attachments)
+        await db.commit()
+
+
+async def discard(object_names: List[str]):
+    """delete objects nothing references (in the background, retried)"""
+    if object_names:
+        await enqueue_now("storage.delete", {"object_names": list(dict.fromkeys(object_names))})
@@ -21,6 +21,49 @@ class Settings(BaseSettings):
     admin_email: str = ""
     admin_default_password: str = ""
     
+    #purges: /clear and the retention sweep delete messages in background
+    #batches, pausing between them so readers and writers get the table
+    purge_batch_size: int = 500
+    purge_batch_pause: float = 0.05
+    #messages older than this many days are purged (0 keeps everything)
+    message_retention_days: int = 0
+    purge_interval_minutes: int = 60
+    
+    #background jobs: postgres-backed queue, every backend process runs workers
+    job_workers: int = 4
+    #idle workers look for due jobs this often (jobs enqueued here wake them at once)
+    job_poll_interval: float = 1.0
+    #lease of a running job, renewed while it runs => jobs of a dead worker are retried after it
+    job_lease_seconds: int = 60
+    job_max_attempts: int = 8
+    #retry delay doubles per attempt up to the max
+    job_retry_base_seconds: float = 5.0
+    job_retry_max_seconds: float = 3600.0
+    #finished jobs (and their idempotency keys) are kept this long
+    job_retention_hours: int = 72
+    #unreferenced storage objects left by failed deletes are swept this often (0 disables)
+    storage_sweep_interval_minutes: int = 60
+    
+    #guests
+    #opt-in: signed token-only guest identities, the users row is created on
+    #first reaction. such tokens can't be revoked server-side
+    stateless_guests: bool = False
+    #guest rows without reactions are purged after this many hours of inactivity
+    guest_purge_max_age_hours: int = 24 * 7
+    guest_purge_interval_minutes: int = 60
+    #users.last_seen is bumped on activity (requests, socket traffic) at most this often per user
+    last_seen_update_seconds: int = 300
+    
+    #attachment storage: "s3" (MinIO/S3 over a pooled async http client) or
+    #"local" (files under storage_local_path, served by the app itself)
+    storage_backend: str = "s3"
+    storage_local_path: str = "./data"
+    #shared keep-alive pool per worker and the storage requests allowed in flight
+    storage_max_connections: int = 32
+    storage_max_concurrency: int = 16
+    storage_keepalive_expiry: float = 30.0
+    storage_timeout: float = 60.0
+    
     #MinIO/S3
     minio_endpoint: str = "minio:9000"
     minio_access_key: str = ""
@@ -41,6 +84,71 @@ class Settings(BaseSettings):
     
     #uploads
     max_file_size: int = 50 * 1024 * 1024
+    #whole multipart body (every file of a message), enforced while it streams in
+    max_request_size: int = 200 * 1024 * 1024
+    #host[:port] browsers reach MinIO at (the nginx /blog/ proxy), presigned PUT
+    #urls are signed for it => empty disables direct-to-storage uploads
+    minio_presign_endpoint: str = ""
+    minio_presign_secure: bool = True
+    #fixed region => presigning never has to ask the server for it
+    minio_region: str = "us-east-1"
+    #how long an upload session (presigned url + upload token) stays valid
+    upload_session_expire_seconds: int = 15 * 60
+    
+    #image attachments: renditions, dimensions and a blurhash placeholder are
+    #computed in a process pool at upload time (larger images only lose their
+    #metadata, which every stored image original does)
+    image_processing: bool = True
+    image_workers: int = 2
+    image_process_max_bytes: int = 20 * 1024 * 1024
+    #decompression bomb guard
+    image_max_pixels: int = 50_000_000
+    #longest edge of the renditions (webp, plus avif when pillow can encode it)
+    image_thumbnail_size: int = 480
+    image_display_size: int = 1600
+    image_webp_quality: int = 80
+    image_avif_quality: int = 60
+    #still custom emojis are stored as webp of at most this size
+    emoji_size: int = 128
+    
+    #built message responses kept in memory per worker (0 disables the cache)
+    message_cache_size: int = 5000
+    #encoded /api/messages pages (with etags) kept until the next write
+    message_page_cache_size: int = 256
+    #reacting users listed per emoji in message summaries (most recent first),
+    #the full list is paged via /api/messages/{id}/reactions/{emoji}
+    reaction_summary_users: int = 20
+    #characters of the parent quoted in a reply (snapshotted when the reply is posted)
+    reply_preview_length: int = 200
+    
+    #websocket fan-out
+    #each socket gets its own bounded outbound queue drained by a writer task
+    #a socket whose queue is full of critical events is closed with
+    #WS_CLOSE_FELL_BEHIND => the client resumes or refetches
+    ws_send_queue_size: int = 256
+    #closing a stalled socket waits on its close handshake => bounded, off the fan-out path
+    ws_close_timeout: float = 2.0
+    #recent events kept per worker so reconnecting clients can resume
+    ws_replay_buffer_size: int = 1000
+    #typing indicators: inbound events per user are throttled, typists expire
+    #after the ttl and changes go out as one typing_state frame per interval
+    ws_typing_throttle: float = 1.0
+    ws_typing_ttl: float = 4.0
+    ws_typing_interval: float = 1.0
+    #presence: joins/leaves are batched into one presence_delta frame per interval
+    #and the online list in the connected frame is capped (rest via /api/online)
+    ws_presence_interval: float = 2.0
+    ws_presence_snapshot_limit: int = 100
+    #heartbeat: quiet sockets get a ping every interval, sockets that sent
+    #nothing (not even a pong) for the timeout are reaped
+    ws_heartbeat_interval: float = 25.0
+    ws_heartbeat_timeout: float = 60.0
+    
+    #cross-worker event bus: "memory" (single process) or "postgres" (LISTEN/NOTIFY)
+    event_bus_backend: str = "memory"
+    event_bus_channel: str = "blog_events"
+    #how often each worker re-announces who is connected to it (seconds)
+    presence_sync_interval: int = 15
     
     #GIF Support - Klipy API
     #get API key from: https://partner.klipy.com
@@ -0,0 +1 @@
+#backend modules import each other by flat name => tests run from this directory
@@ -0,0 +1,213 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from config import get_settings
+import asyncio
+import asyncpg
+import logging
+import orjson
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+#postgres rejects NOTIFY payloads of 8000 bytes or more
+NOTIFY_PAYLOAD_LIMIT = 7800
+#chunks of one event are sent in one transaction => a buffer still incomplete
+#after this long lost a chunk (dropped while the listener reconnected)
+PARTIAL_EVENT_TTL = 30.0
+#far above any real event (64 chunks ~ 500KB), bounds what a bad header can allocate
+MAX_EVENT_CHUNKS = 64
+
+
+class EventBus:
+    """transport for events that every worker has to fan out to its own sockets"""
+    
+    #whether other processes can be listening at all
+    distributed = False
+    
+    def __init__(self):
+        self._handler: Optional[EventHandler] = None
+    
+    async def start(self, handler: EventHandler):
+        self._handler = handler
+    
+    async def stop(self):
+        self._handler = None
+    
+    async def publish(self, event: dict):
+        raise NotImplementedError
+
+
+class InProcessEventBus(EventBus):
+    """single worker => the manager already fanned out locally, nothing to forward"""
+    
+    async def publish(self, event: dict):
+        return None
+
+
+def _split_payload(payload: str) -> List[str]:
+    """split an encoded event into chunks that each fit into one NOTIFY"""
+    if len(payload.encode("utf-8")) <= NOTIFY_PAYLOAD_LIMIT:
+        return [payload]
+    
+    chunks = []
+    current: List[str] = []
+    size = 0
+    for char in payload:
+        char_size = len(char.encode("utf-8"))
+        if size + char_size > NOTIFY_PAYLOAD_LIMIT:
+            chunks.append("".join(current))
+            current, size = [], 0
+        current.append(char)
+        size += char_size
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+class PostgresEventBus(EventBus):
+    """fan events out across workers/containers with LISTEN/NOTIFY
+    
+    large events are split into several notifications sent in one
+    transaction, so they arrive contiguous and in order
+    """
+    
+    distributed = True
+    
+    def __init__(self, dsn: str, channel: str):
+        super().__init__()
+        self.dsn = dsn
+        self.channel = channel
+        self._publish_conn: Optional[asyncpg.Connection] = None
+        self._publish_lock = asyncio.Lock()
+        self._listen_task: Optional[asyncio.Task] = None
+        self._inbox: "asyncio.Queue[str]" = asyncio.Queue()
+        #event id -> (monotonic time of the first chunk, received chunks)
+        self._partial: Dict[str, Tuple[float, List[Optional[str]]]] = {}
+    
+    async def start(self, handler: EventHandler):
+        await super().start(handler)
+        self._listen_task = asyncio.create_task(self._listen())
+    
+    async def stop(self):
+        if self._listen_task:
+            self._listen_task.cancel()
+            try:
+                await self._listen_task
+            except asyncio.CancelledError:
+                pass
+            self._listen_task = None
+        if self._publish_conn and not self._publish_conn.is_closed():
+            await self._publish_conn.close()
+        self._publish_conn = None
+        await super().stop()
+    
+    async def publish(self, event: dict):
+        payload = orjson.dumps(event).decode("utf-8")
+        chunks = _split_payload(payload)
+        if len(chunks) > MAX_EVENT_CHUNKS:
+            #receivers would drop it anyway
+            logger.error(f"Event of {len(payload)} characters is too large for the event bus, not published")
+            return
+        event_id = uuid.uuid4().hex[:12]
+        
+        async with self._publish_lock:
+            try:
+                if self._publish_conn is None or self._publish_conn.is_closed():
+                    self._publish_conn = await asyncpg.connect(self.dsn)
+                async with self._publish_conn.transaction():
+                    for index, chunk in enumerate(chunks):
+                        await self._publish_conn.execute(
+                            "SELECT pg_notify($1, $2)",
+                            self.channel,
+                            f"{event_id}:{index}:{len(chunks)}:{chunk}"
+                        )
+            except (asyncpg.PostgresError, OSError) as e:
+                logger.error(f"Failed to publish event to other workers: {e}")
+                self._publish_conn = None
+    
+    def _on_notify(self, connection, pid, channel, payload):
+        self._inbox.put_nowait(payload)
+    
+    async def _listen(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                #notifications sent while we were away are gone => so are the
+                #missing chunks of anything half received
+                self._partial.clear()
+                await conn.add_listener(self.channel, self._on_notify)
+                logger.info(f"Listening for cross-worker events on '{self.channel}'")
+                backoff = 1
+                while not conn.is_closed():
+                    try:
+                        payload = await asyncio.wait_for(self._inbox.get(), timeout=30)
+                    except asyncio.TimeoutError:
+                        #idle => make sure the listening connection is still alive
+                        await conn.execute("SELECT 1")
+                        continue
+                    await self._dispatch(payload)
+            except asyncio.CancelledError:
+                if conn and not conn.is_closed():
+                    await conn.close()
+                raise
+            except Exception as e:
+                logger.error(f"Event bus listener error, reconnecting in {backoff}s: {e}")
+                if conn and not conn.is_closed():
+                    await conn.close()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+    
+    def _expire_partial(self):
+        cutoff = time.monotonic() - PARTIAL_EVENT_TTL
+        for event_id in [key for key, (started, _) in self._partial.items() if started < cutoff]:
+            logger.warning(f"Dropping incomplete cross-worker event {event_id}")
+            del self._partial[event_id]
+    
+    def _reassemble(self, payload: str) -> Optional[str]:
+        """the event once all its chunks arrived, None while incomplete or malformed"""
+        fields = payload.split(":", 3)
+        if len(fields) != 4 or not fields[1].isdigit() or not fields[2].isdigit():
+            logger.warning("Ignoring malformed cross-worker event")
+            return None
+        event_id, index, total, chunk = fields[0], int(fields[1]), int(fields[2]), fields[3]
+        if not 0 <= index < total <= MAX_EVENT_CHUNKS:
+            logger.warning(f"Ignoring cross-worker event {event_id} with bad chunk {index}/{total}")
+            return None
+        if total == 1:
+            return chunk
+        
+        self._expire_partial()
+        _, parts = self._partial.setdefault(event_id, (time.monotonic(), [None] * total))
+        if len(parts) != total:
+            logger.warning(f"Ignoring cross-worker event {event_id} with inconsistent chunk count")
+            del self._partial[event_id]
+            return None
+        parts[index] = chunk
+        if any(part is None for part in parts):
+            return None
+        del self._partial[event_id]
+        return "".join(parts)  # type: ignore[arg-type]
+    
+    async def _dispatch(self, payload: str):
+        try:
+            message = self._reassemble(payload)
+            if message is None or not self._handler:
+                return
+            await self._handler(orjson.loads(message))
+        except Exception as e:
+            logger.error(f"Failed to handle cross-worker event: {e}")
+
+
+def create_event_bus() -> EventBus:
+    backend = settings.event_bus_backend.lower()
+    if backend == "postgres":
+        dsn = settings.database_url.replace("postgresql+asyncpg://", "postgresql://", 1)
+        return PostgresEventBus(dsn, settings.event_bus_channel)
+    if backend != "memory":
+        logger.warning(f"Unknown event bus backend '{backend}', falling back to in-process")
+    return InProcessEventBus()
\ No newline at end of file
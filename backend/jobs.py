@@ -0,0 +1,340 @@
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from sqlalchemy import select, update, delete, func, case, or_, and_
+from sqlalchemy import event as sa_event
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import get_settings
+from database import AsyncSessionLocal
+from models import Job
+import asyncio
+import logging
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+JobHandler = Callable[[dict], Awaitable[None]]
+
+#finished jobs pruned per statement
+JOB_PRUNE_BATCH_SIZE = 1000
+#runtimes kept for the latency percentiles in stats()
+LATENCY_WINDOW = 1000
+
+_handlers: Dict[str, JobHandler] = {}
+#(kind, interval in seconds, enabled) => enqueued once per interval across all workers
+_periodic: List[tuple] = []
+
+
+def job_handler(kind: str):
+    """register the coroutine that runs jobs of this kind
+
+    handlers can run more than once (retries, an expired lease), so they have
+    to be idempotent
+    """
+    def register(handler: JobHandler) -> JobHandler:
+        _handlers[kind] = handler
+        return handler
+    return register
+
+
+def every(kind: str, seconds: float, enabled: Callable[[], bool] = lambda: True):
+    """enqueue a payload-less job of this kind once per interval (0 disables it)"""
+    _periodic.append((kind, seconds, enabled))
+
+
+class JobMetrics:
+    """per worker counters and recent latencies of the jobs it ran"""
+
+    def __init__(self):
+        self.succeeded = 0
+        self.retried = 0
+        self.failed = 0
+        #run_at -> start (queueing delay) and start -> finish (runtime), seconds
+        self.waits: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.runtimes: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+
+    @staticmethod
+    def _percentiles(values: Deque[float]) -> dict:
+        if not values:
+            return {"p50": None, "p95": None, "max": None}
+        ordered = sorted(values)
+        return {
+            "p50": round(ordered[len(ordered) // 2], 4),
+            "p95": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 4),
+            "max": round(ordered[-1], 4)
+        }
+
+    def stats(self) -> dict:
+        return {
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "failed": self.failed,
+            "wait_seconds": self._percentiles(self.waits),
+            "run_seconds": self._percentiles(self.runtimes)
+        }
+
+
+metrics = JobMetrics()
+_wakeup = asyncio.Event()
+_tasks: List[asyncio.Task] = []
+_worker_id = uuid.uuid4().hex[:8]
+
+
+def _wake(*_):
+    _wakeup.set()
+
+
+async def enqueue(
+    db: AsyncSession,
+    kind: str,
+    payload: Optional[dict] = None,
+    key: Optional[str] = None,
+    delay: float = 0,
+    max_attempts: Optional[int] = None
+):
+    """add a job in the caller's transaction => it only exists if the caller commits
+
+    a job whose idempotency key is already taken is dropped silently
+    """
+    statement = insert(Job).values(
+        id=str(uuid.uuid4()),
+        kind=kind,
+        payload=payload or {},
+        idempotency_key=key,
+        max_attempts=max_attempts or settings.job_max_attempts,
+        run_at=func.now() + timedelta(seconds=delay)
+    )
+    if key is not None:
+        statement = statement.on_conflict_do_nothing(index_elements=[Job.idempotency_key])
+    await db.execute(statement)
+    #local workers pick it up right after the commit instead of on their next poll
+    if delay <= 0:
+        sa_event.listen(db.sync_session, "after_commit", _wake, once=True)
+
+
+async def enqueue_now(kind: str, payload: Optional[dict] = None, key: Optional[str] = None, delay: float = 0):
+    """enqueue in a transaction of its own"""
+    async with AsyncSessionLocal() as db:
+        await enqueue(db, kind, payload, key, delay)
+        await db.commit()
+
+
+def _backoff(attempts: int) -> float:
+    return min(settings.job_retry_max_seconds, settings.job_retry_base_seconds * 2 ** (attempts - 1))
+
+
+async def _claim() -> Optional[Job]:
+    """lease the next due job (or one whose worker let its lease run out)"""
+    now = func.now()
+    due = (
+        select(Job.id)
+        .where(or_(
+            and_(Job.status == "queued", Job.run_at <= now),
+            and_(Job.status == "running", Job.locked_until < now)
+        ))
+        .order_by(Job.run_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(Job)
+            .where(Job.id == due)
+            .values(
+                status="running",
+                attempts=Job.attempts + 1,
+                started_at=now,
+                locked_until=now + timedelta(seconds=settings.job_lease_seconds),
+                lease_token=uuid.uuid4().hex
+            )
+            .returning(Job)
+        )
+        job = result.scalar_one_or_none()
+        await db.commit()
+    return job
+
+
+async def _renew_lease(job: Job):
+    """keep the lease alive while a long handler (a purge) runs
+
+    a failed renewal is retried on the next tick, the lease outlives two of them
+    """
+    while True:
+        await asyncio.sleep(settings.job_lease_seconds / 3)
+        try:
+            async with AsyncSessionLocal() as db:
+                result = await db.execute(
+                    update(Job)
+                    .where(Job.id == job.id, Job.status == "running", Job.lease_token == job.lease_token)
+                    .values(locked_until=func.now() + timedelta(seconds=settings.job_lease_seconds))
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"Failed to renew the lease of job {job.id} ({job.kind}): {e}")
+            continue
+        if result.rowcount == 0:
+            #claimed again elsewhere => that worker owns it now
+            logger.warning(f"Job {job.id} ({job.kind}) lost its lease while running")
+            return
+
+
+async def _finish(job: Job, **values):
+    """only while this worker still holds the lease => never overwrites a later claim"""
+    async with AsyncSessionLocal() as db:
+        result = await db.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.lease_token == job.lease_token)
+            .values(lease_token=None, locked_until=None, **values)
+        )
+        await db.commit()
+    if result.rowcount == 0:
+        logger.warning(f"Job {job.id} ({job.kind}) was claimed again, result of this run discarded")
+
+
+async def _run(job: Job):
+    started = time.monotonic()
+    metrics.waits.append(max(0.0, (datetime.now(timezone.utc) - job.run_at).total_seconds()))
+
+    handler = _handlers.get(job.kind)
+    if handler is None:
+        logger.error(f"No handler for job {job.id} ({job.kind})")
+        metrics.failed += 1
+        await _finish(job, status="failed", last_error="no handler", finished_at=func.now())
+        return
+
+    renewer = asyncio.create_task(_renew_lease(job))
+    try:
+        await handler(job.payload or {})
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"[:2000]
+        if job.attempts >= job.max_attempts:
+            logger.error(f"Job {job.id} ({job.kind}) failed for good after {job.attempts} attempts: {error}")
+            metrics.failed += 1
+            await _finish(job, status="failed", last_error=error, finished_at=func.now())
+        else:
+            delay = _backoff(job.attempts)
+            logger.warning(f"Job {job.id} ({job.kind}) failed, retrying in {delay:.0f}s: {error}")
+            metrics.retried += 1
+            await _finish(
+                job,
+                status="queued",
+                last_error=error,
+                run_at=func.now() + timedelta(seconds=delay)
+            )
+        return
+    finally:
+        renewer.cancel()
+
+    metrics.succeeded += 1
+    metrics.runtimes.append(time.monotonic() - started)
+    await _finish(job, status="done", finished_at=func.now())
+
+
+async def _worker(index: int):
+    while True:
+        try:
+            job = await _claim()
+        except Exception as e:
+            logger.error(f"Job worker {_worker_id}/{index} could not claim: {e}")
+            job = None
+            await asyncio.sleep(settings.job_poll_interval)
+        if job is not None:
+            try:
+                await _run(job)
+            except Exception as e:
+                #the lease runs out and another worker retries the job
+                logger.error(f"Job worker {_worker_id}/{index} failed to run job {job.id} ({job.kind}): {e}")
+                await asyncio.sleep(settings.job_poll_interval)
+            continue
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=settings.job_poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _scheduler():
+    """enqueue periodic jobs => the slot number in the key makes every worker agree on one job per slot
+
+    an interval of 0 (or less) disables its job
+    """
+    while True:
+        intervals = [60.0]
+        for kind, seconds, enabled in _periodic:
+            #one bad entry must never stop the others (or the loop)
+            try:
+                if seconds <= 0 or not enabled():
+                    continue
+                intervals.append(seconds)
+                slot = int(time.time() // seconds)
+                await enqueue_now(kind, key=f"{kind}:{slot}")
+            except Exception as e:
+                logger.error(f"Failed to schedule {kind}: {e}")
+        await asyncio.sleep(min(intervals))
+
+
+@job_handler("jobs.prune")
+async def prune_jobs(payload: dict):
+    """drop finished jobs past job_retention_hours (their idempotency keys go with them)"""
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.job_retention_hours)
+    stale = (
+        select(Job.id)
+        .where(Job.status.in_(("done", "failed")), Job.finished_at < cutoff)
+        .limit(JOB_PRUNE_BATCH_SIZE)
+        .scalar_subquery()
+    )
+    while True:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(delete(Job).where(Job.id.in_(stale)))
+            await db.commit()
+        if result.rowcount < JOB_PRUNE_BATCH_SIZE:
+            break
+
+
+every("jobs.prune", 3600)
+
+
+async def start():
+    """started from the lifespan hook, after every module registered its handlers"""
+    _tasks.extend(asyncio.create_task(_worker(i)) for i in range(settings.job_workers))
+    _tasks.append(asyncio.create_task(_scheduler()))
+    logger.info(f"Started {settings.job_workers} job workers ({len(_handlers)} job kinds)")
+
+
+async def stop():
+    """a job cut off here is retried elsewhere once its lease runs out"""
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+
+
+async def stats(db: AsyncSession) -> dict:
+    """queue depth (cluster wide) plus what this worker ran"""
+    result = await db.execute(
+        select(
+            func.count().filter(and_(Job.status == "queued", Job.run_at <= func.now())).label("ready"),
+            func.count().filter(and_(Job.status == "queued", Job.run_at > func.now())).label("scheduled"),
+            func.count().filter(Job.status == "running").label("running"),
+            func.count().filter(Job.status == "failed").label("failed"),
+            #how long the oldest due job has been waiting => queue lag
+            func.max(case(
+                (and_(Job.status == "queued", Job.run_at <= func.now()),
+                 func.extract("epoch", func.now() - Job.run_at)),
+                else_=None
+            )).label("lag")
+        )
+    )
+    row = result.one()
+    return {
+        "ready": row.ready,
+        "scheduled": row.scheduled,
+        "running": row.running,
+        "failed": row.failed,
+        "lag_seconds": round(float(row.lag), 3) if row.lag is not None else 0.0,
+        "worker": metrics.stats()
+    }
@@ -1,33 +1,55 @@
-from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Query
+from fastapi import FastAPI, Depends, HTTPException, status, WebSocket, WebSocketDisconnect, UploadFile, File, Form, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, delete
-from sqlalchemy.orm import selectinload
-from typing import Optional, List, cast
+from sqlalchemy import select, func, update, tuple_, and_, literal, union_all, cast, null
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from typing import Optional, List
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+import asyncio
+import base64
 import json
 import os
 import logging
 import httpx
 
 from config import get_settings
-from database import get_db, init_db
+from database import get_db, init_db, AsyncSessionLocal
 from models import User, Message, Reaction, CustomEmoji
 from schemas import (
     LoginRequest, PasswordChangeRequest, TokenResponse,
-    GuestCreate, UserResponse, MessageResponse,
-    MessageList, ReactionCreate, Attachment, MessageReplyInfo,
-    CommandResponse, CustomEmojiResponse, GifSearchResult, GifSearchResponse
+    GuestCreate, UserResponse,
+    MessageList, ReactionCreate, ReactionUser, ReactionUserList, MyReactions, MessageSearchResponse, MessageThread,
+    CommandResponse, CustomEmojiResponse, GifSearchResult, GifSearchResponse,
+    UploadSessionRequest, UploadSessionResponse, AvatarList
 )
 from auth import (
     verify_password, hash_password, create_access_token,
-    get_current_user, get_current_admin, generate_guest_id
+    get_current_user, get_current_admin, generate_guest_id,
+    new_guest, create_guest_token, is_stateless_guest, materialize_guest,
+    decode_token, guest_from_claims, get_user_from_token, note_activity,
+    create_upload_token, decode_upload_token
 )
 from websocket_manager import manager
-from storage import init_minio, upload_file, get_file_url, delete_file
+from message_cache import message_cache, page_cache, etag_matches
+from serializers import message_dict, custom_emoji_dict, encode, reply_preview, reply_tombstone
+from event_bus import create_event_bus
+from tasks import guest_sweeper, purge_horizon, start_purge
+from storage import (
+    storage, LocalStorage, init_storage, close_storage, get_file_url,
+    FileTooLarge, direct_uploads_enabled, create_upload_session, stat_file,
+    store_bytes, store_stream, IMMUTABLE_CACHE_CONTROL
+)
+from blobs import (
+    claim_content, hash_stream, hash_bytes, claim, record, release,
+    drop_references, discard, store_renditions
+)
+from media import should_process, should_strip, derive_image, derive_emoji, strip_image, shutdown_pool
+from jobs import enqueue, enqueue_now
+import jobs
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -39,12 +61,98 @@ settings = get_settings()
 async def lifespan(app: FastAPI):
     logger.info("Starting up application...")
     await init_db()
-    await init_minio()
+    await init_storage()
+    manager.add_listener(message_cache.on_event)
+    manager.add_listener(page_cache.on_event)
+    manager.add_listener(purge_horizon.on_event)
+    await purge_horizon.load()
+    await manager.start(create_event_bus())
+    await warm_message_cache()
+    sweeper = asyncio.create_task(guest_sweeper())
+    await jobs.start()
     os.makedirs(os.path.dirname(settings.avatars_config_path), exist_ok=True)
     os.makedirs("./avatars", exist_ok=True)
     logger.info("Application startup complete")
     yield
     logger.info("Shutting down application...")
+    sweeper.cancel()
+    await jobs.stop()
+    await manager.stop()
+    shutdown_pool()
+    await close_storage()
+
+
+class UploadSizeLimitMiddleware:
+    """413 for multipart bodies past max_request_size while they stream in
+    
+    the multipart parser spools every file to disk before file.size is known
+    => a declared Content-Length is checked up front and the received bytes are
+    counted, so an oversized body is cut off instead of written out in full
+    """
+    
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+    
+    async def _reject(self, send):
+        body = json.dumps({
+            "detail": f"Request exceeds maximum size of {self.max_size // (1024*1024)}MB"
+        }).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close")
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
+    
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or []) if scope["type"] == "http" else {}
+        if not headers.get(b"content-type", b"").startswith(b"multipart/form-data"):
+            await self.app(scope, receive, send)
+            return
+        
+        length = headers.get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_size:
+            await self._reject(send)
+            return
+        
+        received = 0
+        too_large = False
+        started = False
+        
+        async def counting_receive():
+            nonlocal received, too_large
+            if too_large:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size:
+                    #the parser sees a disconnect => it stops reading and spooling
+                    too_large = True
+                    return {"type": "http.disconnect"}
+            return message
+        
+        async def guarded_send(message):
+            nonlocal started
+            if too_large:
+                #whatever the app makes of the cut off body, the client gets the 413
+                return
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+        
+        try:
+            await self.app(scope, counting_receive, guarded_send)
+        except Exception:
+            if not too_large:
+                raise
+        if too_large and not started:
+            await self._reject(send)
 
 
 docs_url = "/docs" if settings.debug else None
@@ -61,6 +169,8 @@ app = FastAPI(
 
 cors_origins = settings.cors_origins.split(",") if settings.cors_origins != "*" else ["*"]
 
+#added first => runs inside CORS, so the 413 still carries the CORS headers
+app.add_middleware(UploadSizeLimitMiddleware, max_size=settings.max_request_size)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=cors_origins,
@@ -71,6 +181,14 @@ app.add_middleware(
 
 app.mount("/avatars", StaticFiles(directory="avatars"), name="avatars")
 
+#the local backend has no server of its own => serve the bucket like the nginx proxy would
+if isinstance(storage, LocalStorage):
+    app.mount(
+        f"/{settings.minio_bucket}",
+        StaticFiles(directory=storage.bucket_path, check_dir=False),
+        name="attachments"
+    )
+
 
 # ============ EXCEPTION HANDLERS ============
 
@@ -116,6 +234,9 @@ async def change_password(
 
 @app.post("/api/auth/guest", response_model=TokenResponse)
 async def create_guest(request: GuestCreate = GuestCreate(), db: AsyncSession = Depends(get_db)):
+    if settings.stateless_guests:
+        return TokenResponse(access_token=create_guest_token(new_guest(request.avatar)))
+    
     guest_id = generate_guest_id()
     guest = User(username=guest_id, is_admin=False, avatar=request.avatar)
     db.add(guest)
@@ -144,11 +265,205 @@ async def get_me(user: User = Depends(get_current_user)):
 async def update_avatar(avatar: str, user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    if is_stateless_guest(user):
+        #the avatar lives in the token claims => hand out a fresh token
+        #(and keep an already materialized row in sync)
+        await db.execute(update(User).where(User.id == user.id).values(avatar=avatar))
+        await db.commit()
+        user.avatar = avatar
+        await manager.broadcast({
+            "type": "user_avatar_changed",
+            "data": {"user_id": str(user.id), "avatar": avatar}
+        })
+        return {"message": "Avatar updated", "avatar": avatar, "access_token": create_guest_token(user)}
+    
     user.avatar = avatar
     await db.commit()
+    await manager.broadcast({
+        "type": "user_avatar_changed",
+        "data": {"user_id": str(user.id), "avatar": avatar}
+    })
     return {"message": "Avatar updated", "avatar": avatar}
 
 
+# ============ UPLOADS ============
+
+def classify_upload(content_type: str) -> tuple:
+    """(attachment type, storage folder) for a mime type"""
+    if content_type.startswith("image/"):
+        return "image", "images"
+    if content_type.startswith("audio/"):
+        return "audio", "audio"
+    if content_type.startswith("video/"):
+        return "video", "video"
+    return "file", "files"
+
+
+#an abandoned direct upload is discarded this long after its session expired
+UPLOAD_DISCARD_GRACE_SECONDS = 300
+
+
+def too_large(filename: Optional[str]) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File {filename} exceeds maximum size of {settings.max_file_size // (1024*1024)}MB"
+    )
+
+
+def check_upload_size(file: UploadFile):
+    """reject a single oversized file before any storage i/o
+    
+    file.size is only known once the body was spooled => the request as a
+    whole is capped while it streams by UploadSizeLimitMiddleware
+    """
+    if file.size is not None and file.size > settings.max_file_size:
+        raise too_large(file.filename)
+
+
+async def store_upload(file: UploadFile, folder: str, filename: Optional[str] = None, derive: bool = True) -> dict:
+    """store an upload under its content hash without blocking the event loop
+    
+    the spooled request file is hashed first => a file that is already stored
+    only takes another reference and no byte is uploaded. images go through
+    the process pool, so the stored original is already stripped of its
+    metadata (and renditions are built for those small enough to process).
+    everything else is streamed part by part, so memory stays at about one
+    UPLOAD_PART_SIZE per upload
+    
+    unlike direct uploads, proxied images are cleaned and derived here rather
+    than in a media.process job: the content-addressed name is public (bucket
+    policy, local static mount) the moment an object lands under it, and there
+    is no private prefix to stage the unstripped bytes in. the pool keeps the
+    work off the event loop, and a stored object is only ever processed once
+    
+    returns:
+        the storage fields of the attachment (object_name, size, image fields)
+    """
+    check_upload_size(file)
+    content_type = file.content_type or "application/octet-stream"
+    filename = filename or file.filename
+    process = derive and should_process(content_type, file.size)
+    strip = should_strip(content_type, file.size)
+    
+    await file.seek(0)
+    if process or strip:
+        data = await file.read()
+        digest = await hash_bytes(data)
+    else:
+        try:
+            digest = await hash_stream(file.file, settings.max_file_size)
+        except FileTooLarge:
+            raise too_large(file.filename)
+    
+    object_name, existing = await claim_content(digest, filename, folder, content_type, digest)
+    if existing is not None:
+        return {"object_name": object_name, "size": existing["size"], **(existing["derived"] or {})}
+    
+    #our reference is taken => store the bytes, or give it back if that fails
+    try:
+        image_fields = None
+        if process or strip:
+            derived = await derive_image(data) if process else None
+            #too large to process, or undecodable => still never stored with its metadata
+            stored = (derived["original"] if derived else await strip_image(data)) or data
+            await store_bytes(object_name, stored, content_type, IMMUTABLE_CACHE_CONTROL)
+            size = len(stored)
+            if derived:
+                image_fields = await store_renditions(object_name, derived)
+        else:
+            await file.seek(0)
+            size = await store_stream(
+                object_name, file.file, content_type, settings.max_file_size, IMMUTABLE_CACHE_CONTROL
+            )
+    except BaseException as e:
+        await release([{"object_name": object_name}])
+        if isinstance(e, FileTooLarge):
+            raise too_large(file.filename)
+        raise
+    
+    await record(object_name, size, image_fields)
+    return {"object_name": object_name, "size": size, **(image_fields or {})}
+
+
+async def verify_direct_upload(token: str, user: User) -> dict:
+    """check an object the client PUT itself against its upload token
+    
+    the presigned url can't bound size or type, so both are checked on the
+    stored object => a mismatching object is discarded in the background
+    
+    returns:
+        the upload token claims plus the stored size
+    """
+    claims = decode_upload_token(token, user.id)
+    if not claims:
+        raise HTTPException(status_code=400, detail="Invalid or expired upload token")
+    
+    object_name = claims["object_name"]
+    stat = await stat_file(object_name)
+    if stat is None:
+        raise HTTPException(status_code=400, detail=f"Upload of {claims['filename']} was not completed")
+    
+    size, content_type = stat
+    if size > settings.max_file_size:
+        await discard([object_name])
+        raise too_large(claims["filename"])
+    if content_type != claims["content_type"]:
+        await discard([object_name])
+        raise HTTPException(status_code=400, detail=f"Upload of {claims['filename']} has the wrong content type")
+    
+    return {**claims, "size": size}
+
+
+async def process_direct_upload(upload: dict) -> dict:
+    """take the reference on an object the client PUT itself
+    
+    direct uploads keep their uuid name (the client stored the bytes before we
+    knew them). images are stripped of their metadata (and processed) by a
+    media.process job once the message exists => posting never waits on the
+    fetch back and the process pool
+    
+    returns:
+        the storage fields of the attachment
+    """
+    object_name = upload["object_name"]
+    await claim(object_name, upload["content_type"])
+    await record(object_name, upload["size"])
+    return {"object_name": object_name, "size": upload["size"]}
+
+
+@app.post("/api/uploads", response_model=UploadSessionResponse)
+async def create_upload(
+    request: UploadSessionRequest,
+    user: User = Depends(get_current_admin)
+):
+    """open a direct-to-storage upload session (presigned PUT + upload token)"""
+    if not direct_uploads_enabled():
+        raise HTTPException(status_code=503, detail="Direct uploads are not configured")
+    if request.size > settings.max_file_size:
+        raise too_large(request.filename)
+    
+    _, folder = classify_upload(request.content_type)
+    expires = settings.upload_session_expire_seconds
+    #signing is local => no storage round trip
+    object_name, upload_url = create_upload_session(request.filename, folder, expires)
+    #an upload that never makes it into a message is deleted after the session ends
+    await enqueue_now(
+        "uploads.discard",
+        {"object_name": object_name},
+        key=f"uploads.discard:{object_name}",
+        delay=expires + UPLOAD_DISCARD_GRACE_SECONDS
+    )
+    
+    return {
+        "upload_url": upload_url,
+        "upload_token": create_upload_token(user.id, object_name, request.filename, request.content_type, expires),
+        "object_name": object_name,
+        "url": get_file_url(object_name),
+        "expires_in": expires
+    }
+
+
 # ============ GIF ROUTES ============
 
 @app.get("/api/gifs/search", response_model=GifSearchResponse)
@@ -263,14 +578,14 @@ async def trending_gifs(
 
 # ============ CUSTOM EMOJI ROUTES ============
 
-@app.get("/api/emojis")
+@app.get("/api/emojis", response_class=ORJSONResponse)
 async def list_custom_emojis(db: AsyncSession = Depends(get_db)):
     """list all custom emojis"""
     result = await db.execute(
-        select(CustomEmoji).order_by(CustomEmoji.name)
+        select(CustomEmoji.id, CustomEmoji.name, CustomEmoji.url, CustomEmoji.created_at)
+        .order_by(CustomEmoji.name)
     )
-    emojis = result.scalars().all()
-    return {"emojis": [CustomEmojiResponse.model_validate(e) for e in emojis]}
+    return ORJSONResponse({"emojis": [custom_emoji_dict(row) for row in result.all()]})
 
 
 @app.post("/api/emojis", response_model=CustomEmojiResponse)
@@ -297,15 +612,24 @@ async def create_custom_emoji(
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    file_data = await file.read()
-    if len(file_data) > settings.max_file_size:
-        raise HTTPException(
-            status_code=400,
-            detail="File exceeds maximum allowed size (5mb)"
-        )
-    
-    #upload to storage
-    object_name = upload_file(file_data, f"{name}.png", file.content_type, "emojis")
+    #stills become a small webp => animations (and anything undecodable) are kept as uploaded
+    check_upload_size(file)
+    object_name = None
+    if should_process(file.content_type, file.size):
+        await file.seek(0)
+        data = await file.read()
+        #keyed by the uploaded bytes => the same picture under another name is stored once
+        object_name, existing = await claim_content(await hash_bytes(data), f"{name}.webp", "emojis", "image/webp")
+        if existing is None:
+            derived = await derive_emoji(data)
+            if derived:
+                await store_bytes(object_name, derived["data"], derived["content_type"], IMMUTABLE_CACHE_CONTROL)
+                await record(object_name, len(derived["data"]))
+            else:
+                await release([{"object_name": object_name}])
+                object_name = None
+    if object_name is None:
+        object_name = (await store_upload(file, "emojis", derive=False))["object_name"]
     file_url = get_file_url(object_name)
     
     emoji = CustomEmoji(
@@ -342,12 +666,10 @@ async def delete_custom_emoji(
     if not emoji:
         raise HTTPException(status_code=404, detail="Emoji not found")
     
-    #delete from storage
+    #drop our reference with the row => the file goes (in the background) once
+    #no other emoji uses the same picture
     if emoji.object_name:
-        try:
-            delete_file(emoji.object_name)
-        except Exception as e:
-            logger.warning(f"Failed to delete emoji file: {e}")
+        await drop_references(db, [{"object_name": emoji.object_name}])
     
     await db.delete(emoji)
     await db.commit()
@@ -365,96 +687,359 @@ async def delete_custom_emoji(
 
 # ============ MESSAGE ROUTES ============
 
-def build_message_response(message: Message) -> MessageResponse:
-    reaction_map = {}
-
-    reactions = getattr(message, 'reactions', None) or []
-    for reaction in reactions:
-        if reaction.emoji not in reaction_map:
-            reaction_map[reaction.emoji] = {
-                "emoji": reaction.emoji, 
-                "count": 0, 
-                "users": [],
-                "user_avatars": [],
-                #add custom emoji URL if present
-                "custom_emoji_url": reaction.custom_emoji.url if reaction.custom_emoji else None
-            }
-        reaction_map[reaction.emoji]["count"] += 1
-        if reaction.user:
-            reaction_map[reaction.emoji]["users"].append(reaction.user.username)
-            reaction_map[reaction.emoji]["user_avatars"].append(reaction.user.avatar or "default")
-    
-    attachments = [Attachment(**a) for a in (message.attachments or [])]
-    
-    reply_info = None
-    if message.parent:
-        reply_info = MessageReplyInfo(
-            id=str(message.parent.id),
-            content=message.parent.content or "Attachment",
-            author_username=message.parent.author.username if message.parent.author else "Unknown"
+async def load_reaction_summaries(db: AsyncSession, message_ids: List[str]) -> tuple:
+    """one summary row per (message, emoji), aggregated by postgres
+
+    only the reaction_summary_users most recent reactors are listed, count
+    stays exact. returns (message_id -> summaries, message_id -> ids of the
+    listed users)
+    """
+    summaries: dict = {}
+    reactor_ids: dict = {}
+    if not message_ids:
+        return summaries, reactor_ids
+    
+    ranked = (
+        select(
+            Reaction.id,
+            Reaction.message_id,
+            Reaction.emoji,
+            Reaction.user_id,
+            Reaction.custom_emoji_id,
+            Reaction.created_at,
+            func.row_number().over(
+                partition_by=(Reaction.message_id, Reaction.emoji),
+                order_by=(Reaction.created_at.desc(), Reaction.id.desc())
+            ).label("recency")
+        )
+        .where(Reaction.message_id.in_(message_ids))
+        .subquery()
+    )
+    listed = ranked.c.recency <= settings.reaction_summary_users
+    #listed users in the order they reacted
+    in_order = (ranked.c.created_at, ranked.c.id)
+    result = await db.execute(
+        select(
+            ranked.c.message_id,
+            ranked.c.emoji,
+            func.count().label("count"),
+            func.array_agg(aggregate_order_by(User.username, *in_order)).filter(listed).label("users"),
+            func.array_agg(aggregate_order_by(
+                func.coalesce(func.nullif(User.avatar, ""), "default"), *in_order
+            )).filter(listed).label("user_avatars"),
+            func.array_agg(aggregate_order_by(ranked.c.user_id, *in_order)).filter(listed).label("user_ids"),
+            func.max(CustomEmoji.url).label("custom_emoji_url")
         )
+        .select_from(ranked)
+        #users are only looked up for the listed rows
+        .outerjoin(User, and_(User.id == ranked.c.user_id, listed))
+        .outerjoin(CustomEmoji, CustomEmoji.id == ranked.c.custom_emoji_id)
+        .group_by(ranked.c.message_id, ranked.c.emoji)
+        .order_by(ranked.c.message_id, func.min(ranked.c.created_at))
+    )
     
-    return MessageResponse(
-        id=str(message.id),
-        content=message.content,
-        author_id=str(message.author_id),
-        author_username=message.author.username if message.author else "Unknown",
-        author_avatar=message.author.avatar if message.author else "default",
-        is_admin=message.author.is_admin if message.author else False,
-        is_pinned=message.is_pinned if message.is_pinned is not None else False,
-        attachments=attachments,
-        reactions=list(reaction_map.values()),
-        created_at=message.created_at or datetime.now(timezone.utc),
-        updated_at=message.updated_at,
-        reply_to=reply_info
+    for row in result.all():
+        summaries.setdefault(row.message_id, []).append({
+            "emoji": row.emoji,
+            "count": row.count,
+            "users": row.users or [],
+            "user_avatars": row.user_avatars or [],
+            "custom_emoji_url": row.custom_emoji_url
+        })
+        reactor_ids.setdefault(row.message_id, set()).update(row.user_ids or [])
+    
+    return summaries, reactor_ids
+
+
+def cache_message_response(row, response: dict, reactor_ids: set, version: int):
+    """remember a built message, indexed by everyone whose avatar it shows"""
+    message_cache.put(response, {str(row.author_id), *reactor_ids}, row.reply_to_id, version)
+
+
+async def load_message_responses(db: AsyncSession, message_ids: List[str]) -> List[dict]:
+    """MessageResponse-shaped dicts in the given order, only cache misses touch the database"""
+    responses = {}
+    missing = []
+    for message_id in message_ids:
+        cached = message_cache.get(message_id)
+        if cached is None:
+            missing.append(message_id)
+        else:
+            responses[message_id] = cached
+    
+    if missing:
+        version = message_cache.version
+        result = await db.execute(message_row_query().where(Message.id.in_(missing)))
+        summaries, reactor_ids = await load_reaction_summaries(db, missing)
+        for row in result.all():
+            response = message_dict(row, summaries.get(row.id))
+            responses[response["id"]] = response
+            cache_message_response(row, response, reactor_ids.get(row.id, set()), version)
+    
+    return [responses[message_id] for message_id in message_ids if message_id in responses]
+
+
+async def warm_message_cache():
+    """build the newest page once at startup so the first visitors hit the cache"""
+    try:
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Message.id)
+                .where(Message.is_pinned == True)
+                .order_by(Message.created_at.desc())
+            )
+            pinned_ids = list(result.scalars().all())
+            result = await db.execute(
+                select(Message.id)
+                .order_by(Message.created_at.desc(), Message.id.desc())
+                .limit(50)
+            )
+            await load_message_responses(db, pinned_ids + list(result.scalars().all()))
+        logger.info(f"Message cache warmed with {message_cache.stats()['size']} messages")
+    except Exception as e:
+        logger.warning(f"Message cache warm-up failed: {e}")
+
+
+def pack_cursor(values: list) -> str:
+    raw = json.dumps(values)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def unpack_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def encode_cursor(message: Message) -> str:
+    """opaque keyset cursor: the (created_at, id) position of a message"""
+    return pack_cursor([message.created_at.isoformat(), str(message.id)])
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        created_at, message_id = unpack_cursor(cursor)
+        return datetime.fromisoformat(created_at), str(message_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def message_row_query():
+    """flat core rows for serializers.message_dict
+    
+    the quoted parent comes from the reply_preview snapshot and reactions are
+    aggregated separately => see load_reaction_summaries
+    """
+    return (
+        select(
+            Message.id,
+            Message.content,
+            Message.author_id,
+            Message.reply_to_id,
+            Message.is_pinned,
+            Message.attachments,
+            Message.created_at,
+            Message.updated_at,
+            Message.reply_count,
+            Message.reply_preview,
+            User.username.label("author_username"),
+            User.avatar.label("author_avatar"),
+            User.is_admin.label("author_is_admin")
+        )
+        .outerjoin(User, User.id == Message.author_id)
     )
 
 
-@app.get("/api/messages", response_model=MessageList)
-async def get_messages(limit: int = 50, before: Optional[str] = None, db: AsyncSession = Depends(get_db)):
-    limit = min(max(1, limit), 100)
+async def build_message_page(
+    db: AsyncSession,
+    limit: int,
+    before: Optional[str],
+    after: Optional[str],
+    around: Optional[str]
+) -> dict:
+    """one page of messages in chronological order
+    
+    every mode is a single range scan on ix_messages_created_at_id_desc,
+    (created_at, id) keeps messages sharing a timestamp apart
+    """
+    position = tuple_(Message.created_at, Message.id)
+    newest_first = (Message.created_at.desc(), Message.id.desc())
+    oldest_first = (Message.created_at.asc(), Message.id.asc())
+    
+    #the page queries only walk the index, full rows are loaded for cache misses
+    page_query = select(Message.id, Message.created_at).where(purge_horizon.visible())
     
     pinned_messages_list = []
-    if not before:
-        pinned_query = select(Message).options(
-            selectinload(Message.author),
-            selectinload(Message.reactions).selectinload(Reaction.user),
-            selectinload(Message.reactions).selectinload(Reaction.custom_emoji), # Load custom emoji
-            selectinload(Message.parent).selectinload(Message.author)
-        ).where(Message.is_pinned == True).order_by(Message.created_at.desc())
+    if not (before or after or around):
+        pinned_query = (
+            select(Message.id)
+            .where(Message.is_pinned == True, purge_horizon.visible())
+            .order_by(Message.created_at.desc())
+        )
         
         pinned_result = await db.execute(pinned_query)
-        pinned_objs = pinned_result.scalars().all()
-        pinned_messages_list = [build_message_response(m) for m in pinned_objs]
-
-    query = select(Message).options(
-        selectinload(Message.author),
-        selectinload(Message.reactions).selectinload(Reaction.user),
-        selectinload(Message.reactions).selectinload(Reaction.custom_emoji), # Load custom emoji
-        selectinload(Message.parent).selectinload(Message.author)
-    ).order_by(Message.created_at.desc()).limit(limit + 1)
-    
-    if before:
-        before_msg = await db.execute(select(Message).where(Message.id == before))
-        before_msg = before_msg.scalar_one_or_none()
-        if before_msg:
-            query = query.where(Message.created_at < before_msg.created_at)
-    
-    result = await db.execute(query)
-    messages = result.scalars().all()
-    
-    has_more = len(messages) > limit
-    if has_more:
-        messages = messages[:-1]
-    
-    messages = list(reversed(messages))
-    
-    return MessageList(
-        messages=[build_message_response(m) for m in messages],
-        pinned_messages=pinned_messages_list,
-        total=len(messages),
-        has_more=has_more
+        pinned_messages_list = await load_message_responses(db, list(pinned_result.scalars().all()))
+
+    if after:
+        result = await db.execute(
+            page_query
+            .where(position > tuple_(*decode_cursor(after)))
+            .order_by(*oldest_first)
+            .limit(limit + 1)
+        )
+        messages = list(result.all())
+        has_newer = len(messages) > limit
+        messages = messages[:limit]
+        has_more = True
+    
+    elif around:
+        anchor = await db.execute(select(Message.created_at).where(Message.id == around))
+        anchor_created_at = anchor.scalar_one_or_none()
+        if anchor_created_at is None:
+            raise HTTPException(status_code=404, detail="Message not found")
+        anchor_position = tuple_(anchor_created_at, around)
+        
+        #the anchor itself is part of the older half
+        older_limit = limit // 2 + 1
+        newer_limit = limit - older_limit
+        older = await db.execute(
+            page_query
+            .where(position <= anchor_position)
+            .order_by(*newest_first)
+            .limit(older_limit + 1)
+        )
+        newer = await db.execute(
+            page_query
+            .where(position > anchor_position)
+            .order_by(*oldest_first)
+            .limit(newer_limit + 1)
+        )
+        older_messages = list(older.all())
+        newer_messages = list(newer.all())
+        has_more = len(older_messages) > older_limit
+        has_newer = len(newer_messages) > newer_limit
+        messages = list(reversed(older_messages[:older_limit])) + newer_messages[:newer_limit]
+    
+    else:
+        query = page_query.order_by(*newest_first).limit(limit + 1)
+        if before:
+            query = query.where(position < tuple_(*decode_cursor(before)))
+    
+        result = await db.execute(query)
+        messages = list(result.all())
+        has_more = len(messages) > limit
+        messages = list(reversed(messages[:limit]))
+        has_newer = bool(before)
+    
+    #MessageList-shaped, field order included
+    return {
+        "messages": await load_message_responses(db, [m.id for m in messages]),
+        "pinned_messages": pinned_messages_list,
+        "total": len(messages),
+        "has_more": has_more,
+        "has_newer": has_newer,
+        "before_cursor": encode_cursor(messages[0]) if messages else None,
+        "after_cursor": encode_cursor(messages[-1]) if messages else None
+    }
+
+
+@app.get("/api/messages", response_model=MessageList)
+async def get_messages(
+    request: Request,
+    limit: int = 50,
+    before: Optional[str] = Query(None, description="Cursor => older messages"),
+    after: Optional[str] = Query(None, description="Cursor => newer messages (catch-up)"),
+    around: Optional[str] = Query(None, description="Message id => page centered on it"),
+    db: AsyncSession = Depends(get_db)
+):
+    """pages are served pre-encoded from the page cache until the next write"""
+    limit = min(max(1, limit), 100)
+    if len([p for p in (before, after, around) if p]) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of before, after or around")
+    
+    key = (limit, before, after, around)
+    page = page_cache.get(key)
+    if page is None:
+        version = page_cache.version
+        message_page = await build_message_page(db, limit, before, after, around)
+        page = page_cache.put(key, encode(message_page), version)
+    etag, body = page
+    
+    #no-cache => browsers keep the page but revalidate it with If-None-Match
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/messages/search", response_model=MessageSearchResponse, response_class=ORJSONResponse)
+async def search_messages(
+    q: str = Query(..., min_length=1, max_length=200, description="Search query (web search syntax)"),
+    limit: int = Query(20, ge=1, le=50),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    db: AsyncSession = Depends(get_db)
+):
+    """ranked full-text search over message content
+    
+    matches come from the GIN index on messages.search_vector, only those
+    are ranked. pages are keyed on (rank, created_at, id) like the timeline
+    """
+    query = func.websearch_to_tsquery("simple", q)
+    rank = func.ts_rank_cd(Message.search_vector, query)
+    position = tuple_(rank, Message.created_at, Message.id)
+    
+    matches = (
+        select(Message.id, Message.created_at, rank.label("rank"))
+        .where(Message.search_vector.op("@@")(query), purge_horizon.visible())
+        .order_by(rank.desc(), Message.created_at.desc(), Message.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        try:
+            cursor_rank, cursor_created_at, cursor_id = unpack_cursor(cursor)
+            after = (float(cursor_rank), datetime.fromisoformat(cursor_created_at), str(cursor_id))
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        matches = matches.where(position < tuple_(*after))
+    matches = matches.subquery()
+    
+    #headlines only for the rows on this page, content escaped first => the
+    #only markup in a snippet is <mark>
+    escaped = func.replace(func.replace(func.replace(
+        func.coalesce(Message.content, ""), "&", "&amp;"), "<", "&lt;"), ">", "&gt;")
+    result = await db.execute(
+        select(
+            matches.c.id,
+            matches.c.created_at,
+            matches.c.rank,
+            func.ts_headline(
+                "simple", escaped, query,
+                "StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=24, MinWords=8"
+            ).label("snippet")
+        )
+        .join(Message, Message.id == matches.c.id)
+        .order_by(matches.c.rank.desc(), matches.c.created_at.desc(), matches.c.id.desc())
     )
+    rows = list(result.all())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    messages = await load_message_responses(db, [row.id for row in rows])
+    by_id = {message["id"]: message for message in messages}
+    last = rows[-1] if rows else None
+    
+    return ORJSONResponse({
+        "results": [
+            {"message": by_id[row.id], "rank": row.rank, "snippet": row.snippet}
+            for row in rows if row.id in by_id
+        ],
+        "has_more": has_more,
+        "next_cursor": pack_cursor([last.rank, last.created_at.isoformat(), str(last.id)]) if has_more else None
+    })
 
 
 async def handle_slash_command(
@@ -465,17 +1050,21 @@ async def handle_slash_command(
 ) -> Optional[dict]:
 
     if command == "/clear":
-        await db.execute(delete(Reaction))
-        await db.execute(delete(Message))
+        #rows are deleted in the background => clients and reads reset right away,
+        #everything up to `before` is hidden until the purge is done
+        purge = await start_purge(db, "clear", user_id=user.id)
         await db.commit()
-        
-        await manager.broadcast({"type": "chat_cleared", "data": {}})
+        await manager.broadcast({
+            "type": "chat_cleared",
+            "data": {"purge_id": purge.id, "before": purge.before.isoformat()}
+        })
         logger.info(f"Chat cleared by admin {user.username}")
         
         return {
             "success": True,
             "command": "clear",
-            "message": "Chat cleared successfully"
+            "message": "Chat cleared successfully",
+            "purge_id": purge.id
         }
 
     elif command == "/pin":
@@ -497,6 +1086,7 @@ async def create_message(
     gif_id: Optional[str] = Form(None),
     gif_preview_url: Optional[str] = Form(None),
     files: List[UploadFile] = File(default=[]),
+    uploads: List[str] = Form(default=[]),  #upload tokens of direct-to-storage uploads
     user: User = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db)
 ):
@@ -517,12 +1107,28 @@ async def create_message(
             content = args
             is_pinned_init = True
 
-    if not content and not files and not gif_url:
+    if not content and not files and not uploads and not gif_url:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, 
             detail="Message must have content, attachments, or a GIF"
         )
     
+    #quote the parent now => reading the reply never touches the parent row
+    preview = None
+    if reply_to_id:
+        result = await db.execute(
+            select(Message.id, Message.content, Message.attachments, User.username)
+            .outerjoin(User, User.id == Message.author_id)
+            .where(Message.id == reply_to_id)
+        )
+        parent = result.one_or_none()
+        if parent is None:
+            raise HTTPException(status_code=404, detail="Replied-to message not found")
+        preview = reply_preview(
+            parent.id, parent.content, parent.attachments, parent.username,
+            settings.reply_preview_length
+        )
+    
     attachments = []
     
     #handle GIF attachment
@@ -535,64 +1141,149 @@ async def create_message(
             "preview_url": gif_preview_url
         })
     
+    #files the client already PUT to storage => a stat each, images are processed after posting
+    direct = await asyncio.gather(*(verify_direct_upload(token, user) for token in uploads))
+    direct_stored = await asyncio.gather(*(process_direct_upload(upload) for upload in direct))
+    
+    proxied = []
     for file in files:
         if file.filename:
-            content_type = file.content_type or "application/octet-stream"
-            if content_type.startswith("image/"):
-                file_type, folder = "image", "images"
-            elif content_type.startswith("audio/"):
-                file_type, folder = "audio", "audio"
-            elif content_type.startswith("video/"):
-                file_type, folder = "video", "video"
-            else:
-                file_type, folder = "file", "files"
-            
-            file_data = await file.read()
+            file_type, folder = classify_upload(file.content_type or "application/octet-stream")
             
-            #check file size
-            if len(file_data) > settings.max_file_size:
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"File {file.filename} exceeds maximum size of {settings.max_file_size // (1024*1024)}MB"
-                )
+            #fail fast => nothing is uploaded if any file is too large
+            check_upload_size(file)
+            proxied.append((file, file_type, folder))
             
-            object_name = upload_file(file_data, file.filename, content_type, folder)
-            file_url = get_file_url(object_name)
+    #all files of a message go to storage concurrently
+    stored = await asyncio.gather(
+        *(store_upload(file, folder) for file, _, folder in proxied),
+        return_exceptions=True
+    )
+    failed = [result for result in stored if isinstance(result, BaseException)]
+    if failed:
+        await release(list(direct_stored) + [result for result in stored if not isinstance(result, BaseException)])
+        raise failed[0]
+    
+    for upload, fields in zip(direct, direct_stored):
+        attachments.append({
+            "type": classify_upload(upload["content_type"])[0],
+            "url": get_file_url(upload["object_name"]),
+            "name": upload["filename"],
+            **fields
+        })
             
-            attachments.append({
-                "type": file_type,
-                "url": file_url,
-                "name": file.filename,
-                "size": len(file_data),
-                "object_name": object_name
-            })
+    for (file, file_type, _), fields in zip(proxied, stored):
+        attachments.append({
+            "type": file_type,
+            "url": get_file_url(fields["object_name"]),
+            "name": file.filename,
+            **fields
+        })
     
     message = Message(
         content=content, 
         author_id=user.id, 
         attachments=attachments,
         reply_to_id=reply_to_id,
+        reply_preview=preview,
         is_pinned=is_pinned_init
     )
     db.add(message)
+    if reply_to_id:
+        await db.execute(
+            update(Message)
+            .where(Message.id == reply_to_id)
+            .values(reply_count=Message.reply_count + 1)
+        )
+    await db.flush()
+    #in the message transaction => a posted image is always processed, a failed post never is
+    for upload in direct:
+        if should_strip(upload["content_type"], upload["size"]):
+            await enqueue(db, "media.process", {
+                "message_id": message.id,
+                "object_name": upload["object_name"],
+                "content_type": upload["content_type"]
+            }, key=f"media.process:{upload['object_name']}")
     await db.commit()
     
-    result = await db.execute(
-        select(Message).options(
-            selectinload(Message.author),
-            selectinload(Message.reactions).selectinload(Reaction.user),
-            selectinload(Message.reactions).selectinload(Reaction.custom_emoji),
-            selectinload(Message.parent).selectinload(Message.author)
-        ).where(Message.id == message.id)
-    )
-    message = result.scalar_one()
+    result = await db.execute(message_row_query().where(Message.id == message.id))
+    row = result.one()
     
-    response = build_message_response(message)
-    await manager.broadcast({"type": "new_message", "data": response.model_dump(mode="json")})
+    #brand new => no reactions yet
+    response = message_dict(row)
+    cache_message_response(row, response, set(), message_cache.version)
+    await manager.broadcast({"type": "new_message", "data": response})
     
     return response
 
 
+#guards the ancestor walk against a (corrupt) reply cycle
+MAX_THREAD_DEPTH = 200
+
+
+@app.get("/api/messages/{message_id}/thread", response_model=MessageThread, response_class=ORJSONResponse)
+async def get_message_thread(
+    message_id: str,
+    limit: int = Query(50, ge=1, le=100),
+    after: Optional[str] = Query(None, description="replies_cursor of the previous page"),
+    db: AsyncSession = Depends(get_db)
+):
+    """ancestor chain plus direct replies of a message, in one query
+    
+    the chain is walked with a recursive CTE over reply_to_id, replies come
+    from ix_messages_reply_to_created
+    """
+    chain = (
+        select(Message.id, Message.reply_to_id, literal(0).label("depth"))
+        .where(Message.id == message_id)
+        .cte("chain", recursive=True)
+    )
+    ancestor = aliased(Message)
+    chain = chain.union_all(
+        select(ancestor.id, ancestor.reply_to_id, chain.c.depth + 1)
+        .join(chain, ancestor.id == chain.c.reply_to_id)
+        .where(chain.c.depth < MAX_THREAD_DEPTH)
+    )
+    
+    replies = (
+        select(Message.id, Message.created_at)
+        .where(Message.reply_to_id == message_id, purge_horizon.visible())
+        .order_by(Message.created_at, Message.id)
+        .limit(limit + 1)
+    )
+    if after:
+        replies = replies.where(tuple_(Message.created_at, Message.id) > tuple_(*decode_cursor(after)))
+    replies = replies.subquery()
+    
+    #depth 0 => the message itself, > 0 => ancestors, -1 => replies
+    result = await db.execute(union_all(
+        select(chain.c.id, chain.c.depth, cast(null(), Message.created_at.type).label("created_at")),
+        select(replies.c.id, literal(-1), replies.c.created_at)
+    ))
+    rows = result.all()
+    
+    ancestor_ids = [row.id for row in sorted(rows, key=lambda r: -r.depth) if row.depth > 0]
+    reply_rows = sorted((row for row in rows if row.depth == -1), key=lambda r: (r.created_at, r.id))
+    if not any(row.depth == 0 for row in rows):
+        raise HTTPException(status_code=404, detail="Message not found")
+    
+    has_more_replies = len(reply_rows) > limit
+    reply_rows = reply_rows[:limit]
+    
+    messages = await load_message_responses(db, [message_id, *ancestor_ids, *(row.id for row in reply_rows)])
+    by_id = {message["id"]: message for message in messages}
+    if message_id not in by_id:
+        raise HTTPException(status_code=404, detail="Message not found")
+    
+    return ORJSONResponse({
+        "message": by_id[message_id],
+        "ancestors": [by_id[i] for i in ancestor_ids if i in by_id],
+        "replies": [by_id[row.id] for row in reply_rows if row.id in by_id],
+        "has_more_replies": has_more_replies,
+        "replies_cursor": encode_cursor(reply_rows[-1]) if has_more_replies else None
+    })
+
+
 @app.post("/api/messages/{message_id}/pin")
 async def toggle_pin_message(
     message_id: str, 
@@ -635,22 +1326,41 @@ async def delete_message(
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
 
+    #files shared with other messages stay until their last reference goes,
+    #the rest is deleted by storage jobs once this transaction commits
     if message.attachments:
-        for attachment in message.attachments:
-            if isinstance(attachment, dict) and "object_name" in attachment:
-                obj_name = attachment.get("object_name")
-                if isinstance(obj_name, str):
-                    try:
-                        delete_file(obj_name)
-                    except Exception as e:
-                        logger.warning(f"Failed to delete attachment {obj_name}: {e}")
+        await drop_references(db, message.attachments)
     
+    reply_to_id = message.reply_to_id
+    #replies keep their quote, marked as deleted (before the FK nulls reply_to_id)
+    #every reply quotes the same parent => one preview serves as the template
+    result = await db.execute(
+        select(Message.reply_preview)
+        .where(Message.reply_to_id == message_id, Message.reply_preview.isnot(None))
+        .limit(1)
+    )
+    quoted = result.scalar_one_or_none()
+    if quoted:
+        await db.execute(
+            update(Message)
+            .where(Message.reply_to_id == message_id)
+            .values(reply_preview=reply_tombstone(quoted))
+        )
     await db.delete(message)
+    if reply_to_id:
+        await db.execute(
+            update(Message)
+            .where(Message.id == reply_to_id)
+            .values(reply_count=func.greatest(Message.reply_count - 1, 0))
+        )
     await db.commit()
     
     logger.info(f"Message {message_id} deleted by {user.username}")
     
-    await manager.broadcast({"type": "message_deleted", "data": {"message_id": message_id}})
+    await manager.broadcast({
+        "type": "message_deleted",
+        "data": {"message_id": message_id, "reply_to_id": reply_to_id}
+    })
     return {"message": "Message deleted"}
 
 
@@ -669,11 +1379,14 @@ async def add_reaction(
     if not request.emoji or len(request.emoji) > 50:
         raise HTTPException(status_code=400, detail="Invalid emoji")
     
-    result = await db.execute(select(Message).where(Message.id == message_id))
+    result = await db.execute(select(Message).where(Message.id == message_id, purge_horizon.visible()))
     message = result.scalar_one_or_none()
     if not message:
         raise HTTPException(status_code=404, detail="Message not found")
     
+    #stateless guests get their users row on the first reaction
+    user = await materialize_guest(user, db)
+    
     #check for custom emoji
     custom_emoji = None
     custom_emoji_url = None
@@ -731,46 +1444,143 @@ async def add_reaction(
     return {"message": "Reaction added", "action": "added"}
 
 
+@app.get("/api/messages/{message_id}/reactions/{emoji}", response_model=ReactionUserList)
+async def get_reaction_users(
+    message_id: str,
+    emoji: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_db)
+):
+    """everyone who reacted with `emoji`, most recent first"""
+    #messages behind a running /clear are gone for every other read
+    visible = await db.execute(select(Message.id).where(Message.id == message_id, purge_horizon.visible()))
+    if visible.scalar_one_or_none() is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    
+    count = await db.execute(
+        select(func.count()).where(Reaction.message_id == message_id, Reaction.emoji == emoji)
+    )
+    total = count.scalar() or 0
+    
+    result = await db.execute(
+        select(Reaction.user_id, Reaction.created_at, User.username, User.avatar)
+        .join(User, User.id == Reaction.user_id)
+        .where(Reaction.message_id == message_id, Reaction.emoji == emoji)
+        .order_by(Reaction.created_at.desc(), Reaction.id.desc())
+        .offset(offset)
+        .limit(limit)
+    )
+    users = [
+        ReactionUser(
+            user_id=str(row.user_id),
+            username=row.username,
+            avatar=row.avatar or "default",
+            created_at=row.created_at
+        )
+        for row in result.all()
+    ]
+    
+    return ReactionUserList(
+        emoji=emoji,
+        count=total,
+        users=users,
+        has_more=offset + len(users) < total
+    )
+
+
+#one page of messages plus its pinned ones
+MY_REACTIONS_MAX_MESSAGES = 200
+
+
+@app.get("/api/reactions/mine", response_model=MyReactions)
+async def get_my_reactions(
+    message_ids: List[str] = Query([], alias="message_id"),
+    user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
+):
+    """the caller's own reactions on a set of messages
+    
+    summaries only list the most recent reactors and pages are shared by
+    everyone => clients look up what they reacted with here
+    """
+    if len(message_ids) > MY_REACTIONS_MAX_MESSAGES:
+        raise HTTPException(status_code=400, detail=f"At most {MY_REACTIONS_MAX_MESSAGES} messages")
+    
+    reactions: dict = {}
+    if user is None or not message_ids:
+        return MyReactions(reactions=reactions)
+    
+    result = await db.execute(
+        select(Reaction.message_id, Reaction.emoji)
+        .join(Message, Message.id == Reaction.message_id)
+        .where(
+            Reaction.user_id == user.id,
+            Reaction.message_id.in_(message_ids),
+            purge_horizon.visible()
+        )
+        .order_by(Reaction.created_at, Reaction.id)
+    )
+    for row in result.all():
+        reactions.setdefault(str(row.message_id), []).append(row.emoji)
+    return MyReactions(reactions=reactions)
+
+
 # ============ WEBSOCKET ============
 
 @app.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket, 
-    token: Optional[str] = None, 
-    db: AsyncSession = Depends(get_db)
+    token: Optional[str] = None,
+    resume_from: Optional[int] = None,
+    epoch: Optional[str] = None
 ):
-    """WebSocket endpoint for real-time updates"""
-    user = None
+    """WebSocket endpoint for real-time updates
     
-    if token:
-        from jose import jwt, JWTError
-        try:
-            payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-            user_id = cast(Optional[str], payload.get("sub"))
-            if user_id:
-                result = await db.execute(select(User).where(User.id == user_id))
-                user = result.scalar_one_or_none()
-        except JWTError:
-            logger.warning("Invalid JWT token in WebSocket connection")
+    sockets live for hours => DB sessions are only opened for the auth lookup
+    and avatar updates, an idle socket holds no pool connection
     
-    if not user:
-        guest_id = generate_guest_id()
-        user = User(username=guest_id, is_admin=False, avatar="default")
-        db.add(user)
-        await db.commit()
-        await db.refresh(user)
+    a reconnecting client passes the last `seq` it saw and the `epoch` from its
+    previous connected frame to get the missed events replayed instead of
+    refetching everything (it gets resync_required if that is not possible,
+    e.g. after a restart or when the reconnect lands on another worker)
+    """
+    user = None
+    new_token = None
+    
+    #guest tokens carry the whole identity => no DB session at all
+    payload = decode_token(token) if token else None
+    if token and not payload:
+        logger.warning("Invalid JWT token in WebSocket connection")
+    if payload:
+        user = guest_from_claims(payload)
+        if not user:
+            async with AsyncSessionLocal() as db:
+                user = await get_user_from_token(token, db)
+    
+    if not user and settings.stateless_guests:
+        user = new_guest()
+        new_token = create_guest_token(user)
     
+    if not user:
+        async with AsyncSessionLocal() as db:
+            guest_id = generate_guest_id()
+            user = User(username=guest_id, is_admin=False, avatar="default")
+            db.add(user)
+            await db.commit()
+            await db.refresh(user)
+        new_token = create_access_token(data={"sub": str(user.id)})
+
     user_info = {
         "username": user.username, 
         "avatar": user.avatar or "default", 
         "is_admin": user.is_admin
     }
-    await manager.connect(websocket, str(user.id), user_info)
-    
-    new_token = create_access_token(data={"sub": str(user.id)}) if not token else None
+    connection_id = await manager.connect(websocket, str(user.id), user_info)
+    note_activity(str(user.id))
     
     try:
-        await websocket.send_json({
+        await manager.start_session(connection_id, {
             "type": "connected",
             "data": {
                 "user_id": str(user.id),
@@ -779,57 +1589,112 @@ async def websocket_endpoint(
                 "is_admin": user.is_admin,
                 "can_post": user.can_post,
                 "token": new_token,
-                "online_users": manager.get_online_users(),
-                "online_count": manager.get_online_count()
+                #capped snapshot => the rest is paged via /api/online
+                "online_users": manager.get_online_users(limit=settings.ws_presence_snapshot_limit),
+                "online_count": manager.get_online_count(),
+                "online_users_truncated": manager.get_online_count() > settings.ws_presence_snapshot_limit
             }
-        })
+        }, resume_from=resume_from, epoch=epoch)
 
         while True:
             data = await websocket.receive_json()
+            manager.touch(connection_id)
+            note_activity(str(user.id))
+            
+            if data.get("type") == "pong":
+                continue
             
             if data.get("type") == "typing":
-                await manager.broadcast({
-                    "type": "typing",
-                    "data": {"user_id": str(user.id), "username": user.username}
-                })
+                await manager.note_typing(str(user.id), user.username)
+            
+            elif data.get("type") == "typing_stop":
+                await manager.stop_typing(str(user.id))
             
             elif data.get("type") == "update_avatar":
                 new_avatar = data.get("avatar", "default")
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(User).where(User.id == user.id).values(avatar=new_avatar)
+                    )
+                    await db.commit()
                 user.avatar = new_avatar
-                await db.commit()
+                if is_stateless_guest(user):
+                    await manager.send_to_connection(connection_id, {
+                        "type": "token_refresh",
+                        "data": {"token": create_guest_token(user)}
+                    })
                 await manager.broadcast({
                     "type": "user_avatar_changed",
                     "data": {"user_id": str(user.id), "avatar": new_avatar}
                 })
     
     except WebSocketDisconnect:
-        await manager.disconnect(str(user.id))
+        await manager.disconnect(connection_id)
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
-        await manager.disconnect(str(user.id))
+        await manager.disconnect(connection_id)
 
 
 # ============ AVATAR ROUTES ============
 
-@app.get("/api/avatars")
-async def get_available_avatars():
-    """get list of available avatars"""
+#(mtime of avatars.json, encoded response body)
+_avatars_body: tuple = (None, b"")
+
+
+def load_avatars_body() -> bytes:
+    """encoded avatar list, only re-read when avatars.json changes"""
+    global _avatars_body
     try:
-        if os.path.exists(settings.avatars_config_path):
+        mtime = os.path.getmtime(settings.avatars_config_path)
+    except OSError:
+        mtime = None
+    if _avatars_body[1] and _avatars_body[0] == mtime:
+        return _avatars_body[1]
+    
+    avatars = [
+        {"id": "default", "name": "Default", "url": "/avatars/default.png"},
+    ]
+    try:
+        if mtime is not None:
             with open(settings.avatars_config_path, 'r') as f:
                 data = json.load(f)
-                return {"avatars": data.get("avatars", [])}
+                avatars = data.get("avatars", [])
     except Exception as e:
         logger.error(f"Error loading avatars: {e}")
     
+    _avatars_body = (mtime, encode({"avatars": avatars}))
+    return _avatars_body[1]
+
+
+@app.get("/api/avatars", response_model=AvatarList)
+async def get_available_avatars():
+    """get list of available avatars
+    
+    the body is encoded once per avatars.json change => returned as is, the
+    response model only documents it
+    """
+    return Response(content=load_avatars_body(), media_type="application/json")
+
+
+# ============ UTILITY ROUTES ============
+
+@app.get("/api/online")
+async def get_online_users(
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=500)
+):
+    """page through online users (admins first)"""
     return {
-        "avatars": [
-            {"id": "default", "name": "Default", "url": "/avatars/default.png"},
-        ]
+        "users": manager.get_online_users(offset=offset, limit=limit),
+        "total": manager.get_online_count()
     }
 
 
-# ============ UTILITY ROUTES ============
+@app.get("/api/connections")
+async def get_connections(user: User = Depends(get_current_admin)):
+    """sockets on this worker with their last inbound activity (admin only)"""
+    return {"connections": manager.get_connection_activity()}
+
 
 @app.get("/api/stats")
 async def get_stats(db: AsyncSession = Depends(get_db)):
@@ -840,7 +1705,10 @@ async def get_stats(db: AsyncSession = Depends(get_db)):
     return {
         "messages": msg_count.scalar(),
         "reactions": reaction_count.scalar(),
-        "online": manager.get_online_count()
+        "online": manager.get_online_count(),
+        "message_cache": message_cache.stats(),
+        "page_cache": page_cache.stats(),
+        "jobs": await jobs.stats(db)
     }
 
 
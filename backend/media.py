@@ -0,0 +1,534 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+from config import get_settings
+import asyncio
+import io
+import logging
+import math
+import multiprocessing
+import zlib
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+#decoding is where image bombs hurt => refuse anything past this many pixels
+Image.MAX_IMAGE_PIXELS = settings.image_max_pixels
+
+#formats the pipeline re-encodes, anything else is stored as uploaded
+PROCESSABLE_TYPES = {"image/jpeg", "image/png", "image/webp", "image/gif", "image/bmp", "image/tiff"}
+#formats whose stored original never keeps its metadata, whatever its size
+#(heif and avif are cleaned without being decoded)
+METADATA_TYPES = PROCESSABLE_TYPES | {"image/heic", "image/heif", "image/avif"}
+
+BLURHASH_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+#components of the placeholder (4x3 => a 28 character hash)
+BLURHASH_X = 4
+BLURHASH_Y = 3
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+# ============ WORKER SIDE (runs in the process pool) ============
+
+def _encode83(value: int, length: int) -> str:
+    return "".join(
+        BLURHASH_CHARS[(value // 83 ** (length - i)) % 83]
+        for i in range(1, length + 1)
+    )
+
+
+def _srgb_to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exp: float) -> float:
+    return math.copysign(abs(value) ** exp, value)
+
+
+def blurhash(image: Image.Image) -> str:
+    """blurhash of an image, computed on a 32px copy (a few ms at most)"""
+    small = image.convert("RGB")
+    small.thumbnail((32, 32))
+    width, height = small.size
+    pixels = [tuple(_srgb_to_linear(c) for c in pixel) for pixel in small.getdata()]
+    
+    factors = []
+    for j in range(BLURHASH_Y):
+        for i in range(BLURHASH_X):
+            norm = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                basis_y = math.cos(math.pi * j * y / height)
+                for x in range(width):
+                    basis = norm * math.cos(math.pi * i * x / width) * basis_y
+                    pr, pg, pb = pixels[y * width + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = 1 / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+    
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((BLURHASH_X - 1) + (BLURHASH_Y - 1) * 9, 1)
+    max_value = max(abs(v) for factor in ac for v in factor)
+    quantised_max = max(0, min(82, int(math.floor(max_value * 166 - 0.5))))
+    max_ac = (quantised_max + 1) / 166
+    result += _encode83(quantised_max, 1)
+    result += _encode83(
+        (_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4
+    )
+    for factor in ac:
+        r, g, b = (
+            max(0, min(18, int(math.floor(_sign_pow(v / max_ac, 0.5) * 9 + 9.5))))
+            for v in factor
+        )
+        result += _encode83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+# ============ METADATA ============
+#formats are edited in place => the coded image data is never touched and
+#the only tag that survives is the exif orientation (it decides how the
+#picture is displayed)
+
+EXIF_ORIENTATION = 0x0112
+#exif tag 0x0112 as SHORT in a big-endian tiff header, the value goes at the end
+_ORIENTATION_IFD = b"MM\x00\x2a\x00\x00\x00\x08\x00\x01\x01\x12\x00\x03\x00\x00\x00\x01"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_METADATA_CHUNKS = {b"eXIf", b"tEXt", b"zTXt", b"iTXt", b"tIME"}
+#application extensions an animated gif needs (loop count)
+GIF_KEPT_APPLICATIONS = (b"NETSCAPE2.0", b"ANIMEXTS1.0", b"ICCRGBG1012")
+HEIF_BRANDS = {b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1", b"avif", b"avis"}
+
+
+def _exif_orientation(tiff: bytes) -> int:
+    """orientation tag of a raw exif block (tiff header onwards), 1 if absent"""
+    if tiff[:2] not in (b"II", b"MM") or len(tiff) < 8:
+        return 1
+    order = "little" if tiff[:2] == b"II" else "big"
+    offset = int.from_bytes(tiff[4:8], order)
+    if offset + 2 > len(tiff):
+        return 1
+    for index in range(int.from_bytes(tiff[offset:offset + 2], order)):
+        entry = offset + 2 + index * 12
+        if entry + 12 > len(tiff):
+            break
+        if int.from_bytes(tiff[entry:entry + 2], order) == EXIF_ORIENTATION:
+            value = int.from_bytes(tiff[entry + 8:entry + 10], order)
+            return value if 1 <= value <= 8 else 1
+    return 1
+
+
+def _orientation_exif(orientation: int) -> bytes:
+    """a raw exif block holding nothing but the orientation"""
+    return _ORIENTATION_IFD + orientation.to_bytes(2, "big") + b"\x00\x00" + b"\x00\x00\x00\x00"
+
+
+def _strip_jpeg(data: bytes) -> bytes:
+    """drop the APP1 (exif/xmp), APP13 (iptc) and comment segments"""
+    out = bytearray(data[:2])
+    pos = 2
+    while pos + 4 <= len(data) and data[pos] == 0xFF:
+        marker = data[pos + 1]
+        if marker == 0xDA:
+            #start of scan => the rest is entropy-coded data
+            break
+        length = int.from_bytes(data[pos + 2:pos + 4], "big")
+        segment = data[pos + 4:pos + 2 + length]
+        if marker == 0xE1 and segment.startswith(b"Exif\x00\x00"):
+            orientation = _exif_orientation(segment[6:])
+            if orientation != 1:
+                payload = b"Exif\x00\x00" + _orientation_exif(orientation)
+                out += b"\xff\xe1" + (len(payload) + 2).to_bytes(2, "big") + payload
+        elif marker not in (0xE1, 0xED, 0xFE):
+            out += data[pos:pos + 2 + length]
+        pos += 2 + length
+    out += data[pos:]
+    return bytes(out)
+
+
+def _png_chunk(chunk_type: bytes, payload: bytes) -> bytes:
+    return (
+        len(payload).to_bytes(4, "big") + chunk_type + payload
+        + zlib.crc32(chunk_type + payload).to_bytes(4, "big")
+    )
+
+
+def _strip_png(data: bytes) -> bytes:
+    """drop the eXIf and text chunks"""
+    out = bytearray(PNG_SIGNATURE)
+    pos = len(PNG_SIGNATURE)
+    while pos + 12 <= len(data):
+        length = int.from_bytes(data[pos:pos + 4], "big")
+        chunk_type = data[pos + 4:pos + 8]
+        end = pos + 12 + length
+        if chunk_type == b"eXIf":
+            orientation = _exif_orientation(data[pos + 8:pos + 8 + length])
+            if orientation != 1:
+                out += _png_chunk(b"eXIf", _orientation_exif(orientation))
+        elif chunk_type not in PNG_METADATA_CHUNKS:
+            out += data[pos:end]
+        pos = end
+        if chunk_type == b"IEND":
+            break
+    return bytes(out)
+
+
+def _strip_webp(data: bytes) -> bytes:
+    """drop the EXIF and XMP chunks and their flags in the VP8X header"""
+    chunks = []
+    pos = 12
+    while pos + 8 <= len(data):
+        fourcc = data[pos:pos + 4]
+        length = int.from_bytes(data[pos + 4:pos + 8], "little")
+        end = pos + 8 + length + (length & 1)
+        if fourcc == b"EXIF":
+            tiff = data[pos + 8:pos + 8 + length]
+            orientation = _exif_orientation(tiff[6:] if tiff.startswith(b"Exif\x00\x00") else tiff)
+            if orientation != 1:
+                payload = _orientation_exif(orientation)
+                chunks.append(b"EXIF" + len(payload).to_bytes(4, "little") + payload)
+        elif fourcc != b"XMP ":
+            chunks.append(data[pos:end])
+        pos = end
+    
+    has_exif = any(chunk[:4] == b"EXIF" for chunk in chunks)
+    for index, chunk in enumerate(chunks):
+        if chunk[:4] == b"VP8X":
+            flags = (chunk[8] & ~0x0C) | (0x08 if has_exif else 0)
+            chunks[index] = chunk[:8] + bytes([flags]) + chunk[9:]
+    body = b"WEBP" + b"".join(chunks)
+    return b"RIFF" + len(body).to_bytes(4, "little") + body
+
+
+def _gif_sub_blocks_end(data: bytes, pos: int) -> int:
+    while pos < len(data) and data[pos]:
+        pos += data[pos] + 1
+    return pos + 1
+
+
+def _strip_gif(data: bytes) -> bytes:
+    """drop comments and application extensions (xmp), except the loop count"""
+    packed = data[10]
+    pos = 13 + ((3 << ((packed & 0x07) + 1)) if packed & 0x80 else 0)
+    out = bytearray(data[:pos])
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x2C:
+            #image descriptor, optional local color table, lzw code size, image data
+            packed = data[pos + 9] if pos + 9 < len(data) else 0
+            start = pos + 10 + ((3 << ((packed & 0x07) + 1)) if packed & 0x80 else 0)
+            end = _gif_sub_blocks_end(data, start + 1)
+            out += data[pos:end]
+        elif block == 0x21 and pos + 1 < len(data):
+            label = data[pos + 1]
+            end = _gif_sub_blocks_end(data, pos + 2)
+            application = data[pos + 3:pos + 14] if label == 0xFF else b""
+            if label != 0xFE and (label != 0xFF or application.startswith(GIF_KEPT_APPLICATIONS)):
+                out += data[pos:end]
+        else:
+            #trailer (or garbage after the last frame)
+            out += data[pos:]
+            break
+        pos = end
+    return bytes(out)
+
+
+def _boxes(data: bytes, start: int, end: int):
+    """(type, payload start, box end) of the isobmff boxes in data[start:end]"""
+    pos = start
+    while pos + 8 <= end:
+        size = int.from_bytes(data[pos:pos + 4], "big")
+        header = 8
+        if size == 1:
+            size = int.from_bytes(data[pos + 8:pos + 16], "big")
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            return
+        yield data[pos + 4:pos + 8], pos + header, pos + size
+        pos += size
+
+
+def _heif_metadata_items(data: bytes, start: int, end: int) -> set:
+    """ids of the exif and xmp items listed in an iinf box"""
+    version = data[start]
+    pos = start + (6 if version == 0 else 8)
+    items = set()
+    for box_type, payload, box_end in _boxes(data, pos, end):
+        if box_type != b"infe" or data[payload] < 2:
+            continue
+        id_size = 2 if data[payload] == 2 else 4
+        field = payload + 4
+        item_id = int.from_bytes(data[field:field + id_size], "big")
+        item_type = data[field + id_size + 2:field + id_size + 6]
+        names = data[field + id_size + 6:box_end].split(b"\x00")
+        content_type = names[1] if len(names) > 1 else b""
+        if item_type == b"Exif" or (item_type == b"mime" and content_type == b"application/rdf+xml"):
+            items.add(item_id)
+    return items
+
+
+def _heif_item_extents(data: bytes, start: int, items: set, idat: int) -> List[tuple]:
+    """(offset, length) in the file of the given items, from an iloc box"""
+    version = data[start]
+    offset_size, length_size = data[start + 4] >> 4, data[start + 4] & 0x0F
+    base_offset_size, index_size = data[start + 5] >> 4, data[start + 5] & 0x0F
+    if version not in (1, 2):
+        index_size = 0
+    id_size = 2 if version < 2 else 4
+    pos = start + 6
+    
+    def read(size: int) -> int:
+        nonlocal pos
+        value = int.from_bytes(data[pos:pos + size], "big")
+        pos += size
+        return value
+    
+    extents = []
+    for _ in range(read(id_size)):
+        item_id = read(id_size)
+        method = read(2) & 0x0F if version in (1, 2) else 0
+        read(2)  #data reference index
+        base = read(base_offset_size)
+        for _ in range(read(2)):
+            read(index_size)
+            offset, length = read(offset_size), read(length_size)
+            if item_id not in items or method > 1 or (method == 1 and idat < 0):
+                continue
+            extents.append(((idat if method == 1 else 0) + base + offset, length))
+    return extents
+
+
+def _strip_heif(data: bytes) -> bytes:
+    """blank the exif and xmp items => no offset in the file has to move"""
+    out = bytearray(data)
+    for box_type, payload, end in _boxes(data, 0, len(data)):
+        if box_type != b"meta":
+            continue
+        children = {child: (child_start, child_end) for child, child_start, child_end in _boxes(data, payload + 4, end)}
+        if b"iinf" not in children or b"iloc" not in children:
+            continue
+        items = _heif_metadata_items(data, *children[b"iinf"])
+        idat = children[b"idat"][0] if b"idat" in children else -1
+        for offset, length in _heif_item_extents(data, children[b"iloc"][0], items, idat):
+            if length and offset + length <= len(out):
+                out[offset:offset + length] = bytes(length)
+    return bytes(out)
+
+
+def strip_metadata(data: bytes) -> Optional[bytes]:
+    """the same image without exif, xmp, iptc and comments, None if there was nothing to strip
+    
+    the format is told by its magic bytes, not by the claimed content type
+    """
+    try:
+        if data[:3] == b"\xff\xd8\xff":
+            stripped = _strip_jpeg(data)
+        elif data[:8] == PNG_SIGNATURE:
+            stripped = _strip_png(data)
+        elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+            stripped = _strip_webp(data)
+        elif data[:6] in (b"GIF87a", b"GIF89a"):
+            stripped = _strip_gif(data)
+        elif data[4:8] == b"ftyp" and (
+            data[8:12] in HEIF_BRANDS
+            or any(data[i:i + 4] in HEIF_BRANDS for i in range(16, min(len(data), int.from_bytes(data[:4], "big")), 4))
+        ):
+            stripped = _strip_heif(data)
+        else:
+            return None
+    except IndexError:
+        #truncated file => nothing safe to write back
+        logger.warning("Could not strip metadata from a truncated image")
+        return None
+    return stripped if stripped != data else None
+
+
+def _encode(image: Image.Image, fmt: str, quality: int, **options) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=quality, **options)
+    return buffer.getvalue()
+
+
+def _clean_tiff(image: Image.Image) -> bytes:
+    """tiff keeps its metadata in the same ifd as the pixel layout => re-encoded losslessly
+    
+    the orientation is baked into the pixels, only the color profile is carried over
+    """
+    upright = ImageOps.exif_transpose(image)
+    upright.info = {key: image.info[key] for key in ("icc_profile", "dpi") if key in image.info}
+    buffer = io.BytesIO()
+    upright.save(buffer, "TIFF", compression="tiff_lzw")
+    return buffer.getvalue()
+
+
+def clean_original(data: bytes, image: Optional[Image.Image] = None) -> Optional[bytes]:
+    """the original without metadata, None if there was none to strip"""
+    if data[:4] not in (b"II*\x00", b"MM\x00*"):
+        return strip_metadata(data)
+    if image is not None:
+        return _clean_tiff(image)
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        return _clean_tiff(image)
+
+
+def _rendition(image: Image.Image, label: str, max_edge: int, fmt: str) -> dict:
+    copy = image.copy()
+    copy.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+    if fmt == "AVIF":
+        data = _encode(copy, "AVIF", settings.image_avif_quality)
+    else:
+        data = _encode(copy, "WEBP", settings.image_webp_quality, method=4)
+    return {
+        "label": label,
+        "content_type": f"image/{fmt.lower()}",
+        "ext": fmt.lower(),
+        "width": copy.width,
+        "height": copy.height,
+        "data": data
+    }
+
+
+def _can_encode(fmt: str) -> bool:
+    Image.init()
+    return fmt in Image.SAVE
+
+
+def process_image(data: bytes) -> dict:
+    """renditions, dimensions and placeholder of one image
+    
+    cpu bound => runs in the process pool, never on the event loop. renditions
+    are size bounded, orientation corrected and carry no metadata
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        animated = getattr(image, "is_animated", False)
+        cleaned = clean_original(data, image)
+        
+        upright = ImageOps.exif_transpose(image)
+        if upright.mode not in ("RGB", "RGBA"):
+            has_alpha = upright.mode in ("LA", "PA") or "transparency" in upright.info
+            upright = upright.convert("RGBA" if has_alpha else "RGB")
+        
+        result = {
+            "width": upright.width,
+            "height": upright.height,
+            "placeholder": blurhash(upright),
+            "original": cleaned,
+            "renditions": []
+        }
+        #still renditions of an animation would freeze it => the original plays as is
+        if animated:
+            return result
+        
+        formats = ["WEBP"] + (["AVIF"] if _can_encode("AVIF") else [])
+        for label, max_edge in (("thumb", settings.image_thumbnail_size), ("display", settings.image_display_size)):
+            #never upscale => a small image only gets the renditions it needs
+            if label == "display" and max(upright.size) <= settings.image_thumbnail_size:
+                continue
+            for fmt in formats:
+                result["renditions"].append(_rendition(upright, label, max_edge, fmt))
+        return result
+
+
+def process_emoji(data: bytes) -> Optional[dict]:
+    """a still emoji as a small webp, None for animations (stored as uploaded)"""
+    with Image.open(io.BytesIO(data)) as image:
+        if getattr(image, "is_animated", False):
+            return None
+        upright = ImageOps.exif_transpose(image).convert("RGBA")
+        upright.thumbnail((settings.emoji_size, settings.emoji_size), Image.Resampling.LANCZOS)
+        return {"content_type": "image/webp", "ext": "webp", "data": _encode(upright, "WEBP", 90, method=4)}
+
+
+# ============ EVENT LOOP SIDE ============
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        #spawn => workers don't inherit the loop, sockets or threads of this process
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.image_workers,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def should_process(content_type: str, size: Optional[int]) -> bool:
+    return (
+        settings.image_processing
+        and content_type in PROCESSABLE_TYPES
+        and size is not None
+        and size <= settings.image_process_max_bytes
+    )
+
+
+def should_strip(content_type: str, size: Optional[int]) -> bool:
+    return content_type in METADATA_TYPES and size is not None and size <= settings.max_file_size
+
+
+async def strip_image(data: bytes) -> Optional[bytes]:
+    """clean_original in the pool, None if there was nothing to strip (or it failed)"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), clean_original, data)
+    except Exception as e:
+        logger.warning(f"Stripping image metadata failed: {e}")
+        return None
+
+
+async def derive_image(data: bytes) -> Optional[dict]:
+    """process_image in the pool, None if the image can't be decoded"""
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), process_image, data)
+    except Exception as e:
+        #undecodable or too many pixels => the file is still stored, just without extras
+        logger.warning(f"Image processing failed: {e}")
+        return None
+
+
+async def derive_emoji(data: bytes) -> Optional[dict]:
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_get_pool(), process_emoji, data)
+    except Exception as e:
+        logger.warning(f"Emoji processing failed: {e}")
+        return None
+
+
+def rendition_object_name(object_name: str, label: str, ext: str) -> str:
+    """images/<uuid>.jpg -> images/<uuid>.<label>.<ext>, next to the original"""
+    base = object_name.rsplit(".", 1)[0] if "." in object_name.rsplit("/", 1)[-1] else object_name
+    return f"{base}.{label}.{ext}"
+
+
+def attachment_object_names(attachment: dict) -> List[str]:
+    """every stored object of an attachment, renditions included"""
+    names = []
+    if isinstance(attachment.get("object_name"), str):
+        names.append(attachment["object_name"])
+    for rendition in attachment.get("renditions") or []:
+        if isinstance(rendition, dict) and isinstance(rendition.get("object_name"), str):
+            names.append(rendition["object_name"])
+    return names
@@ -0,0 +1,231 @@
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Set, Tuple
+from config import get_settings
+import hashlib
+
+settings = get_settings()
+
+
+class MessageCache:
+    """lru of MessageResponse-shaped dicts keyed by message id
+    
+    entries are invalidated from the broadcast events that change them, so a
+    cached message is always what a fresh serializers.message_dict would return
+    """
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        #reverse indexes => precise invalidation without scanning every entry
+        #user_id -> messages showing that user (author or reactor)
+        self._by_user: Dict[str, Set[str]] = {}
+        #parent message id -> cached replies quoting it
+        self._by_parent: Dict[str, Set[str]] = {}
+        #message id -> (user ids, parent id) it was indexed under
+        self._keys: Dict[str, tuple] = {}
+        #bumped on every invalidation => a build that raced one is not stored
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def get(self, message_id: str) -> Optional[dict]:
+        response = self._entries.get(message_id)
+        if response is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(message_id)
+        self.hits += 1
+        return response
+    
+    def put(
+        self,
+        response: dict,
+        user_ids: Iterable[str],
+        parent_id: Optional[str],
+        version: int
+    ):
+        """store a built message unless something was invalidated since `version`"""
+        if version != self.version or self.max_size <= 0:
+            return
+        
+        message_id = response["id"]
+        self._unindex(message_id)
+        self._entries[message_id] = response
+        self._entries.move_to_end(message_id)
+        
+        user_ids = set(user_ids)
+        for user_id in user_ids:
+            self._by_user.setdefault(user_id, set()).add(message_id)
+        if parent_id:
+            self._by_parent.setdefault(parent_id, set()).add(message_id)
+        self._keys[message_id] = (user_ids, parent_id)
+        
+        while len(self._entries) > self.max_size:
+            oldest, _ = self._entries.popitem(last=False)
+            self._unindex(oldest)
+    
+    def _unindex(self, message_id: str):
+        keys = self._keys.pop(message_id, None)
+        if keys is None:
+            return
+        user_ids, parent_id = keys
+        for user_id in user_ids:
+            messages = self._by_user.get(user_id)
+            if messages is not None:
+                messages.discard(message_id)
+                if not messages:
+                    del self._by_user[user_id]
+        if parent_id and parent_id in self._by_parent:
+            self._by_parent[parent_id].discard(message_id)
+            if not self._by_parent[parent_id]:
+                del self._by_parent[parent_id]
+    
+    def invalidate(self, message_ids: Iterable[str]):
+        self.version += 1
+        for message_id in list(message_ids):
+            if self._entries.pop(message_id, None) is not None:
+                self.invalidations += 1
+            self._unindex(message_id)
+    
+    def invalidate_user(self, user_id: str):
+        self.invalidate(self._by_user.get(user_id, ()))
+    
+    def invalidate_replies(self, parent_id: str):
+        self.invalidate(self._by_parent.get(parent_id, ()))
+    
+    def clear(self):
+        self.version += 1
+        self.invalidations += len(self._entries)
+        self._entries.clear()
+        self._by_user.clear()
+        self._by_parent.clear()
+        self._keys.clear()
+    
+    def on_event(self, message: dict):
+        """websocket manager listener, sees local and cross-worker broadcasts alike"""
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        
+        if event_type in ("reaction_added", "reaction_removed", "message_pinned_update"):
+            self.invalidate([data.get("message_id")])
+        
+        elif event_type == "new_message":
+            #the parent's reply_count went up
+            if data.get("reply_to"):
+                self.invalidate([data["reply_to"]["id"]])
+        
+        elif event_type == "message_deleted":
+            #replies quote the deleted parent => they lose their reply_to
+            self.invalidate_replies(data.get("message_id"))
+            self.invalidate([data.get("message_id"), data.get("reply_to_id")])
+        
+        elif event_type == "attachments_updated":
+            #renditions of a direct upload landed after the post
+            self.invalidate([data.get("id")])
+        
+        elif event_type == "user_avatar_changed":
+            self.invalidate_user(data.get("user_id"))
+        
+        elif event_type in ("chat_cleared", "custom_emoji_removed"):
+            self.clear()
+        
+        elif event_type == "purge_progress" and data.get("done") and data.get("reason") != "clear":
+            #surviving replies of purged messages were tombstoned in bulk =>
+            #dropped once at the end, the purged rows were hidden from the start
+            self.clear()
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+#events after which any page of /api/messages may look different
+PAGE_CHANGING_EVENTS = {
+    "new_message", "message_deleted", "message_pinned_update",
+    "reaction_added", "reaction_removed", "user_avatar_changed",
+    "chat_cleared", "custom_emoji_removed", "purge_started", "attachments_updated"
+}
+
+
+def changes_pages(message: dict) -> bool:
+    """purge batches only delete rows the horizon already hides => pages
+    change when a purge starts and once more for the tombstoned quotes when
+    it is done"""
+    if message.get("type") == "purge_progress":
+        return bool((message.get("data") or {}).get("done"))
+    return message.get("type") in PAGE_CHANGING_EVENTS
+
+
+class PageCache:
+    """encoded /api/messages bodies with their etags, valid for one version
+    
+    the version is bumped on every write that can change a page, the etag is
+    a hash of the body => identical on every worker and stable across bumps
+    that did not touch the page
+    """
+    
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        #query key -> (version, etag, body)
+        self._pages: "OrderedDict[Hashable, Tuple[int, str, bytes]]" = OrderedDict()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: Hashable) -> Optional[Tuple[str, bytes]]:
+        page = self._pages.get(key)
+        if page is None or page[0] != self.version:
+            self.misses += 1
+            return None
+        self._pages.move_to_end(key)
+        self.hits += 1
+        return page[1], page[2]
+    
+    def put(self, key: Hashable, body: bytes, version: int) -> Tuple[str, bytes]:
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        #built from data older than the current version => serve it once, don't keep it
+        if version == self.version and self.max_size > 0:
+            self._pages[key] = (version, etag, body)
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.max_size:
+                self._pages.popitem(last=False)
+        return etag, body
+    
+    def on_event(self, message: dict):
+        if changes_pages(message):
+            self.version += 1
+            #every stored page is stale now
+            self._pages.clear()
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._pages),
+            "version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison, so W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+message_cache = MessageCache(settings.message_cache_size)
+page_cache = PageCache(settings.message_page_cache_size)
\ No newline at end of file
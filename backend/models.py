@@ -1,4 +1,5 @@
-from sqlalchemy import String, Boolean, DateTime, Text, ForeignKey, JSON, Index, Enum as SQLEnum
+from sqlalchemy import String, Boolean, DateTime, Text, Integer, BigInteger, ForeignKey, JSON, Index, Computed, Enum as SQLEnum, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import relationship, declarative_base, Mapped, mapped_column
 from sqlalchemy.sql import func
 import uuid
@@ -133,6 +134,13 @@ class Message(Base):
         nullable=False,
         index=True
     )
+    #direct replies, maintained on reply create/delete (never counted at read time)
+    reply_count: Mapped[int] = mapped_column(
+        Integer,
+        default=0,
+        server_default="0",
+        nullable=False
+    )
     created_at: Mapped[datetime] = mapped_column(
         DateTime(timezone=True), 
         server_default=func.now(),
@@ -148,6 +156,21 @@ class Message(Base):
         default=list,
         nullable=False
     )  #[{type: "image"|"gif"|"audio"|"video"|"file", url: "...", name: "...", gif_id?: "..."}]
+    #quote of the parent snapshotted when the reply is posted, tombstoned
+    #when the parent is deleted => pages never load the parent row
+    #{id, content, author_username, attachment_only, deleted}
+    reply_preview: Mapped[Optional[dict]] = mapped_column(
+        JSON(none_as_null=True),
+        nullable=True
+    )
+    #full-text search document, generated by postgres on insert/update
+    #('simple' => no language specific stemming, posts can be in any language)
+    search_vector: Mapped[Optional[str]] = mapped_column(
+        TSVECTOR,
+        Computed("to_tsvector('simple', coalesce(content, ''))", persisted=True),
+        nullable=True,
+        deferred=True
+    )
     
     #relationships
     author: Mapped["User"] = relationship("User", back_populates="messages")
@@ -164,8 +187,12 @@ class Message(Base):
     
     #indexes
     __table_args__ = (
-        Index('ix_messages_created_at_desc', created_at.desc()),
+        #keyset pagination cursor => (created_at, id) ties never skip a message
+        Index('ix_messages_created_at_id_desc', created_at.desc(), id.desc()),
         Index('ix_messages_pinned_created', is_pinned, created_at.desc()),
+        Index('ix_messages_search_vector', search_vector, postgresql_using='gin'),
+        #direct replies of a message in thread order
+        Index('ix_messages_reply_to_created', reply_to_id, created_at, id),
     )
 
 
@@ -211,4 +238,189 @@ class Reaction(Base):
 
     __table_args__ = (
         Index('ix_reactions_message_user_emoji', message_id, user_id, emoji, unique=True),
-    )
\ No newline at end of file
+    )
+
+
+class StoredObject(Base):
+    """one object in storage, shared by every attachment/emoji with the same bytes
+    
+    uploads are keyed by the hash of their content, so uploading a known file
+    only takes another reference. the object (and its renditions) is deleted
+    once the last reference is released
+    """
+    __tablename__ = "stored_objects"
+    
+    object_name: Mapped[str] = mapped_column(
+        String(255),
+        primary_key=True
+    )
+    #sha256 of the uploaded bytes, null for direct uploads (stored under a uuid)
+    sha256: Mapped[Optional[str]] = mapped_column(
+        String(64),
+        nullable=True
+    )
+    size: Mapped[int] = mapped_column(
+        BigInteger,
+        default=0,
+        server_default="0",
+        nullable=False
+    )
+    content_type: Mapped[str] = mapped_column(
+        String(255),
+        nullable=False
+    )
+    ref_count: Mapped[int] = mapped_column(
+        Integer,
+        default=1,
+        server_default="1",
+        nullable=False
+    )
+    #set by record() once the bytes are in storage => a row that is still
+    #uploading (or whose upload failed) is never a dedup hit. cleared again by
+    #storage.collect => unreferenced and not stored is a tombstone
+    stored: Mapped[bool] = mapped_column(
+        Boolean,
+        default=False,
+        server_default=text("false"),
+        nullable=False
+    )
+    #image fields of the attachment (dimensions, placeholder, renditions)
+    #=> a dedup hit reuses them instead of processing the image again
+    derived: Mapped[Optional[dict]] = mapped_column(
+        JSON(none_as_null=True),
+        nullable=True
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now()
+    )
+    
+    __table_args__ = (
+        #unreferenced objects waiting to be deleted
+        Index('ix_stored_objects_unreferenced', 'object_name', postgresql_where=text('ref_count <= 0')),
+    )
+
+
+class ChatPurge(Base):
+    """a background delete of every message created at or before `before`
+    
+    /clear and the retention sweep only insert one of these, batches are
+    deleted by a task that records its progress here (and resumes after a
+    restart)
+    """
+    __tablename__ = "chat_purges"
+    
+    id: Mapped[str] = mapped_column(
+        String(36),
+        primary_key=True,
+        default=generate_uuid
+    )
+    reason: Mapped[str] = mapped_column(String(20), nullable=False)  #"clear", "retention"
+    before: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        nullable=False
+    )
+    status: Mapped[str] = mapped_column(
+        String(20),
+        default="running",
+        server_default="running",
+        nullable=False,
+        index=True
+    )  #"running", "done"
+    deleted: Mapped[int] = mapped_column(
+        Integer,
+        default=0,
+        server_default="0",
+        nullable=False
+    )
+    created_by_id: Mapped[Optional[str]] = mapped_column(
+        String(36),
+        ForeignKey("users.id", ondelete="SET NULL"),
+        nullable=True
+    )
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now()
+    )
+    #touched after every batch => when the purge last made progress
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now()
+    )
+    finished_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True
+    )
+
+
+class Job(Base):
+    """a deferred side-effect (storage deletes, media processing, purges)
+    
+    inserted in the transaction of the change that needs it => a job exists
+    exactly when that change was committed. workers claim jobs with SKIP
+    LOCKED and hold a lease that they renew while the handler runs
+    """
+    __tablename__ = "jobs"
+    
+    id: Mapped[str] = mapped_column(
+        String(36),
+        primary_key=True,
+        default=generate_uuid
+    )
+    kind: Mapped[str] = mapped_column(String(50), nullable=False)
+    payload: Mapped[dict] = mapped_column(
+        JSON,
+        default=dict,
+        nullable=False
+    )
+    #enqueueing the same key twice keeps the first job (until it is pruned)
+    idempotency_key: Mapped[Optional[str]] = mapped_column(
+        String(255),
+        unique=True,
+        nullable=True
+    )
+    status: Mapped[str] = mapped_column(
+        String(20),
+        default="queued",
+        server_default="queued",
+        nullable=False
+    )  #"queued", "running", "done", "failed"
+    attempts: Mapped[int] = mapped_column(
+        Integer,
+        default=0,
+        server_default="0",
+        nullable=False
+    )
+    max_attempts: Mapped[int] = mapped_column(Integer, nullable=False)
+    #not before => retries are pushed back here
+    run_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+    locked_until: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True
+    )
+    #new on every claim => a worker whose lease ran out can no longer renew
+    #or finish the job once another worker claimed it again
+    lease_token: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    last_error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now()
+    )
+    started_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True
+    )
+    finished_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True
+    )
+    
+    __table_args__ = (
+        #the claim query: next due job
+        Index('ix_jobs_status_run_at', status, run_at),
+    )
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 
 
@@ -43,6 +43,16 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+class ImageRendition(BaseModel):
+    label: str  #"thumb", "display"
+    url: str
+    content_type: str  #"image/webp", "image/avif"
+    width: int
+    height: int
+    size: Optional[int] = None
+    object_name: Optional[str] = None
+
+
 class Attachment(BaseModel):
     type: str  #"image", "audio", "video", "file", "gif"
     url: str
@@ -51,6 +61,28 @@ class Attachment(BaseModel):
     object_name: Optional[str] = None
     gif_id: Optional[str] = None
     preview_url: Optional[str] = None
+    #images only => lets clients lay out (and blur in) before fetching anything
+    width: Optional[int] = None
+    height: Optional[int] = None
+    placeholder: Optional[str] = None  #blurhash
+    renditions: Optional[List[ImageRendition]] = None
+
+
+class UploadSessionRequest(BaseModel):
+    filename: str = Field(..., min_length=1, max_length=255)
+    content_type: str = "application/octet-stream"
+    #declared size => oversized files are refused before any byte is sent
+    size: int = Field(..., ge=0)
+
+
+class UploadSessionResponse(BaseModel):
+    #PUT the file here with the same Content-Type, then pass upload_token to
+    #POST /api/messages as an `uploads` form field
+    upload_url: str
+    upload_token: str
+    object_name: str
+    url: str
+    expires_in: int
 
 
 class ReactionBase(BaseModel):
@@ -75,12 +107,32 @@ class ReactionResponse(BaseModel):
 
 class ReactionSummary(BaseModel):
     emoji: str
+    #exact total, users/user_avatars only hold the most recent reactors
     count: int
     users: List[str]
     user_avatars: Optional[List[str]] = None
     custom_emoji_url: Optional[str] = None
 
 
+class ReactionUser(BaseModel):
+    user_id: str
+    username: str
+    avatar: str
+    created_at: datetime
+
+
+class ReactionUserList(BaseModel):
+    emoji: str
+    count: int
+    users: List[ReactionUser]
+    has_more: bool
+
+
+class MyReactions(BaseModel):
+    #message id -> emojis the current user reacted with
+    reactions: Dict[str, List[str]]
+
+
 class MessageBase(BaseModel):
     content: Optional[str] = None
 
@@ -93,6 +145,9 @@ class MessageReplyInfo(BaseModel):
     id: str
     content: Optional[str]
     author_username: str
+    attachment_only: bool = False
+    #the parent was deleted after the reply was posted
+    deleted: bool = False
     
     class Config:
         from_attributes = True
@@ -111,6 +166,7 @@ class MessageResponse(BaseModel):
     created_at: datetime
     updated_at: Optional[datetime] = None
     reply_to: Optional[MessageReplyInfo] = None
+    reply_count: int = 0
     
     class Config:
         from_attributes = True
@@ -121,6 +177,34 @@ class MessageList(BaseModel):
     pinned_messages: List[MessageResponse] = []
     total: int
     has_more: bool
+    has_newer: bool = False
+    #pass as before= / after= to continue paging from either end of this page
+    before_cursor: Optional[str] = None
+    after_cursor: Optional[str] = None
+
+
+class MessageThread(BaseModel):
+    message: MessageResponse
+    #root first, ending with the direct parent
+    ancestors: List[MessageResponse]
+    #direct replies, oldest first
+    replies: List[MessageResponse]
+    has_more_replies: bool
+    #pass as after= to get the next replies
+    replies_cursor: Optional[str] = None
+
+
+class MessageSearchHit(BaseModel):
+    message: MessageResponse
+    rank: float
+    #html-escaped content with the matches wrapped in <mark>
+    snippet: str
+
+
+class MessageSearchResponse(BaseModel):
+    results: List[MessageSearchHit]
+    has_more: bool
+    next_cursor: Optional[str] = None
 
 
 class CommandResponse(BaseModel):
@@ -156,4 +240,14 @@ class GifSearchResult(BaseModel):
 
 class GifSearchResponse(BaseModel):
     results: List[GifSearchResult]
-    next: Optional[str] = None
\ No newline at end of file
+    next: Optional[str] = None
+
+
+class Avatar(BaseModel):
+    id: str
+    name: str
+    url: str
+
+
+class AvatarList(BaseModel):
+    avatars: List[Avatar]
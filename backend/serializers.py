@@ -0,0 +1,93 @@
+from datetime import datetime, timezone
+from typing import Any, Optional
+from schemas import Attachment, ImageRendition
+import orjson
+
+#lean read path: core rows -> plain dicts -> orjson, no ORM objects or model
+#validation. the output matches what the pydantic response models produce
+
+
+def json_datetime(value: Optional[datetime]) -> Optional[str]:
+    """same text pydantic emits for a datetime (utc => Z suffix)"""
+    if value is None:
+        return None
+    text = value.isoformat()
+    if text.endswith("+00:00"):
+        return text[:-6] + "Z"
+    return text
+
+
+def _schema_dict(data: dict, model) -> dict:
+    return {name: data.get(name, field.default) for name, field in model.model_fields.items()}
+
+
+def attachment_dict(attachment: dict) -> dict:
+    """every Attachment field in schema order, unknown keys dropped (renditions too)"""
+    result = _schema_dict(attachment, Attachment)
+    if result["renditions"] is not None:
+        result["renditions"] = [_schema_dict(r, ImageRendition) for r in result["renditions"]]
+    return result
+
+
+def reply_preview(parent_id: str, content: Optional[str], attachments: Optional[list], author_username: Optional[str], length: int) -> dict:
+    """snapshot of a parent message stored on the reply (Message.reply_preview)"""
+    return {
+        "id": str(parent_id),
+        "content": content[:length] if content else None,
+        "author_username": author_username if author_username is not None else "Unknown",
+        "attachment_only": not content and bool(attachments),
+        "deleted": False
+    }
+
+
+def reply_tombstone(preview: dict) -> dict:
+    return {**preview, "content": None, "attachment_only": False, "deleted": True}
+
+
+def reply_info_dict(preview: Optional[dict]) -> Optional[dict]:
+    """MessageReplyInfo-shaped dict from a stored preview"""
+    if not preview:
+        return None
+    deleted = bool(preview.get("deleted"))
+    return {
+        "id": preview["id"],
+        "content": None if deleted else (preview.get("content") or "Attachment"),
+        "author_username": preview.get("author_username") or "Unknown",
+        "attachment_only": bool(preview.get("attachment_only")),
+        "deleted": deleted
+    }
+
+
+def message_dict(row: Any, reactions: Optional[list] = None) -> dict:
+    """MessageResponse-shaped dict from a message_row_query() row"""
+    has_author = row.author_username is not None
+    
+    return {
+        "id": str(row.id),
+        "content": row.content,
+        "author_id": str(row.author_id),
+        "author_username": row.author_username if has_author else "Unknown",
+        "author_avatar": row.author_avatar if has_author else "default",
+        "is_admin": row.author_is_admin if has_author else False,
+        "is_pinned": row.is_pinned if row.is_pinned is not None else False,
+        "attachments": [attachment_dict(a) for a in (row.attachments or [])],
+        "reactions": reactions or [],
+        "created_at": json_datetime(row.created_at or datetime.now(timezone.utc)),
+        "updated_at": json_datetime(row.updated_at),
+        "reply_to": reply_info_dict(row.reply_preview),
+        "reply_count": row.reply_count or 0
+    }
+
+
+def custom_emoji_dict(row: Any) -> dict:
+    """CustomEmojiResponse-shaped dict"""
+    return {
+        "id": str(row.id),
+        "name": row.name,
+        "url": row.url,
+        "created_at": json_datetime(row.created_at)
+    }
+
+
+def encode(content: Any) -> bytes:
+    return orjson.dumps(content)
\ No newline at end of file
@@ -1,76 +1,608 @@
-from minio import Minio
-from minio.error import S3Error
+from typing import BinaryIO, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+from urllib.parse import quote
+from xml.etree import ElementTree
 from config import get_settings
+import asyncio
+import hashlib
+import hmac
 import io
-import uuid
+import json
 import logging
+import mimetypes
+import os
+import uuid
+import httpx
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
 
-minio_client = Minio(
-    settings.minio_endpoint,
-    access_key=settings.minio_access_key,
-    secret_key=settings.minio_secret_key,
-    secure=settings.minio_secure
-)
+#multipart part size for streamed uploads => also the most a single upload
+#keeps in memory (5mb is the smallest part S3 accepts)
+UPLOAD_PART_SIZE = 5 * 1024 * 1024
 
+#chunk size the local backend copies uploads with
+LOCAL_COPY_CHUNK_SIZE = 1024 * 1024
 
-async def init_minio():
-    try:
-        if not minio_client.bucket_exists(settings.minio_bucket):
-            minio_client.make_bucket(settings.minio_bucket)
-
-            policy = {
-                "Version": "2012-10-17",
-                "Statement": [
-                    {
-                        "Effect": "Allow",
-                        "Principal": {"AWS": "*"},
-                        "Action": ["s3:GetObject"],
-                        "Resource": [f"arn:aws:s3:::{settings.minio_bucket}/*"]
-                    }
-                ]
+UNSIGNED_PAYLOAD = "UNSIGNED-PAYLOAD"
+
+#content-addressed objects never change => clients and proxies may keep them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class FileTooLarge(Exception):
+    """an upload crossed the size limit while it was being streamed"""
+
+
+class StorageError(Exception):
+    """the storage backend rejected a request"""
+    
+    def __init__(self, status_code: int, code: str, message: str = ""):
+        super().__init__(f"{code} ({status_code}): {message}" if message else f"{code} ({status_code})")
+        self.status_code = status_code
+        self.code = code
+
+
+class _LimitedReader:
+    """file-like wrapper that counts bytes and aborts once the limit is crossed"""
+    
+    def __init__(self, raw: BinaryIO, limit: int):
+        self.raw = raw
+        self.limit = limit
+        self.size = 0
+    
+    def read(self, size: int = -1) -> bytes:
+        chunk = self.raw.read(size)
+        self.size += len(chunk)
+        if self.size > self.limit:
+            raise FileTooLarge(f"upload exceeds {self.limit} bytes")
+        return chunk
+
+
+def _new_object_name(filename: str, folder: str) -> str:
+    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    unique_name = f"{uuid.uuid4()}.{ext}" if ext else str(uuid.uuid4())
+    return f"{folder}/{unique_name}"
+
+
+def _public_read_policy(bucket: str) -> str:
+    return json.dumps({
+        "Version": "2012-10-17",
+        "Statement": [
+            {
+                "Effect": "Allow",
+                "Principal": {"AWS": "*"},
+                "Action": ["s3:GetObject"],
+                "Resource": [f"arn:aws:s3:::{bucket}/*"]
             }
-            import json
-            minio_client.set_bucket_policy(settings.minio_bucket, json.dumps(policy))
-            logger.info(f"Created MinIO bucket: {settings.minio_bucket}")
-        else:
-            logger.info(f"MinIO bucket already exists: {settings.minio_bucket}")
-    except S3Error as e:
-        logger.error(f"MinIO initialization error: {e}")
-        raise
+        ]
+    })
 
 
-def upload_file(file_data: bytes, filename: str, content_type: str, folder: str = "uploads") -> str:
-    """upload a file to MinIO and return the object path
+class Storage:
+    """object store for attachments and emojis, every method is non-blocking"""
     
-    args:
-        file_data: the file content as bytes
-        filename: original filename
-        content_type: MIME type of the file
-        folder: folder/prefix in the bucket
+    #whether clients can PUT objects themselves through presigned urls
+    supports_direct_uploads = False
+    
+    def __init__(self, bucket: str):
+        self.bucket = bucket
+    
+    async def start(self):
+        return None
+    
+    async def stop(self):
+        return None
+    
+    async def ensure_bucket(self):
+        raise NotImplementedError
+    
+    async def put_stream(
+        self,
+        object_name: str,
+        raw: BinaryIO,
+        content_type: str,
+        max_size: int,
+        cache_control: Optional[str] = None
+    ) -> int:
+        """store everything raw yields under object_name, returns the size in bytes"""
+        raise NotImplementedError
+    
+    async def put_bytes(self, object_name: str, data: bytes, content_type: str, cache_control: Optional[str] = None):
+        await self.put_stream(object_name, io.BytesIO(data), content_type, len(data), cache_control)
+    
+    async def get(self, object_name: str) -> bytes:
+        """whole object in memory => only for objects known to be small"""
+        raise NotImplementedError
+    
+    async def stat(self, object_name: str) -> Optional[Tuple[int, str]]:
+        """(size, content type) of a stored object, None if it does not exist"""
+        raise NotImplementedError
+    
+    async def delete(self, object_name: str):
+        raise NotImplementedError
+    
+    def presign_put(self, object_name: str, expires_seconds: int) -> str:
+        raise NotImplementedError
+
+
+# ============ S3 ============
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hmac(key: bytes, msg: str) -> bytes:
+    return hmac.new(key, msg.encode("utf-8"), hashlib.sha256).digest()
+
+
+def _uri_encode(value: str, safe: str = "-_.~") -> str:
+    return quote(value, safe=safe)
+
+
+def _amz_date() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def _canonical_query(query: Dict[str, str]) -> str:
+    return "&".join(
+        f"{_uri_encode(key)}={_uri_encode(value)}"
+        for key, value in sorted(query.items())
+    )
+
+
+class _SigV4Signer:
+    """AWS signature v4 for S3 => signing is local, it never talks to the server"""
+    
+    def __init__(self, access_key: str, secret_key: str, region: str):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+    
+    def _scope(self, date: str) -> str:
+        return f"{date}/{self.region}/s3/aws4_request"
+    
+    def _signature(self, amz_date: str, canonical_request: str) -> str:
+        date = amz_date[:8]
+        string_to_sign = "\n".join([
+            "AWS4-HMAC-SHA256", amz_date, self._scope(date), _sha256(canonical_request.encode("utf-8"))
+        ])
+        key = _hmac(("AWS4" + self.secret_key).encode("utf-8"), date)
+        for part in (self.region, "s3", "aws4_request"):
+            key = _hmac(key, part)
+        return hmac.new(key, string_to_sign.encode("utf-8"), hashlib.sha256).hexdigest()
+    
+    def sign_headers(
+        self,
+        method: str,
+        path: str,
+        query: Dict[str, str],
+        headers: Dict[str, str],
+        payload_hash: str
+    ) -> Dict[str, str]:
+        """headers (host included) plus the x-amz-* and authorization headers"""
+        amz_date = _amz_date()
+        signed = {key.lower(): str(value).strip() for key, value in headers.items()}
+        signed["x-amz-date"] = amz_date
+        signed["x-amz-content-sha256"] = payload_hash
         
-    returns:
-        the object name (path within the bucket)
+        names = sorted(signed)
+        canonical_request = "\n".join([
+            method,
+            _uri_encode(path, safe="/-_.~"),
+            _canonical_query(query),
+            "".join(f"{name}:{signed[name]}\n" for name in names),
+            ";".join(names),
+            payload_hash
+        ])
+        signature = self._signature(amz_date, canonical_request)
+        signed["authorization"] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{self._scope(amz_date[:8])}, "
+            f"SignedHeaders={';'.join(names)}, Signature={signature}"
+        )
+        return signed
+    
+    def presign(self, method: str, host: str, path: str, expires_seconds: int) -> str:
+        """query string of a presigned url, only the host header is signed"""
+        amz_date = _amz_date()
+        query = {
+            "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+            "X-Amz-Credential": f"{self.access_key}/{self._scope(amz_date[:8])}",
+            "X-Amz-Date": amz_date,
+            "X-Amz-Expires": str(expires_seconds),
+            "X-Amz-SignedHeaders": "host",
+        }
+        canonical_request = "\n".join([
+            method,
+            _uri_encode(path, safe="/-_.~"),
+            _canonical_query(query),
+            f"host:{host}\n",
+            "host",
+            UNSIGNED_PAYLOAD
+        ])
+        query["X-Amz-Signature"] = self._signature(amz_date, canonical_request)
+        return _canonical_query(query)
+
+
+def _xml_text(root: ElementTree.Element, tag: str) -> Optional[str]:
+    """text of the first element named tag, whatever its namespace"""
+    for element in root.iter():
+        if element.tag == tag or element.tag.endswith("}" + tag):
+            return element.text
+    return None
+
+
+def _error_from_response(response: httpx.Response) -> StorageError:
+    code, message = response.reason_phrase or "Error", ""
+    if response.content:
+        try:
+            root = ElementTree.fromstring(response.content)
+            code = _xml_text(root, "Code") or code
+            message = _xml_text(root, "Message") or ""
+        except ElementTree.ParseError:
+            pass
+    return StorageError(response.status_code, code, message)
+
+
+class S3Storage(Storage):
+    """MinIO/S3 over one shared keep-alive connection pool
+    
+    requests are signed here and sent through httpx, so no call blocks the
+    event loop. a semaphore bounds the requests in flight per worker, and
+    streamed uploads still keep about one UPLOAD_PART_SIZE in memory each
     """
-    ext = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
-    unique_name = f"{uuid.uuid4()}.{ext}" if ext else str(uuid.uuid4())
-    object_name = f"{folder}/{unique_name}"
     
+    def __init__(
+        self,
+        endpoint: str,
+        access_key: str,
+        secret_key: str,
+        bucket: str,
+        secure: bool,
+        region: str,
+        presign_endpoint: str = "",
+        presign_secure: bool = True
+    ):
+        super().__init__(bucket)
+        self.host = endpoint
+        self.base_url = f"{'https' if secure else 'http'}://{endpoint}"
+        self.signer = _SigV4Signer(access_key, secret_key, region)
+        self.presign_endpoint = presign_endpoint
+        self.presign_base_url = f"{'https' if presign_secure else 'http'}://{presign_endpoint}"
+        self.supports_direct_uploads = bool(presign_endpoint)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._slots = asyncio.Semaphore(settings.storage_max_concurrency)
+    
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=settings.storage_max_connections,
+                    max_keepalive_connections=settings.storage_max_connections,
+                    keepalive_expiry=settings.storage_keepalive_expiry
+                ),
+                timeout=httpx.Timeout(settings.storage_timeout, connect=5.0)
+            )
+    
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def _path(self, object_name: Optional[str] = None) -> str:
+        return f"/{self.bucket}/{object_name}" if object_name else f"/{self.bucket}"
+    
+    async def _request(
+        self,
+        method: str,
+        object_name: Optional[str] = None,
+        query: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+        body: bytes = b"",
+        sign_payload: bool = True,
+        expect: Tuple[int, ...] = (200,)
+    ) -> httpx.Response:
+        if self._client is None:
+            await self.start()
+        
+        query = query or {}
+        path = self._path(object_name)
+        #part bodies are not hashed => no 5mb sha256 on the event loop
+        payload_hash = _sha256(body) if sign_payload else UNSIGNED_PAYLOAD
+        signed = self.signer.sign_headers(
+            method, path, query, {**(headers or {}), "host": self.host}, payload_hash
+        )
+        url = self.base_url + _uri_encode(path, safe="/-_.~")
+        if query:
+            url += "?" + _canonical_query(query)
+        
+        async with self._slots:
+            response = await self._client.request(method, url, headers=signed, content=body)
+        if response.status_code not in expect:
+            raise _error_from_response(response)
+        return response
+    
+    async def ensure_bucket(self):
+        response = await self._request("HEAD", expect=(200, 404))
+        if response.status_code == 200:
+            logger.info(f"MinIO bucket already exists: {self.bucket}")
+            return
+        
+        await self._request("PUT")
+        await self._request(
+            "PUT",
+            query={"policy": ""},
+            headers={"content-type": "application/json"},
+            body=_public_read_policy(self.bucket).encode("utf-8"),
+            expect=(200, 204)
+        )
+        logger.info(f"Created MinIO bucket: {self.bucket}")
+    
+    async def put_stream(
+        self,
+        object_name: str,
+        raw: BinaryIO,
+        content_type: str,
+        max_size: int,
+        cache_control: Optional[str] = None
+    ) -> int:
+        reader = _LimitedReader(raw, max_size)
+        #stored with the object => MinIO sends it back on every GET
+        headers = {"content-type": content_type}
+        if cache_control:
+            headers["cache-control"] = cache_control
+        #reads of the spooled file can hit the disk => worker thread
+        part = await asyncio.to_thread(reader.read, UPLOAD_PART_SIZE)
+        
+        if len(part) < UPLOAD_PART_SIZE:
+            #fits into one part => a single PUT, no multipart bookkeeping
+            await self._request(
+                "PUT", object_name, headers=headers,
+                body=part, sign_payload=False
+            )
+            return reader.size
+        
+        response = await self._request(
+            "POST", object_name, query={"uploads": ""}, headers=headers
+        )
+        upload_id = _xml_text(ElementTree.fromstring(response.content), "UploadId")
+        if not upload_id:
+            raise StorageError(response.status_code, "InvalidResponse", "no UploadId in response")
+        
+        etags: List[str] = []
+        try:
+            while part:
+                response = await self._request(
+                    "PUT", object_name,
+                    query={"partNumber": str(len(etags) + 1), "uploadId": upload_id},
+                    body=part, sign_payload=False
+                )
+                etags.append(response.headers.get("etag", ""))
+                part = await asyncio.to_thread(reader.read, UPLOAD_PART_SIZE)
+            
+            parts = "".join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>"
+                for number, etag in enumerate(etags, start=1)
+            )
+            response = await self._request(
+                "POST", object_name, query={"uploadId": upload_id},
+                headers={"content-type": "application/xml"},
+                body=f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>".encode("utf-8")
+            )
+            #completion can fail after the 200 status line went out
+            if b"<Error>" in response.content:
+                raise _error_from_response(response)
+        except BaseException:
+            try:
+                await self._request(
+                    "DELETE", object_name, query={"uploadId": upload_id}, expect=(204, 404)
+                )
+            except Exception as e:
+                logger.warning(f"Failed to abort multipart upload of {object_name}: {e}")
+            raise
+        return reader.size
+    
+    async def get(self, object_name: str) -> bytes:
+        response = await self._request("GET", object_name)
+        return response.content
+    
+    async def stat(self, object_name: str) -> Optional[Tuple[int, str]]:
+        response = await self._request("HEAD", object_name, expect=(200, 404))
+        if response.status_code == 404:
+            return None
+        return (
+            int(response.headers.get("content-length") or 0),
+            response.headers.get("content-type") or "application/octet-stream"
+        )
+    
+    async def delete(self, object_name: str):
+        await self._request("DELETE", object_name, expect=(204, 200))
+    
+    def presign_put(self, object_name: str, expires_seconds: int) -> str:
+        if not self.supports_direct_uploads:
+            raise RuntimeError("direct uploads need MINIO_PRESIGN_ENDPOINT")
+        path = self._path(object_name)
+        query = self.signer.presign("PUT", self.presign_endpoint, path, expires_seconds)
+        return f"{self.presign_base_url}{_uri_encode(path, safe='/-_.~')}?{query}"
+
+
+# ============ LOCAL DISK ============
+
+class LocalStorage(Storage):
+    """objects as plain files under <root>/<bucket>/<object name>
+    
+    same layout and urls as the S3 backend (main.py serves the bucket
+    directory), no server needed => for tests, benchmarks and single-box setups
+    """
+    
+    def __init__(self, root: str, bucket: str):
+        super().__init__(bucket)
+        self.bucket_path = os.path.abspath(os.path.join(root, bucket))
+    
+    def _file_path(self, object_name: str) -> str:
+        path = os.path.abspath(os.path.join(self.bucket_path, object_name))
+        if not path.startswith(self.bucket_path + os.sep):
+            raise StorageError(400, "InvalidObjectName", object_name)
+        return path
+    
+    async def ensure_bucket(self):
+        await asyncio.to_thread(os.makedirs, self.bucket_path, exist_ok=True)
+        logger.info(f"Local storage bucket at {self.bucket_path}")
+    
+    def _write(self, path: str, raw: BinaryIO, max_size: int) -> int:
+        reader = _LimitedReader(raw, max_size)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        #write next to the target and rename => readers never see half a file
+        temp_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            with open(temp_path, "wb") as out:
+                while True:
+                    chunk = reader.read(LOCAL_COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return reader.size
+    
+    async def put_stream(
+        self,
+        object_name: str,
+        raw: BinaryIO,
+        content_type: str,
+        max_size: int,
+        cache_control: Optional[str] = None
+    ) -> int:
+        return await asyncio.to_thread(self._write, self._file_path(object_name), raw, max_size)
+    
+    def _read(self, path: str) -> bytes:
+        with open(path, "rb") as source:
+            return source.read()
+    
+    async def get(self, object_name: str) -> bytes:
+        try:
+            return await asyncio.to_thread(self._read, self._file_path(object_name))
+        except FileNotFoundError:
+            raise StorageError(404, "NoSuchKey", object_name)
+    
+    def _stat(self, path: str) -> Optional[Tuple[int, str]]:
+        try:
+            size = os.stat(path).st_size
+        except FileNotFoundError:
+            return None
+        return size, mimetypes.guess_type(path)[0] or "application/octet-stream"
+    
+    async def stat(self, object_name: str) -> Optional[Tuple[int, str]]:
+        return await asyncio.to_thread(self._stat, self._file_path(object_name))
+    
+    def _remove(self, path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    
+    async def delete(self, object_name: str):
+        await asyncio.to_thread(self._remove, self._file_path(object_name))
+    
+    def presign_put(self, object_name: str, expires_seconds: int) -> str:
+        raise RuntimeError("direct uploads need the s3 storage backend")
+
+
+def create_storage() -> Storage:
+    if settings.storage_backend == "local":
+        return LocalStorage(settings.storage_local_path, settings.minio_bucket)
+    if settings.storage_backend != "s3":
+        logger.warning(f"Unknown storage backend {settings.storage_backend!r}, falling back to s3")
+    return S3Storage(
+        settings.minio_endpoint,
+        settings.minio_access_key,
+        settings.minio_secret_key,
+        settings.minio_bucket,
+        settings.minio_secure,
+        settings.minio_region,
+        settings.minio_presign_endpoint,
+        settings.minio_presign_secure
+    )
+
+
+storage = create_storage()
+
+
+async def init_storage():
+    await storage.start()
     try:
-        minio_client.put_object(
-            settings.minio_bucket,
+        await storage.ensure_bucket()
+    except (StorageError, httpx.HTTPError) as e:
+        logger.error(f"Storage initialization error: {e}")
+        raise
+
+
+async def close_storage():
+    await storage.stop()
+
+
+async def store_stream(
+    object_name: str,
+    raw: BinaryIO,
+    content_type: str,
+    max_size: Optional[int] = None,
+    cache_control: Optional[str] = None
+) -> int:
+    """stream a file-like object to storage under a given object name
+    
+    raises FileTooLarge (and aborts the upload) once more than max_size
+    bytes were read
+    
+    returns:
+        the size in bytes
+    """
+    try:
+        size = await storage.put_stream(
             object_name,
-            io.BytesIO(file_data),
-            length=len(file_data),
-            content_type=content_type
+            raw,
+            content_type,
+            max_size if max_size is not None else settings.max_file_size,
+            cache_control
         )
-        logger.info(f"Uploaded file: {object_name} ({len(file_data)} bytes)")
-        return object_name
-    except S3Error as e:
-        logger.error(f"Failed to upload file {filename}: {e}")
+    except (StorageError, httpx.HTTPError) as e:
+        logger.error(f"Failed to upload file {object_name}: {e}")
         raise
+    logger.info(f"Uploaded file: {object_name} ({size} bytes)")
+    return size
+
+
+async def store_bytes(object_name: str, data: bytes, content_type: str, cache_control: Optional[str] = None):
+    """write in-memory bytes under a given object name (renditions, cleaned originals)"""
+    await storage.put_bytes(object_name, data, content_type, cache_control)
+    logger.info(f"Uploaded file: {object_name} ({len(data)} bytes)")
+
+
+async def read_file(object_name: str) -> bytes:
+    return await storage.get(object_name)
+
+
+def direct_uploads_enabled() -> bool:
+    return storage.supports_direct_uploads
+
+
+def create_upload_session(filename: str, folder: str, expires_seconds: int) -> Tuple[str, str]:
+    """reserve a fresh object name and presign a PUT for it
+    
+    the client uploads straight to storage, so no byte passes through the workers
+    
+    returns:
+        (object name, presigned PUT url)
+    """
+    object_name = _new_object_name(filename, folder)
+    return object_name, storage.presign_put(object_name, expires_seconds)
+
+
+async def stat_file(object_name: str) -> Optional[Tuple[int, str]]:
+    """size and content type of a stored object, None if it does not exist"""
+    return await storage.stat(object_name)
 
 
 def get_file_url(object_name: str) -> str:
@@ -78,7 +610,7 @@ def get_file_url(object_name: str) -> str:
     
     args:
         object_name: the object path within the bucket
-        
+    
     returns:
         URL to access the file (relative URL through nginx proxy)
     """
@@ -90,58 +622,20 @@ def get_file_url(object_name: str) -> str:
         return f"/{settings.minio_bucket}/{object_name}"
 
 
-def delete_file(object_name: str) -> bool:
-    """delete a file from MinIO
+async def delete_file(object_name: str) -> bool:
+    """delete a file from storage
     
     args:
         object_name: the object path within the bucket
-        
+    
     returns:
         true if successful => false otherwise
     """
     try:
-        minio_client.remove_object(settings.minio_bucket, object_name)
+        await storage.delete(object_name)
         logger.info(f"Deleted file: {object_name}")
         return True
-    except S3Error as e:
+    except (StorageError, httpx.HTTPError) as e:
         logger.error(f"Error deleting file {object_name}: {e}")
         return False
 
-
-def get_presigned_url(object_name: str, expires_hours: int = 24) -> str:
-    """get a presigned URL for temporary direct access
-    
-    args:
-        object_name: the object path within the bucket
-        expires_hours: how long the URL should be valid
-        
-    returns:
-        presigned URL for direct access
-    """
-    from datetime import timedelta
-    try:
-        url = minio_client.presigned_get_object(
-            settings.minio_bucket,
-            object_name,
-            expires=timedelta(hours=expires_hours)
-        )
-        return url
-    except S3Error as e:
-        logger.error(f"Error generating presigned URL for {object_name}: {e}")
-        raise
-
-
-def file_exists(object_name: str) -> bool:
-    """vheck if a file exists in MinIO
-    
-    args:
-        object_name: the object path within the bucket
-        
-    returns:
-        true if the file exists => false otherwise
-    """
-    try:
-        minio_client.stat_object(settings.minio_bucket, object_name)
-        return True
-    except S3Error:
-        return False
\ No newline at end of file
@@ -0,0 +1,307 @@
+from sqlalchemy import select, delete, update, exists, func, literal, null, true
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from config import get_settings
+from database import AsyncSessionLocal
+from models import User, Message, Reaction, ChatPurge, StoredObject
+from websocket_manager import manager
+from storage import read_file, store_bytes
+from media import should_process, derive_image, strip_image, attachment_object_names
+from blobs import drop_references, store_renditions, discard
+from jobs import job_handler, every, enqueue
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+settings = get_settings()
+
+GUEST_PURGE_BATCH_SIZE = 1000
+
+
+async def purge_stale_guests() -> int:
+    """delete guest rows that never reacted (or no longer have reactions)
+    
+    returns the number of purged users
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=settings.guest_purge_max_age_hours)
+    stale_guests = (
+        select(User.id)
+        .where(
+            User.username.like("guest\\_%", escape="\\"),
+            User.email.is_(None),
+            User.password_hash.is_(None),
+            User.is_admin == False,
+            User.last_seen < cutoff,
+            ~exists().where(Reaction.user_id == User.id),
+            ~exists().where(Message.author_id == User.id),
+        )
+        .limit(GUEST_PURGE_BATCH_SIZE)
+    )
+    
+    purged = 0
+    while True:
+        #small batches => never hold locks on the users table for long
+        async with AsyncSessionLocal() as db:
+            ids = (await db.execute(stale_guests)).scalars().all()
+            if not ids:
+                break
+            await db.execute(delete(User).where(User.id.in_(ids)))
+            await db.commit()
+        purged += len(ids)
+        if len(ids) < GUEST_PURGE_BATCH_SIZE:
+            break
+    
+    if purged:
+        logger.info(f"Purged {purged} stale guest users")
+    return purged
+
+
+async def guest_sweeper():
+    """background loop started from the lifespan hook"""
+    while True:
+        try:
+            await purge_stale_guests()
+        except Exception as e:
+            logger.error(f"Guest purge failed: {e}")
+        await asyncio.sleep(settings.guest_purge_interval_minutes * 60)
+
+
+# ============ PURGES ============
+
+class PurgeHorizon:
+    """cutoff of the running purges => reads hide everything at or before it
+    
+    kept per worker from the chat_cleared/purge_started/purge_progress
+    broadcasts, so every worker stops serving the purged messages at once
+    while the rows are still being deleted
+    """
+    
+    def __init__(self):
+        self.before: Optional[datetime] = None
+    
+    async def load(self):
+        """pick up purges that were running when this worker started"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(func.max(ChatPurge.before))
+                .where(ChatPurge.status == "running")
+            )
+            self.before = result.scalar_one_or_none()
+    
+    def on_event(self, message: dict):
+        event_type = message.get("type")
+        data = message.get("data") or {}
+        
+        if event_type in ("chat_cleared", "purge_started") and data.get("before"):
+            before = datetime.fromisoformat(data["before"])
+            if self.before is None or before > self.before:
+                self.before = before
+        
+        elif event_type == "purge_progress" and data.get("done"):
+            #an older purge only ever deletes a subset of a newer one
+            if self.before is not None and datetime.fromisoformat(data["before"]) >= self.before:
+                self.before = None
+    
+    def visible(self):
+        """where clause for message reads"""
+        return Message.created_at > self.before if self.before else true()
+
+
+purge_horizon = PurgeHorizon()
+
+
+async def start_purge(
+    db: AsyncSession,
+    reason: str,
+    before: Optional[datetime] = None,
+    user_id: Optional[str] = None
+) -> ChatPurge:
+    """record a purge of everything created at or before `before` (default: now)
+    
+    the chat.purge job is enqueued in the caller's transaction => the purge
+    runs exactly when its row was committed
+    """
+    purge = ChatPurge(reason=reason, before=before or func.now(), created_by_id=user_id)
+    db.add(purge)
+    await db.flush()
+    await db.refresh(purge)
+    await enqueue(db, "chat.purge", {"purge_id": purge.id}, key=f"chat.purge:{purge.id}")
+    return purge
+
+
+def _progress(purge: ChatPurge, deleted: int, done: bool, event_type: str = "purge_progress") -> dict:
+    return {
+        "type": event_type,
+        "data": {
+            "purge_id": purge.id,
+            "reason": purge.reason,
+            "before": purge.before.isoformat(),
+            "deleted": deleted,
+            "done": done
+        }
+    }
+
+
+async def _purge_batch(purge: ChatPurge) -> int:
+    """delete one batch of messages in its own short transaction
+    
+    storage references go in the same transaction => a retried purge never
+    releases an attachment twice
+    
+    returns:
+        deleted messages
+    """
+    async with AsyncSessionLocal() as db:
+        ids = (await db.execute(
+            select(Message.id)
+            .where(Message.created_at <= purge.before)
+            .order_by(Message.created_at)
+            .limit(settings.purge_batch_size)
+        )).scalars().all()
+        if not ids:
+            return 0
+        
+        #replies that survive the purge keep their quote, marked as deleted
+        #(before the FK nulls reply_to_id)
+        await db.execute(
+            update(Message)
+            .where(Message.reply_to_id.in_(ids), Message.reply_preview.isnot(None))
+            .values(reply_preview=func.json_build_object(
+                "id", Message.reply_preview["id"].as_string(),
+                "content", null(),
+                "author_username", Message.reply_preview["author_username"].as_string(),
+                "attachment_only", literal(False),
+                "deleted", literal(True)
+            ))
+        )
+        #reactions go with their message (ON DELETE CASCADE)
+        result = await db.execute(
+            delete(Message).where(Message.id.in_(ids)).returning(Message.attachments)
+        )
+        attachments = [
+            attachment for row in result
+            for attachment in (row.attachments or []) if isinstance(attachment, dict)
+        ]
+        #shared objects only lose a reference, the rest is collected by storage jobs
+        await drop_references(db, attachments)
+        await db.execute(
+            update(ChatPurge)
+            .where(ChatPurge.id == purge.id)
+            .values(deleted=ChatPurge.deleted + len(ids))
+        )
+        await db.commit()
+    return len(ids)
+
+
+@job_handler("chat.purge")
+async def run_purge(payload: dict):
+    """delete a purge's messages batch by batch
+    
+    every batch is its own short transaction => concurrent reads and posts
+    never wait long on locks. purge_started moves every worker's horizon
+    before the first batch, progress goes out as purge_progress events. a
+    purge whose worker went away is resumed from the next batch once the job
+    lease runs out
+    """
+    async with AsyncSessionLocal() as db:
+        purge = await db.get(ChatPurge, payload["purge_id"])
+    if purge is None or purge.status != "running":
+        return
+    
+    deleted = purge.deleted
+    await manager.broadcast(_progress(purge, deleted, False, "purge_started"))
+    while True:
+        count = await _purge_batch(purge)
+        deleted += count
+        if count < settings.purge_batch_size:
+            break
+        await manager.broadcast(_progress(purge, deleted, False))
+        await asyncio.sleep(settings.purge_batch_pause)
+    
+    async with AsyncSessionLocal() as db:
+        await db.execute(
+            update(ChatPurge)
+            .where(ChatPurge.id == purge.id)
+            .values(status="done", finished_at=func.now())
+        )
+        await db.commit()
+    await manager.broadcast(_progress(purge, deleted, True))
+    logger.info(f"Purge {purge.id} ({purge.reason}) deleted {deleted} messages")
+
+
+@job_handler("chat.retention")
+async def start_retention_purge(payload: dict):
+    """purge messages past message_retention_days, unless one is still running"""
+    async with AsyncSessionLocal() as db:
+        pending = await db.execute(
+            select(ChatPurge.id)
+            .where(ChatPurge.reason == "retention", ChatPurge.status == "running")
+            .limit(1)
+        )
+        if pending.scalar_one_or_none() is not None:
+            return
+        cutoff = datetime.now(timezone.utc) - timedelta(days=settings.message_retention_days)
+        await start_purge(db, "retention", before=cutoff)
+        await db.commit()
+
+
+every("chat.retention", settings.purge_interval_minutes * 60, lambda: settings.message_retention_days > 0)
+
+
+# ============ MEDIA ============
+
+@job_handler("media.process")
+async def process_attachment(payload: dict):
+    """metadata strip, renditions, dimensions and placeholder of an image the client PUT itself
+    
+    the message is posted first and patched here => clients get an
+    attachments_updated event. a cleaned original replaces the object in place
+    """
+    object_name = payload["object_name"]
+    async with AsyncSessionLocal() as db:
+        stored = await db.get(StoredObject, object_name)
+    if stored is None or stored.ref_count <= 0 or stored.derived is not None:
+        #message already gone, or processed by an earlier attempt
+        return
+    
+    data = await read_file(object_name)
+    derived = await derive_image(data) if should_process(payload["content_type"], stored.size) else None
+    #too large to process, or undecodable => the original is still cleaned
+    original = derived["original"] if derived else await strip_image(data)
+    size = stored.size
+    if original:
+        await store_bytes(object_name, original, payload["content_type"])
+        size = len(original)
+    fields = await store_renditions(object_name, derived) if derived else {}
+    
+    async with AsyncSessionLocal() as db:
+        stored = (await db.execute(
+            select(StoredObject).where(StoredObject.object_name == object_name).with_for_update()
+        )).scalar_one_or_none()
+        if stored is None:
+            #collected while we were processing => what we just wrote goes too
+            await discard(attachment_object_names({"object_name": object_name, **fields}))
+            return
+        stored.size = size
+        stored.derived = fields
+        
+        message = (await db.execute(
+            select(Message).where(Message.id == payload["message_id"]).with_for_update()
+        )).scalar_one_or_none()
+        attachments = None
+        if message is not None:
+            attachments = [
+                {**attachment, "size": size, **fields}
+                if isinstance(attachment, dict) and attachment.get("object_name") == object_name
+                else attachment
+                for attachment in message.attachments or []
+            ]
+            message.attachments = attachments
+        await db.commit()
+    
+    if attachments is not None:
+        await manager.broadcast({
+            "type": "attachments_updated",
+            "data": {"id": payload["message_id"], "attachments": attachments}
+        })
@@ -0,0 +1,159 @@
+"""stored originals never keep their metadata
+
+every image is saved with a gps block, an xmp packet and a comment where
+the format has one => the cleaned bytes must carry none of them, keep the
+exif orientation and decode to the same pixels
+"""
+import io
+import struct
+import pytest
+from PIL import Image, ImageChops
+
+from media import clean_original, process_image, strip_metadata, EXIF_ORIENTATION
+
+GPS_IFD = 0x8825
+MARKER = b"secret-location-marker"
+XMP = b'<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:Description>' + MARKER + b"</rdf:Description></x:xmpmeta>"
+
+
+def gps_exif(orientation: int = 1) -> Image.Exif:
+    exif = Image.Exif()
+    exif[0x010E] = MARKER.decode()  #image description
+    if orientation != 1:
+        exif[EXIF_ORIENTATION] = orientation
+    gps = exif.get_ifd(GPS_IFD)
+    gps[1] = "N"
+    gps[2] = (52.0, 31.0, 12.5)
+    gps[3] = "E"
+    gps[4] = (13.0, 24.0, 36.0)
+    return exif
+
+
+def picture(mode: str = "RGB") -> Image.Image:
+    image = Image.new(mode, (40, 24))
+    for x in range(40):
+        for y in range(24):
+            image.putpixel((x, y), (x * 6, y * 10, 128) if mode == "RGB" else (x * 6, y * 10, 128, 200))
+    return image
+
+
+def encode(fmt: str, orientation: int = 1, **options) -> bytes:
+    buffer = io.BytesIO()
+    picture("RGBA" if fmt == "PNG" else "RGB").save(buffer, fmt, exif=gps_exif(orientation), **options)
+    return buffer.getvalue()
+
+
+def assert_clean(data: bytes, orientation: int = 1):
+    assert MARKER not in data
+    with Image.open(io.BytesIO(data)) as image:
+        exif = image.getexif()
+        assert not exif.get_ifd(GPS_IFD)
+        assert exif.get(EXIF_ORIENTATION, 1) == orientation
+        assert set(exif) <= {EXIF_ORIENTATION}
+
+
+def same_pixels(a: bytes, b: bytes) -> bool:
+    with Image.open(io.BytesIO(a)) as first, Image.open(io.BytesIO(b)) as second:
+        return ImageChops.difference(first.convert("RGBA"), second.convert("RGBA")).getbbox() is None
+
+
+@pytest.mark.parametrize("fmt,options", [
+    ("JPEG", {"quality": 90}),
+    ("PNG", {"pnginfo": None}),
+    ("WEBP", {"lossless": True, "xmp": XMP}),
+])
+@pytest.mark.parametrize("orientation", [1, 6])
+def test_original_loses_gps_but_keeps_orientation(fmt, options, orientation):
+    data = encode(fmt, orientation, **options)
+    assert MARKER in data
+    cleaned = clean_original(data)
+    assert cleaned is not None
+    assert_clean(cleaned, orientation)
+    #edited in place => not re-encoded
+    assert same_pixels(cleaned, data)
+
+
+def test_jpeg_xmp_and_comment_are_dropped():
+    buffer = io.BytesIO()
+    picture().save(buffer, "JPEG", exif=gps_exif(), xmp=XMP, comment=MARKER)
+    assert buffer.getvalue().count(MARKER) == 3
+    cleaned = clean_original(buffer.getvalue())
+    assert_clean(cleaned)
+
+
+def test_png_text_chunks_are_dropped():
+    from PIL.PngImagePlugin import PngInfo
+    info = PngInfo()
+    info.add_itxt("XML:com.adobe.xmp", XMP.decode())
+    info.add_text("Comment", MARKER.decode())
+    buffer = io.BytesIO()
+    picture().save(buffer, "PNG", pnginfo=info)
+    cleaned = clean_original(buffer.getvalue())
+    assert_clean(cleaned)
+    assert same_pixels(cleaned, buffer.getvalue())
+
+
+def test_gif_comment_goes_and_the_loop_stays():
+    frames = [picture().convert("P"), picture().rotate(180).convert("P")]
+    buffer = io.BytesIO()
+    frames[0].save(buffer, "GIF", save_all=True, append_images=frames[1:], loop=0, comment=MARKER)
+    assert MARKER in buffer.getvalue()
+    cleaned = clean_original(buffer.getvalue())
+    assert MARKER not in cleaned
+    with Image.open(io.BytesIO(cleaned)) as image:
+        assert image.n_frames == 2
+        assert image.info.get("loop") == 0
+
+
+def test_tiff_is_reencoded_without_its_tags():
+    data = encode("TIFF", 6)
+    cleaned = clean_original(data)
+    assert MARKER not in cleaned
+    with Image.open(io.BytesIO(cleaned)) as image:
+        assert not image.getexif().get_ifd(GPS_IFD)
+        #orientation baked in => 40x24 stands upright
+        assert image.size == (24, 40)
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I", len(payload) + 8) + box_type + payload
+
+
+def heif_with_exif(exif: bytes) -> bytes:
+    """ftyp, meta (iinf + iloc of one exif item) and an mdat holding the exif"""
+    ftyp = box(b"ftyp", b"heic" + b"\x00\x00\x00\x00" + b"mif1heic")
+    infe = box(b"infe", b"\x02\x00\x00\x00" + struct.pack(">HH", 1, 0) + b"Exif" + b"\x00")
+    iinf = box(b"iinf", b"\x00\x00\x00\x00" + struct.pack(">H", 1) + infe)
+
+    def meta(offset: int) -> bytes:
+        #version 0, offset/length size 4, no base offset
+        iloc = box(b"iloc", b"\x00\x00\x00\x00" + bytes([0x44, 0x00]) + struct.pack(">HHHHII", 1, 1, 0, 1, offset, len(exif)))
+        return box(b"meta", b"\x00\x00\x00\x00" + box(b"hdlr", b"\x00" * 24) + iinf + iloc)
+
+    head = ftyp + meta(0)
+    offset = len(head) + 8
+    return ftyp + meta(offset) + box(b"mdat", exif)
+
+
+def test_heif_exif_item_is_blanked_in_place():
+    exif_block = b"\x00\x00\x00\x06Exif\x00\x00" + gps_exif().tobytes()
+    data = heif_with_exif(exif_block)
+    assert MARKER in data
+    cleaned = strip_metadata(data)
+    assert len(cleaned) == len(data)
+    assert MARKER not in cleaned
+    assert cleaned[:len(data) - len(exif_block)] == data[:len(data) - len(exif_block)]
+
+
+def test_process_image_stores_a_clean_original():
+    data = encode("JPEG", 6, quality=90)
+    result = process_image(data)
+    assert_clean(result["original"], 6)
+    #the renditions are upright => 40x24 turned by exif orientation 6
+    assert (result["width"], result["height"]) == (24, 40)
+
+
+def test_clean_image_is_left_alone():
+    buffer = io.BytesIO()
+    picture().save(buffer, "PNG")
+    assert clean_original(buffer.getvalue()) is None
@@ -0,0 +1,289 @@
+"""the lean read path has to emit exactly the bytes the ORM read path emitted
+
+every case is one set of ORM fixture objects (Message, its author, its
+parent). the reference bytes are what the endpoints used to send: the ORM
+builder below validated into the response models and rendered by FastAPI's
+JSONResponse. the lean bytes are message_dict/custom_emoji_dict of the core
+row message_row_query() returns for the same objects, encoded with orjson
+"""
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Optional
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+import pytest
+
+from config import get_settings
+from models import User, Message, CustomEmoji
+from schemas import MessageResponse, MessageReplyInfo, Attachment, CustomEmojiResponse, AvatarList
+from serializers import (
+    message_dict, custom_emoji_dict, encode, json_datetime, reply_preview, reply_tombstone
+)
+
+settings = get_settings()
+
+PARENT_ID = "5b0c6f0e-4f7e-4b6a-9a43-2f3c1d1e0a00"
+
+
+# ============ ORM READ PATH (reference) ============
+
+def orm_message_response(message: Message, reactions: Optional[list] = None) -> MessageResponse:
+    """the builder the lean path replaced: pydantic models straight from ORM objects
+
+    reply_count and the attachment_only/deleted quote flags came later => they
+    are read off the same objects
+    """
+    attachments = [Attachment(**a) for a in (message.attachments or [])]
+
+    reply_info = None
+    if message.parent:
+        reply_info = MessageReplyInfo(
+            id=str(message.parent.id),
+            content=message.parent.content or "Attachment",
+            author_username=message.parent.author.username if message.parent.author else "Unknown",
+            attachment_only=not message.parent.content and bool(message.parent.attachments)
+        )
+    elif message.reply_preview and message.reply_preview.get("deleted"):
+        reply_info = MessageReplyInfo(
+            id=message.reply_preview["id"],
+            content=None,
+            author_username=message.reply_preview["author_username"],
+            deleted=True
+        )
+
+    return MessageResponse(
+        id=str(message.id),
+        content=message.content,
+        author_id=str(message.author_id),
+        author_username=message.author.username if message.author else "Unknown",
+        author_avatar=message.author.avatar if message.author else "default",
+        is_admin=message.author.is_admin if message.author else False,
+        is_pinned=message.is_pinned if message.is_pinned is not None else False,
+        attachments=attachments,
+        reactions=reactions or [],
+        created_at=message.created_at or datetime.now(timezone.utc),
+        updated_at=message.updated_at,
+        reply_to=reply_info,
+        reply_count=message.reply_count or 0
+    )
+
+
+def orm_bytes(content) -> bytes:
+    """what FastAPI sent for a response model (or a dict of them)"""
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+# ============ FIXTURES ============
+
+def user(**overrides) -> User:
+    fields = {
+        "id": "a1b2c3d4-0000-4000-8000-000000000001",
+        "username": "alice",
+        "avatar": "cat",
+        "is_admin": True
+    }
+    fields.update(overrides)
+    return User(**fields)
+
+
+def message(author: Optional[User] = None, parent: Optional[Message] = None, **overrides) -> Message:
+    fields = {
+        "id": "5b0c6f0e-4f7e-4b6a-9a43-2f3c1d1e0a01",
+        "content": "hello",
+        "author_id": author.id if author else "a1b2c3d4-0000-4000-8000-000000000009",
+        "is_pinned": False,
+        "attachments": [],
+        "created_at": datetime(2026, 10, 16, 12, 30, 5, 123456, tzinfo=timezone.utc),
+        "updated_at": None,
+        "reply_count": 0,
+    }
+    fields.update(overrides)
+    result = Message(**fields)
+    result.author = author
+    if parent is not None:
+        result.parent = parent
+        result.reply_to_id = parent.id
+        #what create_message snapshots from the parent row
+        result.reply_preview = reply_preview(
+            parent.id, parent.content, parent.attachments,
+            parent.author.username if parent.author else None,
+            settings.reply_preview_length
+        )
+    return result
+
+
+def row_of(message: Message) -> SimpleNamespace:
+    """the message_row_query() row of a fixture message (author outer joined)"""
+    author = message.author
+    return SimpleNamespace(
+        id=message.id,
+        content=message.content,
+        author_id=message.author_id,
+        reply_to_id=message.reply_to_id,
+        is_pinned=message.is_pinned,
+        attachments=message.attachments,
+        created_at=message.created_at,
+        updated_at=message.updated_at,
+        reply_count=message.reply_count,
+        reply_preview=message.reply_preview,
+        author_username=author.username if author else None,
+        author_avatar=author.avatar if author else None,
+        author_is_admin=author.is_admin if author else None
+    )
+
+
+def deleted_parent_reply() -> Message:
+    """the parent was deleted after the reply => the FK was nulled, the quote tombstoned"""
+    reply = message(user(), parent=message(user(id="b0", username="bob"), id=PARENT_ID, content="gone"))
+    reply.parent = None
+    reply.reply_to_id = None
+    reply.reply_preview = reply_tombstone(reply.reply_preview)
+    return reply
+
+
+RENDITIONS = [
+    {
+        "label": "thumb",
+        "url": "http://storage/chat/images/abc.thumb.webp",
+        "content_type": "image/webp",
+        "width": 480,
+        "height": 320,
+        "size": 10240,
+        "object_name": "images/abc.thumb.webp"
+    },
+    {
+        "label": "display",
+        "url": "http://storage/chat/images/abc.display.avif",
+        "content_type": "image/avif",
+        "width": 1600,
+        "height": 1067,
+        "size": 81920,
+        "object_name": "images/abc.display.avif"
+    },
+]
+
+REACTIONS = [
+    {
+        "emoji": "👍",
+        "count": 3,
+        "users": ["alice", "bøb", "曹"],
+        "user_avatars": ["cat", "default", "dog"],
+        "custom_emoji_url": None
+    },
+    {
+        "emoji": ":party:",
+        "count": 1,
+        "users": ["alice"],
+        "user_avatars": ["cat"],
+        "custom_emoji_url": "http://storage/chat/emojis/party.webp"
+    },
+]
+
+MESSAGES = {
+    "plain": lambda: message(user()),
+    "nulls": lambda: message(user(), content=None, attachments=None, reply_count=None, is_pinned=None),
+    "deleted-author": lambda: message(None),
+    "guest-author": lambda: message(user(username="guest_4f2a", avatar="default", is_admin=False)),
+    "unicode": lambda: message(user(username="bøb 曹"), content="naïve café ✓ 日本語 🎉 \"quoted\" \\ back\nslash\t "),
+    "offset-datetimes": lambda: message(
+        user(),
+        created_at=datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=2))),
+        updated_at=datetime(2026, 1, 2, 3, 4, 6, 1, tzinfo=timezone.utc)
+    ),
+    "negative-offset": lambda: message(
+        user(), created_at=datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone(timedelta(hours=-9, minutes=-30)))
+    ),
+    "attachments": lambda: message(user(), attachments=[
+        {
+            "type": "image",
+            "url": "http://storage/chat/images/abc.jpg",
+            "name": "photo.jpg",
+            "size": 2048000,
+            "object_name": "images/abc.jpg",
+            "width": 4000,
+            "height": 2667,
+            "placeholder": "LEHV6nWB2yk8pyo0adR*.7kCMdnj",
+            "renditions": RENDITIONS
+        },
+        {
+            "type": "gif",
+            "url": "https://static.klipy.com/x.gif",
+            "name": "GIF",
+            "gif_id": "123",
+            "preview_url": "https://static.klipy.com/x.webp"
+        },
+        {
+            #keys the schema doesn't know are dropped, missing ones default
+            "type": "file",
+            "url": "http://storage/chat/files/report.pdf",
+            "name": "räport.pdf",
+            "legacy_key": "ignored"
+        },
+        {
+            "type": "image",
+            "url": "http://storage/chat/images/def.png",
+            "name": "legacy.png",
+            "renditions": [{**RENDITIONS[0], "data": "not part of the schema"}]
+        },
+    ]),
+    "reply": lambda: message(
+        user(),
+        parent=message(user(id="b0", username="bob"), id=PARENT_ID, content="parent ✓ text"),
+        reply_count=2
+    ),
+    "reply-attachment-only": lambda: message(
+        user(),
+        parent=message(None, id=PARENT_ID, content=None, attachments=[{"type": "image", "url": "/x", "name": "x"}])
+    ),
+    "reply-deleted-parent": deleted_parent_reply,
+}
+
+
+@pytest.mark.parametrize("fixture", MESSAGES.values(), ids=MESSAGES.keys())
+@pytest.mark.parametrize("reactions", [None, REACTIONS], ids=["no-reactions", "reactions"])
+def test_message_bytes_match_the_orm_path(fixture, reactions):
+    orm_message = fixture()
+    assert encode(message_dict(row_of(orm_message), reactions)) == orm_bytes(orm_message_response(orm_message, reactions))
+
+
+def test_message_page_bytes_match_the_orm_path():
+    messages = [fixture() for fixture in MESSAGES.values()]
+    lean = {
+        "messages": [message_dict(row_of(m), REACTIONS) for m in messages],
+        "pinned_messages": [],
+        "total": len(messages)
+    }
+    orm = {
+        "messages": [orm_message_response(m, REACTIONS) for m in messages],
+        "pinned_messages": [],
+        "total": len(messages)
+    }
+    assert encode(lean) == orm_bytes(orm)
+
+
+@pytest.mark.parametrize("created_at", [
+    datetime(2026, 10, 16, 12, 0, tzinfo=timezone.utc),
+    datetime(2026, 10, 16, 12, 0, 0, 999, tzinfo=timezone(timedelta(hours=5, minutes=45))),
+])
+def test_emoji_list_bytes_match_the_orm_path(created_at):
+    emojis = [
+        CustomEmoji(id="e1", name="party_ñ", url="http://storage/chat/emojis/party.webp", created_at=created_at),
+        CustomEmoji(id="e2", name="wave", url="http://storage/chat/emojis/wave.gif", created_at=created_at),
+    ]
+    #GET /api/emojis before and after
+    orm = orm_bytes({"emojis": [CustomEmojiResponse.model_validate(e) for e in emojis]})
+    lean = ORJSONResponse({"emojis": [custom_emoji_dict(e) for e in emojis]}).body
+    assert lean == orm
+
+
+def test_avatars_body_matches_its_declared_schema():
+    import main
+    body = main.load_avatars_body()
+    assert AvatarList.model_validate_json(body).model_dump_json().encode("utf-8") == body
+    responses = main.app.openapi()["paths"]["/api/avatars"]["get"]["responses"]
+    assert responses["200"]["content"]["application/json"]["schema"] == {"$ref": "#/components/schemas/AvatarList"}
+
+
+def test_json_datetime_utc_suffix():
+    assert json_datetime(datetime(2026, 10, 16, 12, 0, tzinfo=timezone.utc)) == "2026-10-16T12:00:00Z"
+    assert json_datetime(None) is None
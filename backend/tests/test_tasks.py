@@ -0,0 +1,201 @@
+"""background jobs: media.process on a direct upload, and the purge events
+
+storage is a LocalStorage under tmp_path, the image pool runs in threads
+and the database is a small stand-in that serves the stored_objects row and
+the message the job patches => the handler itself runs unmodified
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import asyncio
+import io
+import pytest
+from PIL import Image
+
+import media
+import storage
+import tasks
+from models import Message, StoredObject
+from storage import LocalStorage
+
+OBJECT_NAME = "images/6f1c0f8e-upload.jpg"
+MARKER = "secret-location-marker"
+
+
+class FakeResult:
+    def __init__(self, value):
+        self.value = value
+
+    def scalar_one_or_none(self):
+        return self.value
+
+
+class FakeDB:
+    """get() and select(Model).where(Model.pk == value) over in-memory rows"""
+
+    def __init__(self, rows: dict):
+        self.rows = rows
+        self.commits = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def get(self, model, key):
+        return self.rows.get((model, key))
+
+    async def execute(self, statement):
+        model = statement.column_descriptions[0]["entity"]
+        return FakeResult(self.rows.get((model, statement.whereclause.right.value)))
+
+    async def commit(self):
+        self.commits += 1
+
+
+class FakeManager:
+    def __init__(self):
+        self.events = []
+
+    async def broadcast(self, event: dict):
+        self.events.append(event)
+
+
+def jpeg_with_gps(size=(800, 600)) -> bytes:
+    exif = Image.Exif()
+    exif[0x010E] = MARKER
+    exif.get_ifd(0x8825)[2] = (52.0, 31.0, 12.5)
+    buffer = io.BytesIO()
+    Image.new("RGB", size, (200, 120, 40)).save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    local = LocalStorage(str(tmp_path), "chat")
+    asyncio.run(local.ensure_bucket())
+    monkeypatch.setattr(storage, "storage", local)
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(media, "_get_pool", lambda: pool)
+    manager = FakeManager()
+    monkeypatch.setattr(tasks, "manager", manager)
+    discarded = []
+
+    async def discard(object_names):
+        discarded.extend(object_names)
+    monkeypatch.setattr(tasks, "discard", discard)
+
+    def run(data: bytes, content_type: str = "image/jpeg", stored: dict = None, collected: bool = False):
+        local._write(local._file_path(OBJECT_NAME), io.BytesIO(data), len(data))
+        row = StoredObject(object_name=OBJECT_NAME, ref_count=1, size=len(data), **(stored or {}))
+        message = Message(
+            id="m1", author_id="u1", content=None,
+            attachments=[{"type": "image", "url": "/chat/" + OBJECT_NAME, "name": "photo", "object_name": OBJECT_NAME}],
+            created_at=datetime.now(timezone.utc)
+        )
+        db = FakeDB({(StoredObject, OBJECT_NAME): row, (Message, "m1"): message})
+        sessions = iter([db, FakeDB({}) if collected else db])
+        monkeypatch.setattr(tasks, "AsyncSessionLocal", lambda: next(sessions, db))
+        asyncio.run(tasks.process_attachment({
+            "message_id": "m1", "object_name": OBJECT_NAME, "content_type": content_type
+        }))
+        return row, message, asyncio.run(local.get(OBJECT_NAME))
+
+    yield run, manager, discarded, local
+    pool.shutdown()
+
+
+def test_image_is_stripped_and_derived(env):
+    run, manager, discarded, local = env
+    row, message, stored = run(jpeg_with_gps())
+
+    assert MARKER.encode() not in stored
+    assert row.size == len(stored)
+    assert (row.derived["width"], row.derived["height"]) == (800, 600)
+    assert row.derived["placeholder"]
+    for rendition in row.derived["renditions"]:
+        assert asyncio.run(local.stat(rendition["object_name"])) is not None
+
+    attachment = message.attachments[0]
+    assert attachment["size"] == len(stored)
+    assert attachment["renditions"] == row.derived["renditions"]
+    assert manager.events == [{
+        "type": "attachments_updated",
+        "data": {"id": "m1", "attachments": message.attachments}
+    }]
+    assert discarded == []
+
+
+def test_unprocessable_image_is_still_stripped(env, monkeypatch):
+    run, manager, _, _ = env
+    monkeypatch.setattr(tasks.settings, "image_process_max_bytes", 10)
+    row, message, stored = run(jpeg_with_gps())
+
+    assert MARKER.encode() not in stored
+    assert row.derived == {}
+    assert "renditions" not in message.attachments[0]
+    assert manager.events[0]["type"] == "attachments_updated"
+
+
+def test_processed_object_is_left_alone(env):
+    run, manager, _, _ = env
+    data = jpeg_with_gps()
+    row, _, stored = run(data, stored={"derived": {"width": 1, "height": 1}})
+
+    assert stored == data
+    assert manager.events == []
+
+
+def test_object_collected_meanwhile_discards_the_renditions(env):
+    run, manager, discarded, _ = env
+    row, message, _ = run(jpeg_with_gps(), collected=True)
+
+    assert OBJECT_NAME in discarded
+    assert any(name.endswith(".thumb.webp") for name in discarded)
+    assert row.derived is None
+    assert manager.events == []
+
+
+def purge_event(event_type: str, reason: str, before: datetime, done: bool = False) -> dict:
+    return {
+        "type": event_type,
+        "data": {"purge_id": 1, "reason": reason, "before": before.isoformat(), "deleted": 0, "done": done}
+    }
+
+
+def test_retention_purge_hides_rows_until_done():
+    horizon = tasks.PurgeHorizon()
+    cutoff = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    assert horizon.before is None
+
+    horizon.on_event(purge_event("purge_started", "retention", cutoff))
+    assert horizon.before == cutoff
+    horizon.on_event(purge_event("purge_progress", "retention", cutoff))
+    assert horizon.before == cutoff
+    horizon.on_event(purge_event("purge_progress", "retention", cutoff, done=True))
+    assert horizon.before is None
+
+
+def test_purge_batches_keep_the_caches():
+    from message_cache import MessageCache, PageCache
+    messages, pages = MessageCache(10), PageCache(10)
+    messages.put({"id": "m1"}, [], None, messages.version)
+    pages.put("page", b"{}", pages.version)
+    cutoff = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    pages.on_event(purge_event("purge_started", "retention", cutoff))
+    assert pages.get("page") is None
+    pages.put("page", b"{}", pages.version)
+
+    for _ in range(3):
+        event = purge_event("purge_progress", "retention", cutoff)
+        messages.on_event(event)
+        pages.on_event(event)
+    assert messages.get("m1") is not None
+    assert pages.get("page") is not None
+
+    done = purge_event("purge_progress", "retention", cutoff, done=True)
+    messages.on_event(done)
+    pages.on_event(done)
+    assert messages.get("m1") is None
+    assert pages.get("page") is None
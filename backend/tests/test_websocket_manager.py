@@ -0,0 +1,76 @@
+"""a socket that stops reading: its queue fills, typing/presence frames make
+room first, and the first critical event it can't take closes it with
+WS_CLOSE_FELL_BEHIND so the client resumes or refetches
+"""
+import asyncio
+
+import websocket_manager
+from websocket_manager import ConnectionManager, WS_CLOSE_FELL_BEHIND
+
+QUEUE_SIZE = 4
+
+
+class StalledSocket:
+    """accepts and never finishes a send, like a peer that stopped reading"""
+
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+        self._never = asyncio.Event()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, frame: str):
+        self.sent.append(frame)
+        await self._never.wait()
+
+    async def close(self, code: int = 1000):
+        self.closed_with = code
+
+
+def run(scenario, monkeypatch):
+    monkeypatch.setattr(websocket_manager.settings, "ws_send_queue_size", QUEUE_SIZE)
+
+    async def main():
+        manager = ConnectionManager()
+        socket = StalledSocket()
+        connection_id = await manager.connect(socket, "u1", {"username": "alice"})
+        await manager.start_session(connection_id, {"type": "connected", "data": {}})
+        #the writer takes the welcome frame and blocks on it
+        await asyncio.sleep(0)
+        await scenario(manager, connection_id)
+        #closes run in the background
+        await asyncio.gather(*manager._closing)
+        alive, closed_with = connection_id in manager._connections, socket.closed_with
+        await manager.close_all()
+        return closed_with, alive
+    return asyncio.run(main())
+
+
+def test_full_queue_closes_on_the_first_lost_critical_event(monkeypatch):
+    async def scenario(manager, connection_id):
+        for number in range(QUEUE_SIZE):
+            await manager.broadcast({"type": "new_message", "data": {"id": str(number)}})
+        assert connection_id in manager._connections
+        await manager.broadcast({"type": "new_message", "data": {"id": "lost"}})
+
+    closed_with, alive = run(scenario, monkeypatch)
+    assert not alive
+    assert closed_with == WS_CLOSE_FELL_BEHIND
+
+
+def test_droppable_frames_make_room_for_critical_ones(monkeypatch):
+    async def scenario(manager, connection_id):
+        for _ in range(QUEUE_SIZE):
+            await manager.broadcast({"type": "typing_state", "data": {"users": []}})
+        for number in range(QUEUE_SIZE):
+            await manager.broadcast({"type": "new_message", "data": {"id": str(number)}})
+        queued = [event_type for event_type, _ in manager._connections[connection_id].queue]
+        assert queued == ["new_message"] * QUEUE_SIZE
+        #a full queue of critical events still swallows typing/presence
+        await manager.broadcast({"type": "typing_state", "data": {"users": []}})
+
+    closed_with, alive = run(scenario, monkeypatch)
+    assert alive
+    assert closed_with is None
@@ -1,10 +1,70 @@
 from fastapi import WebSocket
-from typing import Dict, List, Optional
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+from collections import deque
+from config import get_settings
+from event_bus import EventBus, InProcessEventBus
 import asyncio
 import logging
+import orjson
+import time
 import uuid
 
 logger = logging.getLogger(__name__)
+settings = get_settings()
+
+#events that are safe to lose when a client falls behind (presence/typing/heartbeat)
+DROPPABLE_EVENTS = {"typing_state", "presence_delta", "ping"}
+
+#close code of a socket that could not take a critical event => its client
+#reconnects at once and resumes (or gets resync_required and refetches)
+WS_CLOSE_FELL_BEHIND = 4008
+
+
+def encode_event(message: dict) -> str:
+    """serialize an event once into the text frame every socket receives"""
+    return orjson.dumps(message).decode("utf-8")
+
+
+class _Connection:
+    """outbound side of a single socket: a bounded queue drained by its own writer task"""
+    
+    def __init__(self, connection_id: str, websocket: WebSocket, max_queue: int):
+        self.connection_id = connection_id
+        self.websocket = websocket
+        self.max_queue = max_queue
+        #(event type, pre-encoded text frame)
+        self.queue: Deque[Tuple[str, str]] = deque()
+        self.wakeup = asyncio.Event()
+        self.writer: Optional[asyncio.Task] = None
+        #last sequence number already queued when the socket registered
+        self.registered_seq = 0
+        #monotonic time of the last inbound frame (any message counts as a pong)
+        self.last_activity = time.monotonic()
+        self.last_ping = 0.0
+    
+    def enqueue(self, event_type: str, frame: str) -> bool:
+        """queue an encoded frame without waiting on the socket
+        
+        returns false if a critical event could not be queued => the client
+        missed it and the connection has to be closed
+        """
+        if len(self.queue) < self.max_queue:
+            self.queue.append((event_type, frame))
+            self.wakeup.set()
+            return True
+        
+        if event_type in DROPPABLE_EVENTS:
+            return True
+        
+        #make room for a critical event by evicting the oldest typing/presence frame
+        for index, (queued_type, _) in enumerate(self.queue):
+            if queued_type in DROPPABLE_EVENTS:
+                del self.queue[index]
+                self.queue.append((event_type, frame))
+                self.wakeup.set()
+                return True
+        
+        return False
 
 
 class ConnectionManager:
@@ -15,14 +75,80 @@ class ConnectionManager:
         self.user_connections: Dict[str, List[str]] = {}
         #connection_id -> user_info
         self.connection_info: Dict[str, dict] = {}
+        #connection_id -> outbound queue + writer
+        self._connections: Dict[str, _Connection] = {}
         self._lock = asyncio.Lock()
+        #unique per process => lets a worker ignore its own events on the bus
+        self.worker_id = uuid.uuid4().hex
+        self._bus: EventBus = InProcessEventBus()
+        #worker_id -> {"users": {user_id: presence entry}, "seen": monotonic time}
+        self._remote_presence: Dict[str, dict] = {}
+        self._presence_task: Optional[asyncio.Task] = None
+        #incremental presence index: user_id -> entry for users online on any
+        #worker, plus the subset connected to this worker
+        self._presence: Dict[str, dict] = {}
+        self._local_users: Dict[str, dict] = {}
+        #sorted snapshot of _presence, rebuilt lazily after a change
+        self._online_snapshot: Optional[list] = None
+        #join/leave churn collected until the next presence_delta frame
+        self._pending_joins: Dict[str, dict] = {}
+        self._pending_leaves: set = set()
+        self._presence_delta_task: Optional[asyncio.Task] = None
+        #sequence numbers are per process => the worker id doubles as the epoch
+        #a resuming client has to match. resume across workers is out of scope:
+        #a reconnect that lands on another worker gets resync_required (sticky
+        #sessions keep multi-worker deploys gap-free)
+        self._seq = 0
+        #(seq, event type, encoded frame) of recent replayable events
+        self._history: Deque[Tuple[int, str, str]] = deque(maxlen=settings.ws_replay_buffer_size)
+        #user_id -> {"username": ..., "expires": monotonic time} of everyone typing
+        self._typists: Dict[str, dict] = {}
+        #user_id -> monotonic time of the last accepted inbound typing event
+        self._typing_inbound: Dict[str, float] = {}
+        self._typing_changed = False
+        self._typing_task: Optional[asyncio.Task] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+        #background close handshakes of sockets already removed from the registry
+        self._closing: set = set()
+        #called with every event fanned out on this worker (local or from the bus)
+        self._listeners: List[Callable[[dict], None]] = []
+    
+    def add_listener(self, listener: Callable[[dict], None]):
+        self._listeners.append(listener)
+    
+    async def start(self, bus: EventBus):
+        """attach the pub/sub backend that carries events to the other workers"""
+        self._bus = bus
+        await bus.start(self._on_bus_event)
+        self._typing_task = asyncio.create_task(self._typing_loop())
+        self._presence_delta_task = asyncio.create_task(self._presence_delta_loop())
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        if bus.distributed:
+            self._presence_task = asyncio.create_task(self._presence_loop())
+            #ask the workers that are already running who they have online
+            await self._publish({"kind": "presence_request"})
+    
+    async def stop(self):
+        for task in (self._presence_task, self._typing_task, self._presence_delta_task, self._heartbeat_task):
+            if task:
+                task.cancel()
+        self._presence_task = None
+        self._typing_task = None
+        self._presence_delta_task = None
+        self._heartbeat_task = None
+        await self.close_all()
+        await self._bus.stop()
     
     async def connect(self, websocket: WebSocket, user_id: str, user_info: dict) -> str:
+        """register a socket; nothing is sent until start_session() is called"""
         await websocket.accept()
         connection_id = str(uuid.uuid4())
+        conn = _Connection(connection_id, websocket, settings.ws_send_queue_size)
+        conn.registered_seq = self._seq
         
         async with self._lock:
             self.active_connections[connection_id] = websocket
+            self._connections[connection_id] = conn
             self.connection_info[connection_id] = {
                 **user_info,
                 "user_id": user_id,
@@ -38,18 +164,14 @@ class ConnectionManager:
         logger.info(f"User {user_info.get('username', user_id)} connected (conn: {connection_id[:8]}). Total connections: {len(self.active_connections)}")
         
         if is_first_connection:
-            await self.broadcast({
-                "type": "user_join",
-                "data": {
-                    "user_id": user_id,
-                    **user_info,
-                    "online_count": self.get_online_count()
-                }
-            }, exclude_connection=connection_id)
+            entry = self._presence_entry(self.connection_info[connection_id])
+            self._local_users[user_id] = entry
+            self._update_presence(user_id, entry)
+            await self._publish({"kind": "presence", "joined": {user_id: entry}})
         
         return connection_id
     
-    async def disconnect(self, connection_id: str):
+    async def disconnect(self, connection_id: str, close: bool = False, code: int = 1013):
         user_info = {}
         user_id = None
         is_last_connection = False
@@ -62,6 +184,8 @@ class ConnectionManager:
             if connection_id in self.active_connections:
                 del self.active_connections[connection_id]
             
+            conn = self._connections.pop(connection_id, None)
+            
             if user_id and user_id in self.user_connections:
                 if connection_id in self.user_connections[user_id]:
                     self.user_connections[user_id].remove(connection_id)
@@ -69,83 +193,441 @@ class ConnectionManager:
                     del self.user_connections[user_id]
                     is_last_connection = True
         
+        if conn is None:
+            return
+        
+        #the writer may be the one reporting its own failure => don't cancel ourselves
+        if conn.writer and conn.writer is not asyncio.current_task():
+            conn.writer.cancel()
+        
+        if close:
+            self._close_later(conn.websocket, code)
+        
         logger.info(f"User {user_info.get('username', 'unknown')} disconnected (conn: {connection_id[:8]}). Total connections: {len(self.active_connections)}")
         
         if is_last_connection and user_id:
-            await self.broadcast({
-                "type": "user_leave",
-                "data": {
-                    "user_id": user_id,
-                    **{k: v for k, v in user_info.items() if k not in ["connection_id"]},
-                    "online_count": self.get_online_count()
-                }
-            })
+            self._local_users.pop(user_id, None)
+            self._update_presence(user_id)
+            await self._publish({"kind": "presence", "left": [user_id]})
+            await self.stop_typing(user_id)
     
-    async def send_personal(self, user_id: str, message: dict):
-        connection_ids = self.user_connections.get(user_id, [])
-        disconnected = []
+    def _close_later(self, websocket: WebSocket, code: int):
+        """close a socket in the background
+        
+        a stalled or half-open peer never answers the close handshake => the
+        close is bounded by ws_close_timeout and never awaited by a fan-out
+        """
+        async def close():
+            try:
+                await asyncio.wait_for(websocket.close(code=code), timeout=settings.ws_close_timeout)
+            except Exception:
+                pass
+        
+        task = asyncio.create_task(close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+    
+    async def start_session(
+        self,
+        connection_id: str,
+        welcome: dict,
+        resume_from: Optional[int] = None,
+        epoch: Optional[str] = None
+    ):
+        """send the welcome frame (plus missed events for a resuming client) and start writing
+        
+        everything broadcast since connect() is already queued, so the welcome
+        and replay frames are put in front of it
+        """
+        conn = self._connections.get(connection_id)
+        if conn is None:
+            return
+        
+        welcome = {**welcome, "data": {**welcome.get("data", {}), "seq": conn.registered_seq, "epoch": self.worker_id}}
+        prefix = [(welcome.get("type", ""), encode_event(welcome))]
+        
+        if resume_from is not None:
+            missed = self._missed_frames(resume_from, epoch, conn.registered_seq)
+            if missed is None:
+                prefix.append(("resync_required", encode_event({"type": "resync_required", "data": {}})))
+            else:
+                prefix.extend(missed)
+        
+        conn.queue.extendleft(reversed(prefix))
+        conn.wakeup.set()
+        conn.writer = asyncio.create_task(self._writer(conn))
+    
+    def _missed_frames(self, resume_from: int, epoch: Optional[str], upto: int) -> Optional[List[Tuple[str, str]]]:
+        """events a client last at `resume_from` missed, or None if it has to refetch"""
+        if epoch != self.worker_id or resume_from > upto:
+            return None
+        if resume_from == upto:
+            return []
+        
+        oldest = self._history[0][0] if self._history else upto + 1
+        if resume_from + 1 < oldest or upto - resume_from > settings.ws_send_queue_size:
+            return None
+        
+        return [(event_type, frame) for seq, event_type, frame in self._history if resume_from < seq <= upto]
+    
+    async def _writer(self, conn: _Connection):
+        """drain one connection's queue so a slow socket only ever delays itself"""
+        try:
+            while True:
+                while not conn.queue:
+                    conn.wakeup.clear()
+                    await conn.wakeup.wait()
+                _, frame = conn.queue.popleft()
+                await conn.websocket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Failed to send to connection {conn.connection_id[:8]}: {e}")
+            await self.disconnect(conn.connection_id)
+    
+    async def _enqueue(self, connection_ids: List[str], message: dict):
+        if not connection_ids:
+            return
+        
+        #encoded exactly once, the same buffer goes to every socket
+        await self._enqueue_frame(connection_ids, message.get("type", ""), encode_event(message))
+    
+    async def _enqueue_frame(self, connection_ids: List[str], event_type: str, frame: str):
+        overflowed = []
         
         for conn_id in connection_ids:
-            if conn_id in self.active_connections:
-                try:
-                    await self.active_connections[conn_id].send_json(message)
-                except Exception as e:
-                    logger.warning(f"Failed to send message to connection {conn_id[:8]}: {e}")
-                    disconnected.append(conn_id)
+            conn = self._connections.get(conn_id)
+            if conn and not conn.enqueue(event_type, frame):
+                overflowed.append(conn_id)
         
-        for conn_id in disconnected:
-            await self.disconnect(conn_id)
+        for conn_id in overflowed:
+            logger.warning(f"Connection {conn_id[:8]} fell too far behind, disconnecting")
+            await self.disconnect(conn_id, close=True, code=WS_CLOSE_FELL_BEHIND)
+    
+    async def send_to_connection(self, connection_id: str, message: dict):
+        await self._enqueue([connection_id], message)
+    
+    async def send_personal(self, user_id: str, message: dict):
+        await self._enqueue(list(self.user_connections.get(user_id, [])), message)
+        await self._publish({"kind": "personal", "user_id": user_id, "message": message})
     
     async def broadcast(self, message: dict, exclude_user: Optional[str] = None, exclude_connection: Optional[str] = None):
-        disconnected = []
+        """deliver to every socket on every worker"""
+        await self._fanout(message, exclude_user, exclude_connection)
+        await self._publish({
+            "kind": "broadcast",
+            "message": message,
+            "exclude_user": exclude_user,
+            "exclude_connection": exclude_connection
+        })
+    
+    async def _fanout(self, message: dict, exclude_user: Optional[str] = None, exclude_connection: Optional[str] = None):
+        """deliver to the sockets connected to this worker only
         
-        async with self._lock:
-            connections = dict(self.active_connections)
-            conn_info = dict(self.connection_info)
+        everything except typing/presence gets a sequence number and is kept
+        in the replay buffer for resuming clients
+        """
+        event_type = message.get("type", "")
+        for listener in self._listeners:
+            try:
+                listener(message)
+            except Exception as e:
+                logger.error(f"Event listener failed on {event_type}: {e}")
         
-        for conn_id, websocket in connections.items():
-            info = conn_info.get(conn_id, {})
-            user_id = info.get("user_id")
-            
-            if exclude_user and user_id == exclude_user:
+        if event_type in DROPPABLE_EVENTS:
+            frame = encode_event(message)
+        else:
+            self._seq += 1
+            frame = encode_event({**message, "seq": self._seq})
+            self._history.append((self._seq, event_type, frame))
+        
+        targets = []
+        
+        for conn_id, info in self.connection_info.items():
+            if exclude_user and info.get("user_id") == exclude_user:
                 continue
             
             if exclude_connection and conn_id == exclude_connection:
                 continue
             
+            targets.append(conn_id)
+        
+        await self._enqueue_frame(targets, event_type, frame)
+    
+    async def close_all(self):
+        """stop every writer task (used on shutdown)"""
+        for conn_id in list(self._connections):
+            await self.disconnect(conn_id, close=True)
+        if self._closing:
+            await asyncio.gather(*self._closing, return_exceptions=True)
+    
+    # ============ HEARTBEAT ============
+    
+    def touch(self, connection_id: str):
+        """record inbound traffic on a socket (called for every received message)"""
+        conn = self._connections.get(connection_id)
+        if conn:
+            conn.last_activity = time.monotonic()
+    
+    async def _heartbeat_loop(self):
+        """ping quiet sockets and reap the ones that stopped answering
+        
+        half-open tcp connections never fail a send on their own, so without
+        this they would stay in the fan-out lists and the online count
+        """
+        interval = settings.ws_heartbeat_interval
+        while True:
+            await asyncio.sleep(min(interval, settings.ws_heartbeat_timeout) / 2)
             try:
-                await websocket.send_json(message)
+                now = time.monotonic()
+                dead = []
+                
+                for conn_id, conn in list(self._connections.items()):
+                    #welcome not sent yet => nothing to judge
+                    if conn.writer is None:
+                        continue
+                    
+                    if now - conn.last_activity > settings.ws_heartbeat_timeout:
+                        dead.append(conn_id)
+                    elif now - conn.last_activity >= interval and now - conn.last_ping >= interval:
+                        conn.last_ping = now
+                        await self._enqueue([conn_id], {"type": "ping", "data": {}})
+                
+                #dead peers are the ones whose close handshake never completes =>
+                #all of them are unregistered at once and closed in the background
+                for conn_id in dead:
+                    logger.info(f"Connection {conn_id[:8]} missed its heartbeat, reaping")
+                if dead:
+                    await asyncio.gather(
+                        *(self.disconnect(conn_id, close=True, code=1001) for conn_id in dead),
+                        return_exceptions=True
+                    )
             except Exception as e:
-                logger.warning(f"Failed to broadcast to connection {conn_id[:8]}: {e}")
-                disconnected.append(conn_id)
+                logger.error(f"Heartbeat error: {e}")
+    
+    def get_connection_activity(self) -> List[dict]:
+        """per-socket idle time on this worker"""
+        now = time.monotonic()
+        activity = []
+        for conn_id, conn in self._connections.items():
+            info = self.connection_info.get(conn_id, {})
+            activity.append({
+                "connection_id": conn_id,
+                "user_id": info.get("user_id"),
+                "username": info.get("username"),
+                "idle_seconds": round(now - conn.last_activity, 1),
+                "last_activity": time.time() - (now - conn.last_activity)
+            })
+        return activity
+    
+    # ============ CROSS-WORKER EVENTS ============
+    
+    async def _publish(self, event: dict):
+        if not self._bus.distributed:
+            return
+        await self._bus.publish({**event, "origin": self.worker_id})
+    
+    async def _on_bus_event(self, event: dict):
+        origin = event.get("origin")
+        if not origin or origin == self.worker_id:
+            return
         
-        for conn_id in disconnected:
-            await self.disconnect(conn_id)
+        kind = event.get("kind")
+        if kind == "broadcast":
+            await self._fanout(event["message"], event.get("exclude_user"), event.get("exclude_connection"))
+        
+        elif kind == "personal":
+            await self._enqueue(list(self.user_connections.get(event["user_id"], [])), event["message"])
+        
+        elif kind == "presence":
+            await self._apply_remote_presence(origin, event.get("joined", {}), event.get("left", []))
+        
+        elif kind == "presence_sync":
+            users = event.get("users", {})
+            known = self._remote_presence.get(origin, {}).get("users", {})
+            left = [user_id for user_id in known if user_id not in users]
+            await self._apply_remote_presence(origin, users, left)
+        
+        elif kind == "presence_request":
+            await self._publish_presence_snapshot()
+        
+        elif kind == "typing":
+            self._record_typing(event["user_id"], event["username"])
+        
+        elif kind == "typing_stop":
+            self._clear_typing(event["user_id"])
     
-    def get_online_users(self) -> list:
-        seen_users = set()
-        users = []
+    async def _apply_remote_presence(self, origin: str, joined: Dict[str, dict], left: List[str]):
+        entry = self._remote_presence.setdefault(origin, {"users": {}, "seen": 0.0})
+        entry["seen"] = time.monotonic()
         
-        for conn_id, info in self.connection_info.items():
-            user_id = info.get("user_id")
-            if user_id and user_id not in seen_users:
-                seen_users.add(user_id)
-                users.append({
-                    "user_id": user_id,
-                    "username": info.get("username"),
-                    "avatar": info.get("avatar"),
-                    "is_admin": info.get("is_admin"),
+        for user_id, info in joined.items():
+            entry["users"][user_id] = info
+            self._update_presence(user_id, info)
+        
+        for user_id in left:
+            if entry["users"].pop(user_id, None) is not None:
+                self._update_presence(user_id)
+    
+    async def _publish_presence_snapshot(self):
+        await self._publish({"kind": "presence_sync", "users": self._local_users})
+    
+    async def _presence_loop(self):
+        """periodically re-announce local presence and forget workers that went silent"""
+        interval = settings.presence_sync_interval
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._publish_presence_snapshot()
+                
+                cutoff = time.monotonic() - interval * 3
+                for origin, entry in list(self._remote_presence.items()):
+                    if entry["seen"] < cutoff:
+                        logger.info(f"Worker {origin[:8]} stopped reporting presence, dropping its users")
+                        users = list(entry["users"])
+                        self._remote_presence.pop(origin, None)
+                        for user_id in users:
+                            self._update_presence(user_id)
+            except Exception as e:
+                logger.error(f"Presence sync error: {e}")
+    
+    # ============ TYPING ============
+    #readers only need to know who is typing => inbound keystroke events are
+    #throttled per user and everyone typing is sent in one periodic frame
+    
+    async def note_typing(self, user_id: str, username: str):
+        now = time.monotonic()
+        if now - self._typing_inbound.get(user_id, 0.0) < settings.ws_typing_throttle:
+            return
+        self._typing_inbound[user_id] = now
+        self._record_typing(user_id, username)
+        await self._publish({"kind": "typing", "user_id": user_id, "username": username})
+    
+    async def stop_typing(self, user_id: str):
+        if self._clear_typing(user_id):
+            await self._publish({"kind": "typing_stop", "user_id": user_id})
+    
+    def _record_typing(self, user_id: str, username: str):
+        if user_id not in self._typists:
+            self._typing_changed = True
+        self._typists[user_id] = {
+            "username": username,
+            "expires": time.monotonic() + settings.ws_typing_ttl
+        }
+    
+    def _clear_typing(self, user_id: str) -> bool:
+        self._typing_inbound.pop(user_id, None)
+        if self._typists.pop(user_id, None) is None:
+            return False
+        self._typing_changed = True
+        return True
+    
+    def get_typing_users(self) -> list:
+        return [
+            {"user_id": user_id, "username": state["username"]}
+            for user_id, state in self._typists.items()
+        ]
+    
+    async def _typing_loop(self):
+        """emit at most one typing_state frame per interval, and only on changes"""
+        while True:
+            await asyncio.sleep(settings.ws_typing_interval)
+            try:
+                now = time.monotonic()
+                for user_id, state in list(self._typists.items()):
+                    if state["expires"] <= now:
+                        self._clear_typing(user_id)
+                
+                if not self._typing_changed:
+                    continue
+                self._typing_changed = False
+                
+                #every worker tracks all typists => fan out locally only
+                await self._fanout({
+                    "type": "typing_state",
+                    "data": {"users": self.get_typing_users()}
                 })
+            except Exception as e:
+                logger.error(f"Typing state error: {e}")
+    
+    # ============ PRESENCE ============
+    
+    @staticmethod
+    def _presence_entry(info: dict) -> dict:
+        return {
+            "user_id": info.get("user_id"),
+            "username": info.get("username"),
+            "avatar": info.get("avatar"),
+            "is_admin": info.get("is_admin"),
+        }
+    
+    def _update_presence(self, user_id: str, entry: Optional[dict] = None):
+        """re-evaluate one user after a local or remote join/leave"""
+        online = user_id in self._local_users or any(
+            user_id in remote["users"] for remote in self._remote_presence.values()
+        )
+        
+        if online and user_id not in self._presence:
+            self._presence[user_id] = entry or self._local_users.get(user_id) or {"user_id": user_id}
+            self._online_snapshot = None
+            #joined and left again within one interval => nothing to report
+            if user_id in self._pending_leaves:
+                self._pending_leaves.discard(user_id)
+            else:
+                self._pending_joins[user_id] = self._presence[user_id]
         
-        return users
+        elif not online and user_id in self._presence:
+            del self._presence[user_id]
+            self._online_snapshot = None
+            if user_id in self._pending_joins:
+                del self._pending_joins[user_id]
+            else:
+                self._pending_leaves.add(user_id)
+    
+    async def _presence_delta_loop(self):
+        """send join/leave churn as one presence_delta frame per interval"""
+        while True:
+            await asyncio.sleep(settings.ws_presence_interval)
+            if not self._pending_joins and not self._pending_leaves:
+                continue
+            
+            joined = list(self._pending_joins.values())
+            left = list(self._pending_leaves)
+            self._pending_joins = {}
+            self._pending_leaves = set()
+            
+            try:
+                #every worker tracks cluster-wide presence => fan out locally only
+                await self._fanout({
+                    "type": "presence_delta",
+                    "data": {
+                        "joined": joined,
+                        "left": left,
+                        "online_count": self.get_online_count()
+                    }
+                })
+            except Exception as e:
+                logger.error(f"Presence delta error: {e}")
+    
+    def get_online_users(self, offset: int = 0, limit: Optional[int] = None) -> list:
+        """online users across all workers, admins first"""
+        if self._online_snapshot is None:
+            self._online_snapshot = sorted(
+                self._presence.values(),
+                key=lambda u: (not u.get("is_admin"), u.get("username") or "")
+            )
+        if limit is None:
+            return self._online_snapshot[offset:]
+        return self._online_snapshot[offset:offset + limit]
     
     def get_online_count(self) -> int:
-        return len(self.user_connections)
+        return len(self._presence)
     
     def is_user_online(self, user_id: str) -> bool:
-        return user_id in self.user_connections and len(self.user_connections[user_id]) > 0
+        return user_id in self._presence
     
     def get_user_connection_count(self, user_id: str) -> int:
+        """sockets this user has open on this worker"""
         return len(self.user_connections.get(user_id, []))
 
 
@@ -115,8 +115,11 @@ export const useAuthStore = defineStore('auth', () => {
       headers: { 'Authorization': `Bearer ${token.value}` }
     })
     
-    if (res.ok && user.value) {
-      user.value.avatar = avatar
+    if (res.ok) {
+      const data = await res.json()
+      //guest identities live in the token => swap in the re-signed one
+      if (data.access_token) setToken(data.access_token)
+      if (user.value) user.value.avatar = avatar
     }
   }
 
@@ -152,6 +155,7 @@ export const useAuthStore = defineStore('auth', () => {
     fetchUser,
     updateAvatar,
     logout,
+    setToken,
     handleWsToken,
   }
 })
\ No newline at end of file
@@ -2,6 +2,9 @@ import { defineStore } from 'pinia'
 import { ref } from 'vue'
 import { useAuthStore } from './auth'
 
+//close code of a socket the server dropped for falling behind (websocket_manager.py)
+const WS_CLOSE_FELL_BEHIND = 4008
+
 export const useChatStore = defineStore('chat', () => {
   const messages = ref([])
   const pinnedMessages = ref([])
@@ -14,6 +17,16 @@ export const useChatStore = defineStore('chat', () => {
   const hasMore = ref(true)
   const avatars = ref([])
   const customEmojis = ref([])
+  //message id -> emojis the current user reacted with (summaries only list
+  //the most recent reactors, so this can't be read off reaction.users)
+  const myReactions = ref({})
+  
+  //keyset cursor of the oldest loaded message (opaque, from the server)
+  let olderCursor = null
+  
+  //resume state => lets a reconnect replay only the events we missed
+  let lastSeq = null
+  let wsEpoch = null
   
   const authStore = useAuthStore()
 
@@ -104,15 +117,54 @@ export const useChatStore = defineStore('chat', () => {
           //initial load
           messages.value = hydratedMessages
           pinnedMessages.value = (data.pinned_messages || []).map(hydrateMessageReactions)
+          myReactions.value = {}
         }
         
         hasMore.value = data.has_more
+        olderCursor = data.before_cursor
+        
+        const loaded = before ? hydratedMessages : [...hydratedMessages, ...pinnedMessages.value]
+        await fetchMyReactions(loaded.filter(m => m.reactions?.length).map(m => m.id))
       }
     } finally {
       loading.value = false
     }
   }
   
+  function fetchOlderMessages() {
+    if (!olderCursor) return
+    return fetchMessages(olderCursor)
+  }
+  
+  //PUT a file straight to storage => returns its upload token, or null when
+  //direct uploads are unavailable (the file then goes through the api instead)
+  async function uploadDirect(file) {
+    const contentType = file.type || 'application/octet-stream'
+    try {
+      const res = await fetch('/api/uploads', {
+        method: 'POST',
+        headers: {
+          'Authorization': `Bearer ${authStore.token}`,
+          'Content-Type': 'application/json'
+        },
+        body: JSON.stringify({ filename: file.name, content_type: contentType, size: file.size })
+      })
+      //not configured or refused (e.g. too large) => the api path reports the error
+      if (!res.ok) return null
+      
+      const session = await res.json()
+      const put = await fetch(session.upload_url, {
+        method: 'PUT',
+        headers: { 'Content-Type': contentType },
+        body: file
+      })
+      return put.ok ? session.upload_token : null
+    } catch (e) {
+      console.error('Direct upload failed, sending through the api:', e)
+      return null
+    }
+  }
+  
   async function sendMessage(content, files = [], replyToId = null, gif = null) {
     const formData = new FormData()
     if (content) formData.append('content', content)
@@ -125,7 +177,11 @@ export const useChatStore = defineStore('chat', () => {
       if (gif.preview_url) formData.append('gif_preview_url', gif.preview_url)
     }
     
-    files.forEach(file => formData.append('files', file))
+    const tokens = await Promise.all(files.map(uploadDirect))
+    files.forEach((file, index) => {
+      if (tokens[index]) formData.append('uploads', tokens[index])
+      else formData.append('files', file)
+    })
     
     const res = await fetch('/api/messages', {
       method: 'POST',
@@ -194,6 +250,46 @@ export const useChatStore = defineStore('chat', () => {
     if (!res.ok) {
       throw new Error('Failed to toggle reaction')
     }
+    
+    const data = await res.json()
+    setMyReaction(messageId, emoji, data.action === 'added')
+  }
+  
+  async function fetchMyReactions(messageIds) {
+    if (!authStore.token || !messageIds.length) return
+    const params = new URLSearchParams()
+    messageIds.forEach(id => params.append('message_id', id))
+    try {
+      const res = await fetch(`/api/reactions/mine?${params}`, {
+        headers: { 'Authorization': `Bearer ${authStore.token}` }
+      })
+      if (res.ok) {
+        const data = await res.json()
+        myReactions.value = { ...myReactions.value, ...data.reactions }
+      }
+    } catch (e) {
+      console.error('Failed to fetch own reactions:', e)
+    }
+  }
+  
+  function hasReacted(messageId, emoji) {
+    return (myReactions.value[messageId] || []).includes(emoji)
+  }
+  
+  function setMyReaction(messageId, emoji, reacted) {
+    const emojis = (myReactions.value[messageId] || []).filter(e => e !== emoji)
+    if (reacted) emojis.push(emoji)
+    myReactions.value = { ...myReactions.value, [messageId]: emojis }
+  }
+  
+  //summaries only carry the most recent reactors => full list is paged
+  async function fetchReactionUsers(messageId, emoji, offset = 0, limit = 100) {
+    const params = new URLSearchParams({ offset: String(offset), limit: String(limit) })
+    const res = await fetch(`/api/messages/${messageId}/reactions/${encodeURIComponent(emoji)}?${params}`)
+    if (!res.ok) {
+      throw new Error('Failed to load reactions')
+    }
+    return await res.json()
   }
 
   async function searchGifs(query, pos = null) {
@@ -228,7 +324,14 @@ export const useChatStore = defineStore('chat', () => {
   
   function connectWebSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:'
-    const wsUrl = `${protocol}//${window.location.host}/ws${authStore.token ? `?token=${authStore.token}` : ''}`
+    const params = new URLSearchParams()
+    if (authStore.token) params.append('token', authStore.token)
+    if (wsEpoch && lastSeq !== null) {
+      params.append('resume_from', lastSeq)
+      params.append('epoch', wsEpoch)
+    }
+    const query = params.toString()
+    const wsUrl = `${protocol}//${window.location.host}/ws${query ? `?${query}` : ''}`
     
     ws.value = new WebSocket(wsUrl)
     
@@ -237,10 +340,11 @@ export const useChatStore = defineStore('chat', () => {
       console.log('WebSocket connected')
     }
     
-    ws.value.onclose = () => {
+    ws.value.onclose = (event) => {
       wsConnected.value = false
       console.log('WebSocket disconnected, reconnecting...')
-      setTimeout(connectWebSocket, 3000)
+      //we fell behind and missed events => resume (or resync) right away
+      setTimeout(connectWebSocket, event.code === WS_CLOSE_FELL_BEHIND ? 0 : 3000)
     }
     
     ws.value.onerror = (error) => {
@@ -249,6 +353,9 @@ export const useChatStore = defineStore('chat', () => {
     
     ws.value.onmessage = (event) => {
       const data = JSON.parse(event.data)
+      if (data.seq !== undefined && (lastSeq === null || data.seq > lastSeq)) {
+        lastSeq = data.seq
+      }
       handleWSMessage(data)
     }
   }
@@ -259,6 +366,13 @@ export const useChatStore = defineStore('chat', () => {
         onlineUsers.value = data.data.online_users
         onlineCount.value = data.data.online_count
         
+        //a different epoch means another worker (or a restart) => sequence starts over,
+        //the server already sent resync_required if we asked to resume
+        if (data.data.epoch !== wsEpoch) {
+          wsEpoch = data.data.epoch
+          lastSeq = data.data.seq
+        }
+        
         if (data.data.token) {
           authStore.handleWsToken(data.data.token)
         }
@@ -289,12 +403,44 @@ export const useChatStore = defineStore('chat', () => {
       case 'message_deleted':
         messages.value = messages.value.filter(m => m.id !== data.data.message_id)
         pinnedMessages.value = pinnedMessages.value.filter(m => m.id !== data.data.message_id)
+        //replies keep their quote, the server tombstones it the same way
+        for (const m of [...messages.value, ...pinnedMessages.value]) {
+          if (m.reply_to?.id === data.data.message_id) {
+            m.reply_to = { ...m.reply_to, content: null, attachment_only: false, deleted: true }
+          }
+        }
         break
       
       case 'chat_cleared':
         messages.value = []
         pinnedMessages.value = []
         break
+      
+      case 'purge_started':
+      case 'purge_progress': {
+        //a /clear already emptied the view, retention hides everything behind its cutoff
+        if (data.data.reason === 'clear') break
+        const cutoff = new Date(data.data.before)
+        messages.value = messages.value.filter(m => new Date(m.created_at) > cutoff)
+        pinnedMessages.value = pinnedMessages.value.filter(m => new Date(m.created_at) > cutoff)
+        break
+      }
+      
+      case 'attachments_updated': {
+        //renditions of a direct upload are processed after the post
+        const { id, attachments } = data.data
+        for (const list of [messages.value, pinnedMessages.value]) {
+          const msg = list.find(m => m.id === id)
+          if (msg) msg.attachments = attachments
+        }
+        break
+      }
+
+      case 'resync_required':
+        //we fell out of the server's replay window, or reconnected to another
+        //worker (replay buffers are per worker) => reload from scratch
+        fetchMessages()
+        break
 
       case 'message_pinned_update': {
         const { message_id, is_pinned } = data.data
@@ -314,38 +460,41 @@ export const useChatStore = defineStore('chat', () => {
       }
 
       case 'reaction_added':
+        if (data.data.user_id === authStore.user?.id) setMyReaction(data.data.message_id, data.data.emoji, true)
         updateMessageReaction(data.data.message_id, data.data.emoji, data.data.username, data.data.avatar, 'add', data.data.custom_emoji_url)
         break
         
       case 'reaction_removed':
+        if (data.data.user_id === authStore.user?.id) setMyReaction(data.data.message_id, data.data.emoji, false)
         updateMessageReaction(data.data.message_id, data.data.emoji, data.data.username, data.data.avatar, 'remove', data.data.custom_emoji_url)
         break
         
-      case 'user_join':
+      case 'presence_delta': {
+        //joins/leaves batched by the server every couple of seconds
         onlineCount.value = data.data.online_count
-        //check if user already in list (shouldnt be => but just in case)
-        if (!onlineUsers.value.find(u => u.user_id === data.data.user_id)) {
-          onlineUsers.value.push({
-            user_id: data.data.user_id,
-            username: data.data.username,
-            avatar: data.data.avatar,
-            is_admin: data.data.is_admin,
-          })
+        const left = new Set(data.data.left)
+        const users = onlineUsers.value.filter(u => !left.has(u.user_id))
+        for (const joined of data.data.joined) {
+          if (!users.find(u => u.user_id === joined.user_id)) {
+            users.push(joined)
+          }
         }
+        onlineUsers.value = users
         break
+      }
         
-      case 'user_leave':
-        onlineCount.value = data.data.online_count
-        onlineUsers.value = onlineUsers.value.filter(u => u.user_id !== data.data.user_id)
+      case 'typing_state':
+        //the server sends the full set of typists whenever it changes
+        typingUsers.value = data.data.users.map(u => u.username)
         break
         
-      case 'typing':
-        if (!typingUsers.value.includes(data.data.username)) {
-          typingUsers.value.push(data.data.username)
-          setTimeout(() => {
-            typingUsers.value = typingUsers.value.filter(u => u !== data.data.username)
-          }, 3000)
-        }
+      case 'token_refresh':
+        authStore.setToken(data.data.token)
+        break
+        
+      case 'ping':
+        //server heartbeat => sockets that stay silent get reaped
+        ws.value?.send(JSON.stringify({ type: 'pong' }))
         break
         
       case 'user_avatar_changed': {
@@ -471,10 +620,14 @@ export const useChatStore = defineStore('chat', () => {
     uploadCustomEmoji,
     deleteCustomEmoji,
     fetchMessages,
+    fetchOlderMessages,
     sendMessage,
     deleteMessage,
     pinMessage,
     toggleReaction,
+    myReactions,
+    hasReacted,
+    fetchReactionUsers,
     searchGifs,
     getTrendingGifs,
     connectWebSocket,